@@ -0,0 +1,436 @@
+#!/usr/bin/python
+
+# Cole L - https://github.com/cole8888/SRNE-Solar-Charge-Controller-Monitor
+#
+# Measure what each step of a poll cycle costs, no charge controller needed.
+#
+# Every benchmark runs one operation (decode the registers, build the JSON, render the text, publish, ...) many times
+# and reports operations per second, the median and 99th percentile time of a single operation and how much memory
+# one operation allocates at its peak. The original implementations of the JSON, text, fault and temperature code
+# are kept below as "legacy" benchmarks, so the numbers can be compared against where the scripts started.
+#
+#   python3 SolarBenchmark.py                          Run everything.
+#   python3 SolarBenchmark.py --filter json            Only the benchmarks with "json" in their name.
+#   python3 SolarBenchmark.py --save before.json      Save the results...
+#   python3 SolarBenchmark.py --compare before.json    ...and later compare against them, exits with 1 on a regression.
+#
+# The MQTT benchmarks publish to a stand-in broker on localhost (see StandInBroker) and need the paho-mqtt library.
+# Benchmarks whose libraries aren't installed are skipped.
+
+import argparse
+import contextlib
+import gc
+import json
+import socket
+import struct
+import sys
+import threading
+import time
+import tracemalloc
+from SolarDecoder import chargeModes, faultCodes, getRealTemp, decodeRegisters, decodeFaults, snapshotToDict, snapshotFromDict, snapshotToText, _TEMPERATURES
+from SolarEvents import EventDetector
+from SolarEnergy import EnergyAccounts
+from SolarDelta import DeltaPublisher, FULL, DELTA, FIELDS
+from SolarExporter import MetricsExporter
+from SolarFormats import Encoder, FORMATS, JSON_MIN
+from SolarSimulator import encodeRegisters
+
+# Registers the benchmarks decode, from JSON_Sample.json with two faults set.
+SAMPLE_VALUES = {
+    "batterySoc": 100, "batteryVolts": 28.2, "chargingAmps": 2.58, "controllerTemp": 21, "batteryTemp": 11,
+    "loadVolts": 28.2, "loadAmps": 0, "loadWatts": 0, "panelVolts": 86.1, "panelAmps": 0.88, "chargingWatts": 76,
+    "loadState": True, "batteryMinVolts": 24.4, "batteryMaxVolts": 29.9, "chargingMaxAmps": 8.46, "loadMaxAmps": 0,
+    "chargingMaxWatts": 251, "loadMaxWatts": 0, "chargingDailyAmpHours": 25, "loadDailyAmpHours": 0,
+    "chargingDailyPower": 0.715, "loadDailyPower": 0, "days": 1002, "overDischarges": 6, "fullCharges": 1477,
+    "chargingTotalAmpHours": 51.734, "loadTotalAmpHours": 0.001, "chargingTotalPower": 1404.9, "loadTotalPower": 0.024,
+    "chargingMode": "FLOAT", "loadEnabled": True, "faultBits": 0x4008,
+}
+SAMPLE_REGISTERS = encodeRegisters(SAMPLE_VALUES)
+
+# pymodbus style response, what the legacy functions took.
+class _Response:
+    def __init__(self, registers):
+        self.registers = registers
+
+# Swallows everything printed, so the text benchmarks measure building the output rather than the terminal.
+class _NullWriter:
+    def write(self, text):
+        return len(text)
+
+    def flush(self):
+        pass
+
+# ---------------------------------------------------------------------------------------------------------------
+# Legacy implementations, as they were in SolarMonitor.py before the register map. Only used for comparison.
+
+def legacyFaults(faultID):
+    faults = []
+    count = 0
+    while(faultID != 0):
+        if(faultID >= pow(2, 15-count)):
+            faults.append(faultCodes[count-1])
+            faultID -= pow(2, 15-count)
+        count += 1
+    return faults
+
+def legacyTemperatures(register):
+    return getRealTemp(int(hex(register)[2:-2], 16)), getRealTemp(int(hex(register)[-2:], 16))
+
+def legacyConvertToJson(response):
+    loadOffset = 32768 if response.registers[32] > 6 else 0
+    faults = legacyFaults(response.registers[34])
+    nested_dict = {
+        "modbusError": False,
+        "controller": {
+            "chargingMode": chargeModes[response.registers[32]-loadOffset],
+            "temperature": getRealTemp(int(hex(response.registers[3])[2:-2], 16)),
+            "days": response.registers[21],
+            "overDischarges": response.registers[22],
+            "fullCharges": response.registers[23]
+        },
+        "charging": {
+            "amps": round(float(response.registers[2]*0.01), 2),
+            "maxAmps": round(float(response.registers[13]*0.01), 2),
+            "watts": response.registers[9],
+            "maxWatts": response.registers[15],
+            "dailyAmpHours": response.registers[17],
+            "totalAmpHours": round(float((response.registers[24]*65536 + response.registers[25])*0.001), 3),
+            "dailyPower": round(float(response.registers[19]*0.001), 3),
+            "totalPower": round(float((response.registers[28]*65536 + response.registers[29])*0.001), 3)
+        },
+        "battery": {
+            "stateOfCharge": response.registers[0],
+            "volts": round(float(response.registers[1]*0.1), 1),
+            "minVolts": round(float(response.registers[11]*0.1), 1),
+            "maxVolts": round(float(response.registers[12]*0.1), 1),
+            "temperature": getRealTemp(int(hex(response.registers[3])[-2:], 16))
+        },
+        "panels": {
+            "volts": round(float(response.registers[7]*0.1), 1),
+            "amps": round(float(response.registers[8]*0.01), 2)
+        },
+        "load": {
+            "state": True if response.registers[10] else False,
+            "volts": round(float(response.registers[4]*0.1), 1),
+            "amps": round(float(response.registers[5]*0.01), 2),
+            "watts": response.registers[6],
+            "maxAmps": response.registers[14]*0.01,
+            "maxWatts": response.registers[16],
+            "dailyAmpHours": response.registers[18],
+            "totalAmpHours": round(float((response.registers[26]*65536 + response.registers[27])*0.001), 3),
+            "dailyPower": round(float(response.registers[20]*0.001), 3),
+            "totalPower": str(round(float((response.registers[30]*65536 + response.registers[31])*0.001), 3))
+        },
+        "faults": faults
+    }
+    return json.dumps(nested_dict, indent=4)
+
+def legacyPrintDataText(response):
+    loadOffset = 32768 if response.registers[32] > 6 else 0
+    chargeMode = chargeModes[response.registers[32]-loadOffset]
+    faults = "None :)"
+    faultID = response.registers[34]
+    if(faultID != 0):
+        faults = ""
+        count = 0
+        while(faultID != 0):
+            if(faultID >= pow(2, 15-count)):
+                if(count > 0):
+                    faults += '\n'
+                faults += '- ' + faultCodes[count-1]
+                faultID -= pow(2, 15-count)
+            count += 1
+    print("\n------------- Real Time Data -------------")
+    print("Charging Mode:\t\t\t" + chargeMode)
+    print("Battery SOC:\t\t\t" + str(response.registers[0]) + "%")
+    print("Battery Voltage:\t\t" + str(round(float(response.registers[1]*0.1), 1)) + "V")
+    print("Battery Charge Current:\t\t" + str(round(float(response.registers[2]*0.01), 2)) + "A")
+    print("Controller Temperature:\t\t" + str(getRealTemp(int(hex(response.registers[3])[2:-2], 16))) + "*C")
+    print("Battery Temperature:\t\t" + str(getRealTemp(int(hex(response.registers[3])[-2:], 16))) + "*C")
+    print("Load Voltage:\t\t\t" + str(round(float(response.registers[4]*0.1), 1)) + " V")
+    print("Load Current:\t\t\t" + str(round(float(response.registers[5]*0.01), 2)) + " A")
+    print("Load Power:\t\t\t" + str(response.registers[6]) + " Watts")
+    print("Load Enabled:\t\t\t" + str(response.registers[32] > 6))
+    print("Panel Volts:\t\t\t" + str(round(float(response.registers[7]*0.1), 1)) + "V")
+    print("Panel Amps:\t\t\t" + str(round(float(response.registers[8]*0.01), 2)) + "A")
+    print("Panel Power:\t\t\t" + str(response.registers[9]) + "W")
+    print("--------------- DAILY DATA ---------------")
+    print("Battery Minimum Voltage:\t" + str(round(float(response.registers[11]*0.1), 1)) + "V")
+    print("Battery Maximum Voltage:\t" + str(round(float(response.registers[12]*0.1), 1)) + "V")
+    print("Maximum Charge Current:\t\t" + str(round(float(response.registers[13]*0.01), 2)) + "A")
+    print("Maximum Charge Power:\t\t" + str(response.registers[15]) + "W")
+    print("Maximum Load Discharge Current:\t" + str(float(response.registers[14])*0.01) + "A")
+    print("Maximum Load Discharge Power:\t" + str(response.registers[16]) + "W")
+    print("Charge Amp Hours:\t\t" + str(response.registers[17]) + "Ah")
+    print("Charge Power:\t\t\t" + str(round(float(response.registers[19]*0.001), 3)) + "KWh")
+    print("Load Amp Hours:\t\t\t" + str(response.registers[18]) + "Ah")
+    print("Load Power:\t\t\t" + str(round(float(response.registers[20]*0.001), 3)) + "KWh")
+    print("------------- LIFETIME DATA --------------")
+    print("Days Operational:\t\t" + str(response.registers[21]) + " Days")
+    print("Times Over Discharged:\t\t" + str(response.registers[22]))
+    print("Times Fully Charged:\t\t" + str(response.registers[23]))
+    print("Cumulative Amp Hours:\t\t" + str(round(float((response.registers[24]*65536 + response.registers[25])*0.001), 3)) + "KAh")
+    print("Cumulative Power:\t\t" + str(round(float((response.registers[28]*65536 + response.registers[29])*0.001), 3)) + "KWh")
+    print("Load Amp Hours:\t\t\t" + str(round(float((response.registers[26]*65536 + response.registers[27])*0.001), 3)) + "KAh")
+    print("Load Power:\t\t\t" + str(round(float((response.registers[30]*65536 + response.registers[31])*0.001), 3)) + "KWh")
+    print("------------------------------------------")
+    print("--------------- FAULT DATA ---------------")
+    print(faults)
+    print("RAW Fault Data:\t\t\t" + str(response.registers[34]))
+    print("------------------------------------------")
+
+# ---------------------------------------------------------------------------------------------------------------
+# Stand-in MQTT broker.
+
+# Just enough of an MQTT 3.1.1 broker to benchmark publishing: it accepts connections, acknowledges QoS 1 messages
+# and counts what it receives. Nothing is delivered to subscribers.
+class StandInBroker:
+    def __init__(self, host="127.0.0.1", port=0):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((host, port))
+        self.server.listen(4)
+        self.host, self.port = self.server.getsockname()
+        self.messages = 0
+        self.bytes = 0
+        self.running = True
+        threading.Thread(target=self._accept, name="stand-in-broker", daemon=True).start()
+
+    def _accept(self):
+        while self.running:
+            try:
+                connection, address = self.server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(connection,), daemon=True).start()
+
+    @staticmethod
+    def _readExactly(connection, size):
+        data = b""
+        while len(data) < size:
+            chunk = connection.recv(size - len(data))
+            if(not chunk):
+                raise EOFError
+            data += chunk
+        return data
+
+    def _serve(self, connection):
+        with connection:
+            try:
+                while True:
+                    header = self._readExactly(connection, 1)[0]
+                    # Remaining length is a variable length integer, 7 bits per byte.
+                    length = 0
+                    shift = 0
+                    while True:
+                        byte = self._readExactly(connection, 1)[0]
+                        length |= (byte & 0x7F) << shift
+                        shift += 7
+                        if(not byte & 0x80):
+                            break
+                    body = self._readExactly(connection, length) if length else b""
+                    packetType = header >> 4
+                    if(packetType == 1):        # CONNECT
+                        connection.sendall(b"\x20\x02\x00\x00")
+                    elif(packetType == 3):      # PUBLISH
+                        self.messages += 1
+                        self.bytes += length
+                        if((header >> 1) & 3):
+                            topicLength = struct.unpack(">H", body[:2])[0]
+                            connection.sendall(b"\x40\x02" + body[2 + topicLength:4 + topicLength])
+                    elif(packetType == 12):     # PINGREQ
+                        connection.sendall(b"\xd0\x00")
+                    elif(packetType == 14):     # DISCONNECT
+                        return
+            except (EOFError, OSError):
+                return
+
+    def close(self):
+        self.running = False
+        self.server.close()
+
+# Collects publishes in memory, to benchmark the publishing code without a network.
+class _MemoryClient:
+    def __init__(self):
+        self.messages = 0
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        self.messages += 1
+        return (0, self.messages)
+
+# ---------------------------------------------------------------------------------------------------------------
+# Harness.
+
+# Time func over the given number of iterations.
+# Returns a dictionary with opsPerSec, p50Us and p99Us (microseconds) and peakBytes (memory allocated by one call).
+def measure(func, iterations=5000, warmup=200):
+    for i in range(min(warmup, iterations)):
+        func()
+    gc.collect()
+    perf = time.perf_counter_ns
+    timings = [0]*iterations
+    for i in range(iterations):
+        start = perf()
+        func()
+        timings[i] = perf() - start
+    total = sum(timings)
+    timings.sort()
+
+    # Peak memory of a single call, averaged over a sample of calls. Run separately since tracing slows everything down.
+    samples = min(iterations, 200)
+    peak = 0
+    tracemalloc.start()
+    try:
+        for i in range(samples):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            func()
+            peak += tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "iterations": iterations,
+        "opsPerSec": round(iterations/(total/1e9), 1) if total else float("inf"),
+        "p50Us": round(timings[iterations//2]/1000, 2),
+        "p99Us": round(timings[min(iterations - 1, iterations*99//100)]/1000, 2),
+        "peakBytes": peak//samples,
+    }
+
+# The benchmarks as (name, setup) pairs. setup() returns the function to time, plus an optional cleanup function.
+# Raising ImportError from setup skips the benchmark.
+def benchmarks():
+    response = _Response(SAMPLE_REGISTERS)
+    snapshot = decodeRegisters(SAMPLE_REGISTERS)
+    null = _NullWriter()
+
+    def printing(func):
+        def run():
+            with contextlib.redirect_stdout(null):
+                func()
+        return run
+
+    yield "faults: legacy pow loop", lambda: (lambda: legacyFaults(SAMPLE_REGISTERS[34]),)
+    yield "faults: decodeFaults", lambda: (lambda: decodeFaults(SAMPLE_REGISTERS[34]),)
+    def events():
+        detector = EventDetector()
+        detector.check("CC1", snapshot)
+        return (lambda: detector.check("CC1", snapshot),)
+    yield "events: check (nothing changed)", events
+    def energy():
+        accounts = EnergyAccounts()
+        accounts.update("CC1", snapshot)
+        return (lambda: accounts.update("CC1", snapshot),)
+    yield "energy: update", energy
+    yield "temperature: legacy hex parsing", lambda: (lambda: legacyTemperatures(SAMPLE_REGISTERS[3]),)
+    yield "temperature: lookup table", lambda: (lambda: (_TEMPERATURES[SAMPLE_REGISTERS[3] >> 8], _TEMPERATURES[SAMPLE_REGISTERS[3] & 0xFF]),)
+    yield "decode: decodeRegisters", lambda: (lambda: decodeRegisters(SAMPLE_REGISTERS, 1, 0),)
+    yield "json: legacy convertToJson", lambda: (lambda: legacyConvertToJson(response),)
+    yield "json: decode + snapshotToDict + dumps", lambda: (lambda: json.dumps(snapshotToDict(decodeRegisters(SAMPLE_REGISTERS, 1, 0)), indent=4),)
+    document = json.dumps(snapshotToDict(snapshot)).encode()
+    yield "ingest: json.loads + snapshotFromDict", lambda: (lambda: snapshotFromDict(json.loads(document), 1, 0),)
+    def ingestOrjson():
+        import orjson
+        return (lambda: snapshotFromDict(orjson.loads(document), 1, 0),)
+    yield "ingest: orjson.loads + snapshotFromDict", ingestOrjson
+    for payloadFormat in FORMATS:
+        def setup(payloadFormat=payloadFormat):
+            encoder = Encoder(payloadFormat)
+            return (lambda: encoder.encode(snapshot),)
+        yield "encode: " + payloadFormat, setup
+    yield "text: legacy printDataText", lambda: (printing(lambda: legacyPrintDataText(response)),)
+    yield "text: print(snapshotToText)", lambda: (printing(lambda: print(snapshotToText(snapshot))),)
+
+    def exporter(devices=24):
+        metrics = MetricsExporter()
+        for index in range(devices):
+            metrics.update("CC%d" % index, decodeRegisters(SAMPLE_REGISTERS, index + 1, 0))
+        return metrics
+    yield "metrics: update (24 controllers)", lambda: (lambda metrics=exporter(): metrics.update("CC0", snapshot),)
+    yield "metrics: scrape (24 controllers)", lambda: (lambda metrics=exporter(): metrics.page("application/openmetrics-text"),)
+
+    for mode in (FULL, DELTA, FIELDS):
+        def setup(mode=mode):
+            publisher = DeltaPublisher(_MemoryClient(), "CC1", mode, encoder=Encoder(JSON_MIN))
+            return (lambda: publisher.publish(decodeRegisters(SAMPLE_REGISTERS, 1, 0)),)
+        yield "publish: %s to memory" % mode, setup
+
+    for qos in (0, 1):
+        def setup(qos=qos):
+            from paho.mqtt import client as mqtt_client
+            broker = StandInBroker()
+            client = mqtt_client.Client("SolarBenchmark")
+            client.connect(broker.host, broker.port)
+            client.loop_start()
+            payload = Encoder(JSON_MIN).encode(snapshot)
+            if(qos):
+                publish = lambda: client.publish("CC1", payload, qos=1).wait_for_publish()
+            else:
+                publish = lambda: client.publish("CC1", payload)
+            def cleanup():
+                client.loop_stop()
+                client.disconnect()
+                broker.close()
+            return publish, cleanup
+        yield "publish: paho QoS %d to stand-in broker" % qos, setup
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the decode, serialize and publish steps of a poll cycle.")
+    parser.add_argument("--filter", help="only run the benchmarks with this in their name")
+    parser.add_argument("--iterations", type=int, default=5000, help="operations timed per benchmark (default 5000)")
+    parser.add_argument("--save", help="save the results to this JSON file")
+    parser.add_argument("--compare", help="compare against results saved with --save")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="slowdown in ops/sec counted as a regression (default 0.15)")
+    parser.add_argument("--controllers", type=int, default=24, help="controllers to estimate the CPU use of (default 24)")
+    parser.add_argument("--interval", type=float, default=3, help="seconds between polls for the CPU estimate (default 3)")
+    args = parser.parse_args()
+
+    baseline = {}
+    if(args.compare):
+        with open(args.compare) as file:
+            baseline = json.load(file)["results"]
+
+    print("%-44s %12s %10s %10s %12s" % ("benchmark", "ops/sec", "p50 us", "p99 us", "peak bytes"))
+    results = {}
+    regressions = []
+    for name, setup in benchmarks():
+        if(args.filter and args.filter not in name):
+            continue
+        try:
+            prepared = setup()
+        except ImportError as e:
+            print("%-44s skipped (%s)" % (name, e))
+            continue
+        iterations = args.iterations if "paho" not in name else min(args.iterations, 1000)
+        try:
+            result = measure(prepared[0], iterations)
+        finally:
+            if(len(prepared) > 1):
+                prepared[1]()
+        results[name] = result
+        line = "%-44s %12.0f %10.2f %10.2f %12d" % (name, result["opsPerSec"], result["p50Us"], result["p99Us"], result["peakBytes"])
+        if(name in baseline):
+            change = result["opsPerSec"]/baseline[name]["opsPerSec"] - 1
+            line += "  %+6.1f%%" % (change*100)
+            if(change < -args.tolerance):
+                line += " REGRESSION"
+                regressions.append(name)
+        print(line)
+
+    # What a poll of one controller costs in CPU: decode, the JSON payload and a delta publish.
+    cycle = [results.get(name) for name in ("decode: decodeRegisters", "encode: " + JSON_MIN, "publish: DELTA to memory")]
+    if(all(cycle)):
+        perPoll = sum(1e6/result["opsPerSec"] for result in cycle)
+        share = perPoll/1e6*args.controllers/args.interval*100
+        print("\nAbout %.0f us of CPU per controller per poll, %d controllers every %gs use about %.2f%% of one core."
+              % (perPoll, args.controllers, args.interval, share))
+
+    if(args.save):
+        with open(args.save, "w") as file:
+            json.dump({"python": sys.version.split()[0], "time": time.time(), "results": results}, file, indent=4)
+    if(regressions):
+        print("\nSlower than %s by more than %.0f%%: %s" % (args.compare, args.tolerance*100, ", ".join(regressions)))
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+#!/usr/bin/python
+
+# Cole L - https://github.com/cole8888/SRNE-Solar-Charge-Controller-Monitor
+#
+# Burst capture: read the battery and PV registers as fast as the bus allows for a short window.
+#
+# The normal poll reads everything every few seconds, far too slow to see the MPPT tracking react to a passing
+# cloud. A burst reads only registers 0x0100 - 0x0109 (battery, load and panel values and the charging power) back
+# to back, one request after the other with no wait, for a set number of seconds. At 9600 baud that is roughly 15 to
+# 25 samples a second. The samples go into arrays that are allocated up front, so the capture loop does nothing but
+# read and copy, and the whole window is shipped as one batch at the end.
+#
+# The MQTT scripts start a burst when something is published to <topic>/burst/set (the payload is the number of
+# seconds, empty for the default) and publish the batch to <topic>/burst. Or run it on its own while the monitor
+# is stopped (the serial port can only be used by one program at a time):
+#   python3 SolarBurst.py --port /dev/ttyS0 --seconds 30 --out burst.json
+
+import argparse
+import json
+import math
+import time
+from array import array
+from SolarDecoder import BASE_ADDRESS, REGISTER_MAP, UNSIGNED
+
+# Registers read in a burst, counted from 0x0100.
+BURST_OFFSET = 0
+BURST_COUNT = 10
+
+# A burst is never longer than this many seconds, so a bad command can't stop the normal polling for long.
+MAX_SECONDS = 300
+
+# Space is allocated for this many samples a second, more than a 9600 baud bus can manage.
+MAX_RATE = 50
+
+# Give up on a burst after this many failed reads in a row.
+MAX_ERRORS = 5
+
+# The plain values (not the temperatures) in the burst registers, as (name, offset in the burst, scale, digits).
+BURST_FIELDS = tuple(
+    (register.name, register.address - BASE_ADDRESS - BURST_OFFSET, register.scale, register.digits)
+    for register in REGISTER_MAP
+    if register.kind == UNSIGNED and register.words == 1
+    and BURST_OFFSET <= register.address - BASE_ADDRESS < BURST_OFFSET + BURST_COUNT
+)
+
+# Turn the payload of a burst command into a number of seconds, None if it isn't one.
+def parseSeconds(payload, default=10):
+    if(isinstance(payload, bytes)):
+        payload = payload.decode("utf-8", "replace")
+    payload = payload.strip()
+    if(not payload):
+        return default
+    try:
+        seconds = float(payload)
+    except ValueError:
+        return None
+    if(not math.isfinite(seconds) or seconds <= 0):
+        return None
+    return min(seconds, MAX_SECONDS)
+
+# One burst capture.
+# seconds: Length of the window.
+# rate:    Samples a second to allocate space for, the capture stops early if the arrays fill up.
+class Burst:
+    def __init__(self, seconds=10, rate=MAX_RATE):
+        self.seconds = min(seconds, MAX_SECONDS)
+        self.capacity = max(1, int(self.seconds*rate))
+        self.registers = array("H", bytes(2*self.capacity*BURST_COUNT))
+        self.times = array("d", bytes(8*self.capacity))
+        self.samples = 0
+        self.errors = 0
+        self.lastError = None
+        self.started = None     # Wall clock time of the first request.
+        self.duration = 0.0
+
+    # Read the burst registers back to back until the window is over.
+    # read(address, count, unit) returns the register values, e.g. ModbusConnection.read (see SolarConnection.py).
+    def capture(self, read, unit=1):
+        address = BASE_ADDRESS + BURST_OFFSET
+        registers = self.registers
+        times = self.times
+        clock = time.monotonic
+        failures = 0
+        self.started = time.time()
+        start = clock()
+        end = start + self.seconds
+        now = start
+        while now < end and self.samples < self.capacity:
+            try:
+                values = read(address, BURST_COUNT, unit)
+            except Exception as e:
+                self.errors += 1
+                self.lastError = e
+                failures += 1
+                if(failures >= MAX_ERRORS):
+                    break
+                now = clock()
+                continue
+            failures = 0
+            now = clock()
+            index = self.samples
+            base = index*BURST_COUNT
+            registers[base:base+BURST_COUNT] = array("H", values)
+            times[index] = now - start
+            self.samples = index + 1
+        self.duration = clock() - start
+        return self
+
+    # Samples a second actually managed.
+    def rate(self):
+        return self.samples/self.duration if self.duration else 0.0
+
+    # The values of one field for every sample.
+    def column(self, offset, scale=1, digits=0):
+        values = self.registers[offset:self.samples*BURST_COUNT:BURST_COUNT]
+        if(scale == 1):
+            return values.tolist()
+        return [round(value*scale, digits) for value in values]
+
+    # The batch as a dictionary of columns, "t" is the seconds since the start of each sample.
+    def toDict(self, device=None, unit=1):
+        batch = {
+            "device": device,
+            "unit": unit,
+            "start": self.started,
+            "seconds": round(self.duration, 3),
+            "samples": self.samples,
+            "rate": round(self.rate(), 2),
+            "errors": self.errors,
+            "t": [round(value, 4) for value in self.times[:self.samples]],
+        }
+        for name, offset, scale, digits in BURST_FIELDS:
+            batch[name] = self.column(offset, scale, digits)
+        return batch
+
+def main():
+    parser = argparse.ArgumentParser(description="Read the battery and PV registers as fast as the bus allows for a short window.")
+    parser.add_argument("--port", default="/dev/ttyS0", help="serial device the charge controller is connected to (default /dev/ttyS0)")
+    parser.add_argument("--unit", type=int, default=1, help="modbus unit ID (default 1)")
+    parser.add_argument("--seconds", type=float, default=10, help="length of the burst in seconds (default 10, at most %d)" % MAX_SECONDS)
+    parser.add_argument("--out", help="write the batch to this JSON file instead of printing it")
+    args = parser.parse_args()
+
+    from SolarConnection import ModbusConnection
+    modbus = ModbusConnection(args.port, baudrate=9600, timeout=1)
+    try:
+        burst = Burst(args.seconds).capture(modbus.read, args.unit)
+    finally:
+        modbus.close()
+    batch = burst.toDict(args.port, args.unit)
+    print("%d samples in %.1fs (%.1f a second), %d errors" % (burst.samples, burst.duration, burst.rate(), burst.errors))
+    if(args.out):
+        with open(args.out, "w") as file:
+            json.dump(batch, file)
+    else:
+        print(json.dumps(batch))
+
+if __name__ == "__main__":
+    main()
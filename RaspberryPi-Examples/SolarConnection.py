@@ -0,0 +1,235 @@
+#!/usr/bin/python
+
+# Cole L - https://github.com/cole8888/SRNE-Solar-Charge-Controller-Monitor
+#
+# Look after the modbus connection to the charge controller.
+#
+# Not every failed read means the port is gone. A timeout or a corrupted reply (bad CRC) is usually a one off, so
+# the read is simply tried again on the same port. Only when the port itself fails (unplugged USB adapter, serial
+# error) or a controller keeps timing out while nothing else on the port answers either is the port closed and opened
+# again. One controller that stopped answering on a shared RS485 bus doesn't disturb the others. Reopening is retried with a jittered
+# exponential backoff instead of blocking, so the poll loop keeps its schedule and reports errors in the meantime.
+#
+# The connection also keeps track of its health (see health()) so it can be shown or published.
+
+import random
+import sys
+import time
+from SolarStats import Histogram, LATENCY_BUCKETS, RECONNECT_BUCKETS
+
+# Kinds of failures.
+TIMEOUT = "timeout"     # The controller didn't answer in time.
+CRC = "crc"             # The answer was corrupted.
+PORT = "port"           # The serial port failed or couldn't be opened.
+DEVICE = "device"       # The controller answered with a modbus error.
+
+# Health states.
+CONNECTED = "connected"
+DEGRADED = "degraded"           # Connected, but the last read(s) failed.
+DISCONNECTED = "disconnected"   # The port is closed and waiting to be reopened.
+
+# Raised when a read fails, kind is one of the failure kinds above.
+class ModbusReadError(IOError):
+    def __init__(self, kind, message):
+        IOError.__init__(self, message)
+        self.kind = kind
+
+# pymodbus is by far the slowest import, so it is only imported when the first port is opened.
+def _modbusClient(**settings):
+    from pymodbus.client.sync import ModbusSerialClient
+    return ModbusSerialClient(**settings)
+
+# The pymodbus exception types, empty if pymodbus hasn't been imported (e.g. only simulated controllers are used).
+def _modbusExceptions():
+    exceptions = sys.modules.get("pymodbus.exceptions")
+    if(exceptions is None):
+        return (), ()
+    return exceptions.ConnectionException, exceptions.ModbusIOException
+
+# Work out what kind of failure an exception (or error response) is.
+def classifyError(error):
+    ConnectionException, ModbusIOException = _modbusExceptions()
+    message = str(error).lower()
+    if(isinstance(error, (ConnectionException, OSError))):
+        return PORT
+    if("crc" in message):
+        return CRC
+    if(isinstance(error, ModbusIOException) or "no response" in message or "timeout" in message or "timed out" in message):
+        return TIMEOUT
+    return DEVICE
+
+# port:         Serial device the controller(s) are connected to.
+# retries:      Number of times a read that timed out or had a bad CRC is tried again on the same port.
+# reopenAfter:  Number of failed reads in a row of a unit after which the port is reopened anyway, unless another unit
+#               answered in the meantime.
+# backoffStart: Seconds to wait before the first attempt to reopen the port, doubled on every failed attempt...
+# backoffMax:   ...up to this many seconds. A random part of the wait is taken off so several ports don't retry in step.
+# clientFactory: Makes the modbus client, takes the same arguments as ModbusSerialClient. (e.g. SimulatedBus.client in SolarSimulator.py)
+class ModbusConnection:
+    def __init__(self, port='/dev/ttyS0', baudrate=9600, timeout=5, retries=1, reopenAfter=3, backoffStart=0.5, backoffMax=60, clientFactory=None):
+        self.port = port
+        self.clientFactory = _modbusClient if clientFactory is None else clientFactory
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.retries = retries
+        self.reopenAfter = reopenAfter
+        self.backoffStart = backoffStart
+        self.backoffMax = backoffMax
+        self.client = None
+        self.state = DISCONNECTED
+        self.failures = {}              # Failed reads in a row by unit ID, units that last answered are left out.
+        self.failingSince = {}          # Monotonic time of the first failure in a row by unit ID.
+        self.lastAnswer = None          # Monotonic time of the last successful request on the port.
+        self.openAttempts = 0           # Failed attempts to open the port in a row.
+        self.nextOpen = 0               # Monotonic time the port may be opened again.
+        self.lostAt = None              # Monotonic time the port was lost, to time reconnects.
+        self.errors = {TIMEOUT: 0, CRC: 0, PORT: 0, DEVICE: 0}
+        self.reads = 0
+        self.writes = 0
+        self.retried = 0
+        self.reconnects = 0
+        self.lastReconnectDuration = None
+        self.lastError = None
+        self.lastSuccess = None
+        self.busy = 0.0                 # Seconds spent on requests, for the bus utilization.
+        self.latency = {}               # Round trip times of successful reads by unit ID.
+        self.reconnectTimes = Histogram(RECONNECT_BUCKETS)
+
+    # Open the port if it isn't already. Raises ModbusReadError while backing off or if it can't be opened.
+    def open(self):
+        if(self.client is not None):
+            return
+        now = time.monotonic()
+        if(now < self.nextOpen):
+            raise ModbusReadError(PORT, "%s unavailable, retrying in %.1f seconds" % (self.port, self.nextOpen - now))
+        if(self.lostAt is None):
+            self.lostAt = now
+        client = self.clientFactory(method='rtu', port=self.port, baudrate=self.baudrate, stopbits = 1, bytesize = 8, parity = 'N', timeout = self.timeout)
+        try:
+            connected = client.connect()
+        except Exception:
+            connected = False
+        if(not connected):
+            client.close()
+            self.openAttempts += 1
+            self.errors[PORT] += 1
+            self.nextOpen = now + self.backoff()
+            raise ModbusReadError(PORT, "Failed to open " + self.port)
+        self.client = client
+        self.openAttempts = 0
+        # Start counting again, so the first timeout after reopening doesn't drop the port straight away.
+        self.failures.clear()
+        self.failingSince.clear()
+        self.state = CONNECTED
+        if(self.reads or self.writes):
+            self.reconnects += 1
+            self.lastReconnectDuration = time.monotonic() - self.lostAt
+            self.reconnectTimes.observe(self.lastReconnectDuration)
+        self.lostAt = None
+
+    # Seconds to wait before the next attempt to open the port.
+    def backoff(self):
+        delay = min(self.backoffMax, self.backoffStart*(2 ** (self.openAttempts - 1)))
+        return random.uniform(delay/2, delay)
+
+    def close(self):
+        if(self.client is not None):
+            self.client.close()
+            self.client = None
+        self.state = DISCONNECTED
+
+    # Close the port because it failed, it is opened again on the next read (after the backoff).
+    def _drop(self):
+        self.close()
+        self.lostAt = time.monotonic()
+        self.openAttempts += 1
+        self.nextOpen = self.lostAt + self.backoff()
+
+    # One request, request(client) makes the pymodbus call and returns its response.
+    def _requestOnce(self, request):
+        try:
+            response = request(self.client)
+        except Exception as e:
+            raise ModbusReadError(classifyError(e), str(e))
+        if(response.isError()):
+            raise ModbusReadError(classifyError(response), str(response))
+        return response
+
+    # Send a request with the retries and error handling described at the top, returns the response.
+    def _transact(self, request, unit, write=False):
+        self.open()
+        if(write):
+            self.writes += 1
+        else:
+            self.reads += 1
+        attempt = 0
+        while True:
+            started = time.monotonic()
+            try:
+                response = self._requestOnce(request)
+            except ModbusReadError as e:
+                self.busy += time.monotonic() - started
+                self.errors[e.kind] += 1
+                self.lastError = e
+                # Timeouts and corrupted replies are worth another go on the same port.
+                if(e.kind in (TIMEOUT, CRC) and attempt < self.retries):
+                    attempt += 1
+                    self.retried += 1
+                    continue
+                count = self.failures[unit] = self.failures.get(unit, 0) + 1
+                if(count == 1):
+                    self.failingSince[unit] = started
+                self.state = DEGRADED
+                if(e.kind == PORT or (e.kind != DEVICE and self._portSilent(unit))):
+                    self._drop()
+                raise
+            elapsed = time.monotonic() - started
+            self.busy += elapsed
+            if(not write):
+                histogram = self.latency.get(unit)
+                if(histogram is None):
+                    histogram = self.latency[unit] = Histogram(LATENCY_BUCKETS)
+                histogram.observe(elapsed)
+            self.failures.pop(unit, None)
+            self.failingSince.pop(unit, None)
+            self.lastAnswer = time.monotonic()
+            self.state = CONNECTED
+            self.lastSuccess = time.time()
+            return response
+
+    # Has the unit failed reopenAfter times in a row with nothing else on the port answering since? If another unit
+    # still answers, the port is fine and only this controller is gone.
+    def _portSilent(self, unit):
+        if(self.failures[unit] < self.reopenAfter):
+            return False
+        return self.lastAnswer is None or self.lastAnswer < self.failingSince[unit]
+
+    # Read holding registers, returns the list of register values or raises ModbusReadError.
+    def read(self, address, count, unit=1):
+        return self._transact(lambda client: client.read_holding_registers(address, count, unit=unit), unit).registers
+
+    # Write holding registers starting at address, raises ModbusReadError if the controller doesn't confirm it.
+    # A single register is written with function 0x06, several with function 0x10 in one request.
+    # Writing the same values twice does no harm, so a write that timed out is retried like a read.
+    def write(self, address, values, unit=1):
+        if(len(values) == 1):
+            request = lambda client: client.write_register(address, values[0], unit=unit)
+        else:
+            request = lambda client: client.write_registers(address, list(values), unit=unit)
+        self._transact(request, unit, write=True)
+
+    # Summary of the connection's health, e.g. for publishing alongside the data.
+    def health(self):
+        return {
+            "port": self.port,
+            "state": self.state,
+            "consecutiveFailures": max(self.failures.values(), default=0),
+            "reads": self.reads,
+            "writes": self.writes,
+            "retries": self.retried,
+            "errors": dict(self.errors),
+            "reconnects": self.reconnects,
+            "lastReconnectSeconds": None if self.lastReconnectDuration is None else round(self.lastReconnectDuration, 3),
+            "lastError": None if self.lastError is None else str(self.lastError),
+            "lastSuccess": self.lastSuccess,
+        }
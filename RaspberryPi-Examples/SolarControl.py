@@ -0,0 +1,160 @@
+#!/usr/bin/python
+
+# Cole L - https://github.com/cole8888/SRNE-Solar-Charge-Controller-Monitor
+#
+# Change settings on the charge controller: switch the load on or off, or change the battery and charging settings.
+#
+# Writes don't go out straight away. They are queued per controller in a ControlQueue, and the poll loop sends them
+# right after its next read of that controller, on the same connection. So a write never collides with a read and
+# the polling keeps its schedule (a write costs one or two requests). Several changes to the same setting before
+# then are merged, only the last value is written. Settings at neighbouring addresses are written together in one
+# request (function 0x10), then read back to check the controller took them.
+#
+# The MQTT scripts take commands on <topic>/set as a JSON object of setting names and values, e.g.
+#   {"loadEnabled": false}    or    {"boostVolts": 14.4, "floatVolts": 13.8}
+# and publish the outcome to <topic>/set/result. From Python:
+#   control = ControlQueue()
+#   control.set({"loadEnabled": True}, onDone=print)
+#   control.flush(modbus, unit=1)
+#
+# The addresses of the battery settings are from the SRNE modbus document (SRNE-MODBUS.pdf). Voltages are in the
+# units the controller uses, check your model's document and the current values before writing charging voltages.
+# The ranges below only catch typos, the controller refuses (modbus exception) values it doesn't accept.
+
+import json
+import threading
+from collections import namedtuple
+
+# Writable setting.
+# address:  Absolute modbus address.
+# scale:    Multiplier from the raw register value to the value given in a command, like Register in SolarDecoder.py.
+# minimum / maximum: Range accepted in a command, in the scaled unit.
+Setting = namedtuple("Setting", ["name", "address", "scale", "minimum", "maximum"])
+
+SETTINGS = (
+    Setting("loadEnabled",                0x010A, 1,   0,   1),
+    Setting("batteryCapacity",            0xE002, 1,   1,   4000),  # Ah
+    Setting("overVoltsDisconnect",        0xE005, 0.1, 7,   70),
+    Setting("chargeLimitVolts",           0xE006, 0.1, 7,   70),
+    Setting("equalizeVolts",              0xE007, 0.1, 7,   70),
+    Setting("boostVolts",                 0xE008, 0.1, 7,   70),
+    Setting("floatVolts",                 0xE009, 0.1, 7,   70),
+    Setting("boostReturnVolts",           0xE00A, 0.1, 7,   70),
+    Setting("overDischargeReturnVolts",   0xE00B, 0.1, 7,   70),
+    Setting("underVoltsWarning",          0xE00C, 0.1, 7,   70),
+    Setting("overDischargeVolts",         0xE00D, 0.1, 7,   70),
+    Setting("dischargeLimitVolts",        0xE00E, 0.1, 7,   70),
+    Setting("overDischargeDelay",         0xE010, 1,   0,   120),   # Seconds
+    Setting("equalizeMinutes",            0xE011, 1,   0,   300),
+    Setting("boostMinutes",               0xE012, 1,   10,  300),
+    Setting("equalizeIntervalDays",       0xE013, 1,   0,   255),
+)
+
+SETTINGS_BY_NAME = {setting.name: setting for setting in SETTINGS}
+SETTINGS_BY_ADDRESS = {setting.address: setting for setting in SETTINGS}
+
+# Most registers written in one request.
+MAX_WRITE = 16
+
+# Turn a value from a command into the raw register value, raises ValueError if it isn't allowed.
+def toRaw(setting, value):
+    if(isinstance(value, str)):
+        text = value.strip().upper()
+        if(text in ("ON", "TRUE")):
+            value = 1
+        elif(text in ("OFF", "FALSE")):
+            value = 0
+        else:
+            try:
+                value = float(text)
+            except ValueError:
+                raise ValueError("%s: not a number: %r" % (setting.name, value))
+    if(value is None or not isinstance(value, (bool, int, float))):
+        raise ValueError("%s: not a number: %r" % (setting.name, value))
+    if(not setting.minimum <= value <= setting.maximum):
+        raise ValueError("%s: %s is outside %s - %s" % (setting.name, value, setting.minimum, setting.maximum))
+    return int(round(value/setting.scale))
+
+def fromRaw(setting, raw):
+    if(setting.scale == 1):
+        return raw
+    return round(raw*setting.scale, 3)
+
+# Turn the payload of a command into {name: value}, raises ValueError if it isn't a JSON object.
+def parseCommand(payload):
+    if(isinstance(payload, bytes)):
+        payload = payload.decode("utf-8", "replace")
+    try:
+        values = json.loads(payload)
+    except ValueError:
+        raise ValueError("Not JSON: %r" % payload)
+    if(not isinstance(values, dict) or not values):
+        raise ValueError("Expected an object of setting names and values, e.g. {\"loadEnabled\": false}")
+    return values
+
+# Addresses and raw values as runs of neighbouring registers [(address, [raw, ...]), ...].
+def writeRuns(writes):
+    runs = []
+    for address in sorted(writes):
+        if(runs and address == runs[-1][0] + len(runs[-1][1]) and len(runs[-1][1]) < MAX_WRITE):
+            runs[-1][1].append(writes[address])
+        else:
+            runs.append((address, [writes[address]]))
+    return runs
+
+# Writes waiting to go to one controller.
+class ControlQueue:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.writes = {}        # Address: raw value, later writes replace earlier ones.
+        self.callbacks = []
+
+    # Queue {name: value} to be written. Raises ValueError (and queues nothing) if a name or value isn't allowed.
+    # onDone(result) is called from the poll loop once the writes have been sent, see flush() for the result.
+    def set(self, values, onDone=None):
+        raws = {}
+        for name, value in values.items():
+            setting = SETTINGS_BY_NAME.get(name)
+            if(setting is None):
+                raise ValueError("Unknown setting %r, pick one of %s" % (name, ", ".join(SETTINGS_BY_NAME)))
+            raws[setting.address] = toRaw(setting, value)
+        with self.lock:
+            self.writes.update(raws)
+            if(onDone is not None):
+                self.callbacks.append(onDone)
+
+    def pending(self):
+        return bool(self.writes)
+
+    # Send the queued writes and read them back, from the thread that owns the connection.
+    # Returns (and hands to every onDone) {"ok": bool, "settings": {name: {"value", "readBack", "ok"}}, "errors": [...]}.
+    def flush(self, connection, unit=1):
+        with self.lock:
+            writes, self.writes = self.writes, {}
+            callbacks, self.callbacks = self.callbacks, []
+        if(not writes):
+            return None
+        result = {"ok": True, "settings": {}, "errors": []}
+        for address, raws in writeRuns(writes):
+            try:
+                connection.write(address, raws, unit)
+                readBack = connection.read(address, len(raws), unit)
+            except Exception as e:
+                result["ok"] = False
+                result["errors"].append("0x%04X: %s" % (address, e))
+                readBack = [None]*len(raws)
+            for offset, raw in enumerate(raws):
+                setting = SETTINGS_BY_ADDRESS[address + offset]
+                ok = readBack[offset] == raw
+                result["ok"] = result["ok"] and ok
+                result["settings"][setting.name] = {
+                    "value": fromRaw(setting, raw),
+                    "readBack": None if readBack[offset] is None else fromRaw(setting, readBack[offset]),
+                    "ok": ok,
+                }
+        for callback in callbacks:
+            try:
+                callback(result)
+            except Exception as e:
+                print("Write callback failed:", e)
+        return result
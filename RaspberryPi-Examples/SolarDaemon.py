@@ -0,0 +1,484 @@
+#!/usr/bin/python
+
+# Cole L - https://github.com/cole8888/SRNE-Solar-Charge-Controller-Monitor
+#
+# Run everything from one configuration file instead of editing the constants at the top of a script.
+#
+#   python3 SolarDaemon.py SolarDaemon.example.json
+#   python3 SolarDaemon.py SolarDaemon.example.json --simulate     (simulated controllers, see SolarSimulator.py)
+#
+# The file lists the controllers (any number, on any number of serial ports) and the outputs: console, MQTT,
+# history file, rollups, energy totals, Prometheus metrics, events, stats and burst commands. See SolarDaemon.example.json, every
+# setting that is left out gets the default below.
+#
+# Only the modules the configuration needs are imported (paho for MQTT, sqlite for the history file, ...), and the
+# MQTT broker is connected to in the background, so the first reads go out a fraction of a second after starting.
+# pymodbus itself is only imported when the first port is opened (see SolarConnection.py).
+#
+# Send SIGHUP (systemctl reload, kill -HUP) to reload the file without restarting. Reads that are in progress are
+# finished, controllers whose settings didn't change keep their schedule, and outputs whose settings didn't change
+# (the MQTT connection, history file, metrics port, ...) are kept open. Readings already queued for the old outputs
+# are still handled by them. The serial settings (baud rate and timeout) only change on a restart.
+
+import asyncio
+import json
+import signal
+import sys
+import time
+from SolarPipeline import Pipeline, Sink
+from SolarPoller import Device, Poller
+
+# Everything that can be set in the file, with the values used when it is left out.
+DEFAULTS = {
+    "serial": {"baudrate": 9600, "timeout": 5},
+    "devices": [],
+    "console": "TEXT",                      # "TEXT", one of the formats in SolarFormats.py, or null for no console output.
+    "mqtt": None,                           # See MQTT_DEFAULTS, null to not use a broker.
+    "history": None,                        # {"file": "solar-history.db", "retentionDays": 30}
+    "metricsPort": None,
+    "rollups": [],                          # "minute", "hour", "day"
+    "energy": None,                         # {"file": "solar-energy.json", "interval": 60}, running totals per controller and for the site.
+    "events": {"socThresholds": [20, 50, 90]},
+    "statsInterval": 60,
+    "burstSeconds": 10,                     # Default length of a burst started over MQTT, null to ignore burst commands.
+    "writes": False,                        # Take setting changes on <name>/set and write them to the controller. (See SolarControl.py)
+}
+
+MQTT_DEFAULTS = {
+    "host": "192.168.2.50",
+    "port": 1883,
+    "user": None,
+    "password": None,
+    "clientId": "RaspberryPiSolarDaemon",
+    "publishMode": "FULL",
+    "keyframeInterval": 300,
+    "payloadFormat": "JSON",
+    "outboxFile": None,
+}
+
+DEVICE_DEFAULTS = {"unit": 1, "interval": 3, "adaptive": True, "nightInterval": 30}
+
+_DEVICE_KEYS = {"name", "port"} | set(DEVICE_DEFAULTS)
+
+def _isNumber(value):
+    return type(value) in (int, float) and value > 0
+
+# Check one entry of "devices", raises ValueError so a mistake never gets as far as Device().
+def _checkDevice(entry):
+    if(type(entry) is not dict):
+        raise ValueError("A device has to be an object: %r" % (entry,))
+    if("name" not in entry or "port" not in entry):
+        raise ValueError("Every device needs a name and a port: %r" % (entry,))
+    unknown = set(entry) - _DEVICE_KEYS
+    if(unknown):
+        raise ValueError("Unknown settings for device %r: %s" % (entry["name"], ", ".join(sorted(unknown))))
+    device = dict(DEVICE_DEFAULTS, **entry)
+    name = device["name"]
+    if(type(name) is not str or not name or type(device["port"]) is not str):
+        raise ValueError("A device's name and port have to be text: %r" % (entry,))
+    if(type(device["unit"]) is not int or not 1 <= device["unit"] <= 247):
+        raise ValueError("%s: unit has to be a whole number from 1 to 247" % name)
+    if(not _isNumber(device["interval"])):
+        raise ValueError("%s: interval has to be a number of seconds" % name)
+    if(device["nightInterval"] is not None and not _isNumber(device["nightInterval"])):
+        raise ValueError("%s: nightInterval has to be a number of seconds or null" % name)
+    if(type(device["adaptive"]) is not bool):
+        raise ValueError("%s: adaptive has to be true or false" % name)
+    return device
+
+# Read and check a configuration file, raises ValueError (or OSError) if it can't be used.
+def loadConfig(path):
+    with open(path) as file:
+        try:
+            loaded = json.load(file)
+        except ValueError as e:
+            raise ValueError("%s is not valid JSON: %s" % (path, e))
+    unknown = set(loaded) - set(DEFAULTS)
+    if(unknown):
+        raise ValueError("Unknown settings in %s: %s" % (path, ", ".join(sorted(unknown))))
+    config = dict(DEFAULTS)
+    config.update(loaded)
+    config["serial"] = dict(DEFAULTS["serial"], **(config["serial"] or {}))
+    if(config["mqtt"] is not None):
+        config["mqtt"] = dict(MQTT_DEFAULTS, **config["mqtt"])
+    if(config["history"] is not None):
+        config["history"] = dict({"retentionDays": 30}, **config["history"])
+        if("file" not in config["history"]):
+            raise ValueError("history needs a file")
+    if(config["energy"] is not None):
+        config["energy"] = dict({"interval": 60}, **config["energy"])
+        if("file" not in config["energy"]):
+            raise ValueError("energy needs a file")
+    if(type(config["devices"]) is not list):
+        raise ValueError("devices has to be a list")
+    devices = [_checkDevice(entry) for entry in config["devices"]]
+    names = [device["name"] for device in devices]
+    if(len(set(names)) != len(names)):
+        raise ValueError("Device names have to be unique, they are used as the MQTT topics")
+    if(not devices):
+        raise ValueError("No devices in " + path)
+    config["devices"] = devices
+    return config
+
+def makeDevices(config):
+    return [Device(**entry) for entry in config["devices"]]
+
+# The outputs for one version of the configuration.
+# Anything expensive to set up (the MQTT connection, files, the metrics server) is taken over from the previous
+# Outputs when its settings are the same, see _reuse().
+class Outputs:
+    def __init__(self, config, poller, previous=None):
+        self.config = config
+        self.poller = poller
+        self.previous = previous
+        self.resources = {}     # name: (settings, object)
+        self.pipeline = Pipeline()
+        self.publishers = {}
+        self.stats = None
+        self.exporter = None
+        self.client = None
+        self.taken = set()      # Names of the resources taken over from previous.
+        try:
+            self._build()
+        except Exception:
+            # Close what was opened for these outputs, the previous ones keep everything they had.
+            self.pipeline.stop()
+            self._closeResources([name for name in self.resources if name not in self.taken])
+            raise
+        if(previous is not None):
+            for name in self.taken:
+                del previous.resources[name]
+        self.previous = None
+
+    # The resource called name, taken from the previous outputs if it was made from the same settings.
+    def _reuse(self, name, settings, make):
+        if(self.previous is not None):
+            old = self.previous.resources.get(name)
+            if(old is not None and old[0] == settings):
+                self.taken.add(name)
+                self.resources[name] = old
+                return old[1]
+        resource = make()
+        self.resources[name] = (settings, resource)
+        return resource
+
+    def _build(self):
+        config = self.config
+        if(config["mqtt"] is not None):
+            self._buildMqtt(config["mqtt"])
+        if(config["events"] is not None):
+            self._buildEvents(config["events"])
+        if(config["console"] is not None):
+            self._buildConsole(config["console"])
+        history = None
+        if(config["history"] is not None):
+            from SolarStore import HistoryStore
+            settings = config["history"]
+            history = self._reuse("history", settings, lambda: HistoryStore(settings["file"], settings["retentionDays"]))
+            self.pipeline.add(Sink("history", lambda device, snapshot: history.add(device.name, snapshot)))
+        if(config["rollups"]):
+            self._buildRollups(config["rollups"], history)
+        if(config["metricsPort"] is not None):
+            from SolarExporter import MetricsExporter
+            exporter = self.exporter = self._reuse("metrics", config["metricsPort"], lambda: MetricsExporter(config["metricsPort"]).start())
+            self.pipeline.add(Sink("metrics",
+                lambda device, snapshot: exporter.update(device.name, snapshot),
+                lambda device, e: exporter.updateError(device.name, e, device.unit)
+            ))
+        if(config["energy"] is not None):
+            self._buildEnergy(config["energy"])
+        if(self.client is not None):
+            self.pipeline.add(Sink("mqtt", self._publishSnapshot, self._publishError))
+        if(config["statsInterval"] is not None):
+            from SolarStats import Stats
+            self.stats = Stats(config["statsInterval"])
+            for port, bus in self.poller.buses.items():
+                self.stats.watchConnection(bus.connection, {device.unit: device.name for device in bus.devices})
+            self.stats.watchPipeline(self.pipeline)
+
+    def _buildMqtt(self, settings):
+        from SolarFormats import Encoder
+        from SolarDelta import DeltaPublisher
+        outbox = None
+        if(settings["outboxFile"] is not None):
+            from SolarOutbox import Outbox
+            outbox = self._reuse("outbox", settings["outboxFile"], lambda: Outbox(settings["outboxFile"]))
+        connection = self._reuse("mqtt", settings, lambda: MqttConnection(settings))
+        connection.client.on_message = self._onMessage
+        topics = []
+        for device in self.config["devices"]:
+            if(self.config["burstSeconds"] is not None):
+                topics.append(device["name"] + "/burst/set")
+            if(self.config["writes"]):
+                topics.append(device["name"] + "/set")
+        connection.subscribe(topics)
+        self.client = connection.client
+        encoder = Encoder(settings["payloadFormat"])
+        for device in self.config["devices"]:
+            self.publishers[device["name"]] = DeltaPublisher(
+                self.client, device["name"], settings["publishMode"], keyframeInterval=settings["keyframeInterval"], encoder=encoder, outbox=outbox
+            )
+
+    def _buildEvents(self, settings):
+        from SolarEvents import EventDetector, eventToText
+        # Kept over a reload, so faults that are already active aren't reported again.
+        detector = self._reuse("events", settings, lambda: EventDetector(settings.get("socThresholds", ()), settings.get("hysteresis", 2)))
+
+        def send(device, events):
+            for event in events:
+                print("Event:", eventToText(event))
+                if(device.name in self.publishers):
+                    self.publishers[device.name].send(device.name + "/events", json.dumps(event), qos=1)
+
+        self.pipeline.add(Sink("events",
+            lambda device, snapshot: send(device, detector.check(device.name, snapshot)),
+            lambda device, e: send(device, detector.checkError(device.name, e))
+        ))
+
+    def _buildConsole(self, outputFormat):
+        if(outputFormat == "TEXT"):
+            def printSnapshot(device, snapshot):
+                print(f"{device.name}: Battery {snapshot.batterySoc}% {snapshot.batteryVolts}V, Panels {snapshot.panelVolts}V {snapshot.chargingWatts}W, {snapshot.chargingMode}")
+        else:
+            from SolarFormats import Encoder, printPayload
+            console = Encoder(outputFormat)
+
+            def printSnapshot(device, snapshot):
+                if(not console.binary):
+                    print(device.name + ":")
+                printPayload(console.encode(snapshot))
+        self.pipeline.add(Sink("console", printSnapshot, lambda device, e: print(f"{device.name}: Failed to read data.", e)))
+
+    def _buildRollups(self, names, history):
+        from SolarRollup import RollupEngine, RESOLUTIONS, RESOLUTION_NAMES
+
+        def onRollup(device, bucket):
+            if(device in self.publishers):
+                publisher = self.publishers[device]
+                publisher.send(device + "/rollup/" + RESOLUTION_NAMES[bucket.resolution], publisher.encoder.dumps(bucket.toDict()))
+            if(history is not None):
+                history.addRollup(device, bucket)
+
+        # Buckets that are half full are carried over as long as the sizes stay the same.
+        rollups = self._reuse("rollups", names, lambda: RollupEngine(onRollup, [RESOLUTIONS[name] for name in names]))
+        rollups.onBucket = onRollup
+        self.pipeline.add(Sink("rollups", lambda device, snapshot: rollups.add(device.name, snapshot)))
+
+    def _buildEnergy(self, settings):
+        from SolarEnergy import EnergyAccounts
+        # Kept over a reload, so the totals carry on without reading the state file again.
+        energy = self._reuse("energy", settings, lambda: EnergyAccounts(settings["file"], reportInterval=settings["interval"]))
+
+        # Every interval the site and controller totals go to <clientId>/energy (retained) and the metrics page.
+        def account(device, snapshot):
+            energy.update(device.name, snapshot)
+            if(energy.due()):
+                if(self.client is not None):
+                    self.client.publish(self.config["mqtt"]["clientId"] + "/energy", json.dumps(energy.report()), retain=True)
+                if(self.exporter is not None):
+                    self.exporter.updateExtra("energy", *energy.render())
+
+        self.pipeline.add(Sink("energy", account))
+
+    def _publishSnapshot(self, device, snapshot):
+        if(not self.publishers[device.name].publish(snapshot)):
+            print(f"Failed to send message to topic {device.name}")
+
+    def _publishError(self, device, e):
+        if(not self.publishers[device.name].publishError(device.unit)):
+            print(f"Failed to send message to topic {device.name}")
+
+    # Start a burst capture (see SolarBurst.py) when asked to on <device>/burst/set.
+    def _onMessage(self, client, userdata, message):
+        # Names can contain "/", so the topic is matched whole against each device's command topics.
+        device = command = None
+        for candidate in self.poller.devices:
+            if(message.topic == candidate.name + "/burst/set"):
+                device, command = candidate, "burst/set"
+            elif(message.topic == candidate.name + "/set"):
+                device, command = candidate, "set"
+            else:
+                continue
+            break
+        if(device is None):
+            print("Ignoring command on", message.topic, message.payload)
+        elif(command == "burst/set"):
+            self._onBurstCommand(device, message.payload)
+        elif(command == "set"):
+            self._onSetCommand(device, message.payload)
+
+    def _onBurstCommand(self, device, payload):
+        from SolarBurst import Burst, parseSeconds
+        seconds = parseSeconds(payload, self.config["burstSeconds"] or 10)
+        if(seconds is None or self.config["burstSeconds"] is None):
+            print(f"{device.name}: Ignoring burst command:", payload)
+            return
+
+        def onBurst(device, burst):
+            print(f"{device.name}: Burst of {burst.samples} samples in {burst.duration:.1f}s ({burst.rate():.1f} a second), {burst.errors} errors")
+            self.publishers[device.name].send(device.name + "/burst", json.dumps(burst.toDict(device.name, device.unit)), qos=1)
+
+        print(f"{device.name}: Burst capture for {seconds:g}s...")
+        try:
+            self.poller.requestBurst(device, Burst(seconds), onBurst)
+        except Exception as e:
+            print(f"{device.name}: Burst capture failed:", e)
+
+    # Queue setting changes, the poller writes them after the device's next read.
+    def _onSetCommand(self, device, payload):
+        from SolarControl import parseCommand
+        client = self.client
+        if(not self.config["writes"]):
+            print(f"{device.name}: Ignoring settings command, writes are turned off")
+            return
+
+        def publishResult(result):
+            print(f"{device.name}: Settings written:" if result["ok"] else f"{device.name}: Settings NOT written:", result)
+            client.publish(device.name + "/set/result", json.dumps(result), qos=1)
+
+        try:
+            self.poller.control(device).set(parseCommand(payload), publishResult)
+        except ValueError as e:
+            print(f"{device.name}: Ignoring settings command:", e)
+            client.publish(device.name + "/set/result", json.dumps({"ok": False, "settings": {}, "errors": [str(e)]}), qos=1)
+
+    def publish(self, device, snapshot, error):
+        if(error is None):
+            self.pipeline.publish(device, snapshot)
+        else:
+            self.pipeline.publishError(device, error)
+        drops = self.pipeline.newDrops()
+        if(drops):
+            print("Outputs falling behind, readings dropped:", drops)
+        if(self.stats is not None and self.stats.due()):
+            report = self.stats.collect()
+            if(self.client is not None):
+                self.client.publish(self.config["mqtt"]["clientId"] + "/stats", json.dumps(report))
+            if(self.exporter is not None):
+                self.exporter.updateExtra("stats", *self.stats.render())
+
+    # Let the sinks finish what they have queued, then close whatever wasn't handed on to newer outputs.
+    def close(self):
+        self.pipeline.stop()
+        self._closeResources(list(self.resources))
+        self.resources = {}
+
+    def _closeResources(self, names):
+        for name in names:
+            resource = self.resources[name][1]
+            if(name == "metrics"):
+                resource.stop()
+            elif(hasattr(resource, "close")):
+                resource.close()
+
+# The connection to the MQTT broker, made in the background so polling doesn't wait for it.
+class MqttConnection:
+    def __init__(self, settings):
+        from paho.mqtt import client as mqtt_client
+        self.topics = []
+        self.client = mqtt_client.Client(settings["clientId"])
+        if(settings["user"] is not None):
+            self.client.username_pw_set(settings["user"], settings["password"])
+        self.client.on_connect = self._onConnect
+        self.client.connect_async(settings["host"], settings["port"])
+        self.client.loop_start()
+
+    # Subscribed again on every connect, paho doesn't keep subscriptions across reconnects.
+    def _onConnect(self, client, userdata, flags, rc):
+        if rc == 0:
+            print("Connected to MQTT Broker!")
+            for topic in self.topics:
+                client.subscribe(topic)
+        else:
+            print("Failed to connect, return code %d\n", rc)
+
+    # Change the topics subscribed to, e.g. after the devices were reloaded.
+    def subscribe(self, topics):
+        for topic in self.topics:
+            if(topic not in topics):
+                self.client.unsubscribe(topic)
+        for topic in topics:
+            if(topic not in self.topics):
+                self.client.subscribe(topic)
+        self.topics = list(topics)
+
+    def close(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+
+def simulatedClients(config):
+    from SolarSimulator import SimulatedBus, SimulatedController, SyntheticProfile
+    units = sorted({device["unit"] for device in config["devices"]})
+    return SimulatedBus([SimulatedController(SyntheticProfile(seed=unit), unit) for unit in units]).client
+
+class Daemon:
+    def __init__(self, path, simulate=False):
+        self.path = path
+        self.simulate = simulate
+        self.config = None
+        self.outputs = None
+        self.poller = None
+
+    def _onSnapshot(self, device, snapshot):
+        self.outputs.publish(device, snapshot, None)
+
+    def _onError(self, device, e):
+        self.outputs.publish(device, None, e)
+
+    async def run(self):
+        started = time.monotonic()
+        self.config = loadConfig(self.path)
+        serial = self.config["serial"]
+        clientFactory = simulatedClients(self.config) if self.simulate else None
+        self.poller = Poller(makeDevices(self.config), self._onSnapshot, self._onError, serial["baudrate"], serial["timeout"], clientFactory)
+        self.outputs = Outputs(self.config, self.poller)
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGHUP, self.reload)
+        loop.add_signal_handler(signal.SIGTERM, self.poller.stop)
+        print("Polling %d controllers on %d ports, started in %.0f ms" % (
+            len(self.poller.devices), len(self.poller.buses), (time.monotonic() - started)*1000
+        ))
+        try:
+            await self.poller.run()
+        finally:
+            self.outputs.close()
+
+    # Read the file again and apply it, the old configuration stays if the new one can't be used.
+    def reload(self):
+        try:
+            config = loadConfig(self.path)
+        except (OSError, ValueError) as e:
+            print("Not reloading:", e)
+            return
+        if(config["serial"] != self.config["serial"]):
+            print("Serial settings only change on a restart")
+        old = self.outputs
+        # Nothing else runs on the event loop until this returns, so no reading can come in half way through.
+        self.poller.update(makeDevices(config))
+        try:
+            outputs = Outputs(config, self.poller, old)
+        except Exception as e:
+            print("Not reloading:", e)
+            self.poller.update(makeDevices(self.config))
+            return
+        self.config = config
+        # New readings go to the new outputs straight away, the old ones finish their queues in the background.
+        self.outputs = outputs
+        asyncio.get_running_loop().run_in_executor(None, old.close)
+        print("Reloaded %s, polling %d controllers on %d ports" % (self.path, len(self.poller.devices), len({device.port for device in self.poller.devices})))
+
+def main():
+    if(len(sys.argv) < 2 or sys.argv[1] in ("-h", "--help")):
+        print("Usage: python3 SolarDaemon.py <config.json> [--simulate]")
+        sys.exit(2)
+    daemon = Daemon(sys.argv[1], "--simulate" in sys.argv[2:])
+    try:
+        asyncio.run(daemon.run())
+    except (OSError, ValueError) as e:
+        print("Can't start:", e)
+        sys.exit(1)
+    except KeyboardInterrupt:
+        print("\nClosing Modbus Connections...")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,390 @@
+#!/usr/bin/python
+
+# Cole L - https://github.com/cole8888/SRNE-Solar-Charge-Controller-Monitor
+#
+# Shared register decoding for the SRNE charge controller examples.
+#
+# The 35 registers from 0x0100 (Decimal 256) to 0x0122 (Decimal 290) are described once in REGISTER_MAP
+# and decoded in a single pass into a Snapshot. The text, JSON and MQTT outputs all render from the Snapshot
+# instead of re-reading the raw registers themselves.
+
+import time
+from collections import namedtuple
+
+# First register of the block we read from the controller and how many registers are in it.
+BASE_ADDRESS = 0x0100
+REGISTER_COUNT = 35
+
+# Array of charging mode strings.
+# These are the states the charge controller can be in when charging the battery.
+chargeModes = [
+    "OFF",      #0
+    "NORMAL",   #1
+    "MPPT",     #2
+    "EQUALIZE", #3
+    "BOOST",    #4
+    "FLOAT",    #5
+    "CUR_LIM"   #6 (Current limiting)
+]
+
+# Array of fault codes.
+# These are all the possible faults the charge controller can indicate.
+# Multiple faults can be thrown at the same time.
+faultCodes = [
+    "Charge MOS short circuit",      #0
+    "Anti-reverse MOS short",        #1
+    "PV panel reversely connected",  #2
+    "PV working point over voltage", #3
+    "PV counter current",            #4
+    "PV input side over-voltage",    #5
+    "PV input side short circuit",   #6
+    "PV input overpower",            #7
+    "Ambient temp too high",         #8
+    "Controller temp too high",      #9
+    "Load over-power/current",       #10
+    "Load short circuit",            #11
+    "Battery undervoltage warning",  #12
+    "Battery overvoltage",           #13
+    "Battery over-discharge"         #14
+]
+
+# How a register (or pair of registers) is turned into a value.
+UNSIGNED = "unsigned"       # Plain unsigned value, optionally scaled.
+FLAG = "flag"               # Non-zero means True.
+TEMP_HIGH = "tempHigh"      # Sign-magnitude temperature in the high byte.
+TEMP_LOW = "tempLow"        # Sign-magnitude temperature in the low byte.
+CHARGE_MODE = "chargeMode"  # Charging mode in the low bits, load state in the top bit.
+FAULTS = "faults"           # Fault bitmask.
+
+# address: Absolute modbus address of the (first) register.
+# words:   Number of registers the value spans, the first one holds the high word.
+# scale:   Multiplier applied to the raw value, 1 leaves the value as an int.
+# digits:  Number of decimal places kept after scaling.
+# kind:    One of the kinds above, covers the signed / packed registers.
+Register = namedtuple("Register", ["name", "address", "words", "scale", "digits", "kind"])
+
+REGISTER_MAP = (
+    Register("batterySoc",             0x0100, 1, 1,     0, UNSIGNED),
+    Register("batteryVolts",           0x0101, 1, 0.1,   1, UNSIGNED),
+    Register("chargingAmps",           0x0102, 1, 0.01,  2, UNSIGNED),
+    Register("controllerTemp",         0x0103, 1, 1,     0, TEMP_HIGH),
+    Register("batteryTemp",            0x0103, 1, 1,     0, TEMP_LOW),
+    Register("loadVolts",              0x0104, 1, 0.1,   1, UNSIGNED),
+    Register("loadAmps",               0x0105, 1, 0.01,  2, UNSIGNED),
+    Register("loadWatts",              0x0106, 1, 1,     0, UNSIGNED),
+    Register("panelVolts",             0x0107, 1, 0.1,   1, UNSIGNED),
+    Register("panelAmps",              0x0108, 1, 0.01,  2, UNSIGNED),
+    Register("chargingWatts",          0x0109, 1, 1,     0, UNSIGNED),
+    Register("loadState",              0x010A, 1, 1,     0, FLAG),
+    Register("batteryMinVolts",        0x010B, 1, 0.1,   1, UNSIGNED),
+    Register("batteryMaxVolts",        0x010C, 1, 0.1,   1, UNSIGNED),
+    Register("chargingMaxAmps",        0x010D, 1, 0.01,  2, UNSIGNED),
+    Register("loadMaxAmps",            0x010E, 1, 0.01,  2, UNSIGNED),
+    Register("chargingMaxWatts",       0x010F, 1, 1,     0, UNSIGNED),
+    Register("loadMaxWatts",           0x0110, 1, 1,     0, UNSIGNED),
+    Register("chargingDailyAmpHours",  0x0111, 1, 1,     0, UNSIGNED),
+    Register("loadDailyAmpHours",      0x0112, 1, 1,     0, UNSIGNED),
+    Register("chargingDailyPower",     0x0113, 1, 0.001, 3, UNSIGNED),
+    Register("loadDailyPower",         0x0114, 1, 0.001, 3, UNSIGNED),
+    Register("days",                   0x0115, 1, 1,     0, UNSIGNED),
+    Register("overDischarges",         0x0116, 1, 1,     0, UNSIGNED),
+    Register("fullCharges",            0x0117, 1, 1,     0, UNSIGNED),
+    Register("chargingTotalAmpHours",  0x0118, 2, 0.001, 3, UNSIGNED),
+    Register("loadTotalAmpHours",      0x011A, 2, 0.001, 3, UNSIGNED),
+    Register("chargingTotalPower",     0x011C, 2, 0.001, 3, UNSIGNED),
+    Register("loadTotalPower",         0x011E, 2, 0.001, 3, UNSIGNED),
+    Register("chargingMode",           0x0120, 1, 1,     0, CHARGE_MODE),
+    Register("faultBits",              0x0122, 1, 1,     0, FAULTS),
+)
+
+# Names of the decoded values, in register map order.
+FIELD_NAMES = tuple(register.name for register in REGISTER_MAP)
+
+# Account for negative temperatures.
+def getRealTemp(temp):
+    if(temp/int(128) > 1):
+        return -(temp%128)
+    return temp
+
+# Every possible temperature byte, decoded ahead of time.
+_TEMPERATURES = tuple(getRealTemp(value) for value in range(256))
+
+# Description of each bit of the fault register, indexed by bit number. Bit 15 and bit 0 share a description,
+# the same as the original decoding loop.
+FAULT_BIT_NAMES = tuple(faultCodes[(15-bit)-1] for bit in range(16))
+
+# The faults for every possible value of the high and low byte of the fault register, worked out ahead of time so
+# decoding is two lookups rather than a loop over the bits. Highest bit first, like the controller reports them.
+def _faultTable(shift):
+    return tuple(
+        tuple(FAULT_BIT_NAMES[bit + shift] for bit in range(7, -1, -1) if value & (1 << bit))
+        for value in range(256)
+    )
+
+_FAULTS_HIGH = _faultTable(8)
+_FAULTS_LOW = _faultTable(0)
+
+# Turn the fault register into a tuple of fault descriptions.
+def decodeFaults(faultID):
+    if(faultID == 0):
+        return ()
+    return _FAULTS_HIGH[(faultID >> 8) & 0xFF] + _FAULTS_LOW[faultID & 0xFF]
+
+# Decoded registers from one read of the charge controller.
+class Snapshot:
+    __slots__ = FIELD_NAMES + ("loadEnabled", "faults", "registers", "unit", "timestamp")
+
+    def __repr__(self):
+        return "Snapshot(unit=%r, timestamp=%r, chargingMode=%r)" % (self.unit, self.timestamp, self.chargingMode)
+
+# Work out each field's position in the register list once, rather than on every decode.
+_PLAN = tuple(
+    (register.name, register.address - BASE_ADDRESS, register.words, register.scale, register.digits, register.kind)
+    for register in REGISTER_MAP
+)
+
+# Decode the 35 registers starting at 0x0100 into a Snapshot.
+def decodeRegisters(registers, unit=1, timestamp=None):
+    snapshot = Snapshot()
+    for name, offset, words, scale, digits, kind in _PLAN:
+        raw = registers[offset]
+        if(kind == UNSIGNED):
+            if(words == 2):
+                raw = (raw << 16) | registers[offset+1]
+            value = raw if scale == 1 else round(raw*scale, digits)
+        elif(kind == TEMP_HIGH):
+            value = _TEMPERATURES[(raw >> 8) & 0xFF]
+        elif(kind == TEMP_LOW):
+            value = _TEMPERATURES[raw & 0xFF]
+        elif(kind == FLAG):
+            value = raw != 0
+        elif(kind == CHARGE_MODE):
+            # The load state shares this register with the charging mode, the top bit is set when the load is on.
+            snapshot.loadEnabled = raw > 6
+            mode = raw & 0x7FFF
+            value = chargeModes[mode] if mode < len(chargeModes) else "UNKNOWN"
+        else:
+            snapshot.faults = decodeFaults(raw)
+            value = raw
+        setattr(snapshot, name, value)
+    snapshot.registers = tuple(registers[:REGISTER_COUNT])
+    snapshot.unit = unit
+    snapshot.timestamp = time.time() if timestamp is None else timestamp
+    return snapshot
+
+# Decode a pymodbus read_holding_registers(256, 35) response into a Snapshot.
+def decodeResponse(response, unit=1, timestamp=None):
+    return decodeRegisters(response.registers, unit, timestamp)
+
+# Convert a Snapshot into the nested dictionary used for the JSON output. (See JSON_Sample.json)
+def snapshotToDict(snapshot):
+    return {
+        "modbusError": False,
+        "controller": {
+            "chargingMode": snapshot.chargingMode,
+            "temperature": snapshot.controllerTemp,
+            "days": snapshot.days,
+            "overDischarges": snapshot.overDischarges,
+            "fullCharges": snapshot.fullCharges
+        },
+        "charging": {
+            "amps": snapshot.chargingAmps,
+            "maxAmps": snapshot.chargingMaxAmps,
+            "watts": snapshot.chargingWatts,
+            "maxWatts": snapshot.chargingMaxWatts,
+            "dailyAmpHours": snapshot.chargingDailyAmpHours,
+            "totalAmpHours": snapshot.chargingTotalAmpHours,
+            "dailyPower": snapshot.chargingDailyPower,
+            "totalPower": snapshot.chargingTotalPower
+        },
+        "battery": {
+            "stateOfCharge": snapshot.batterySoc,
+            "volts": snapshot.batteryVolts,
+            "minVolts": snapshot.batteryMinVolts,
+            "maxVolts": snapshot.batteryMaxVolts,
+            "temperature": snapshot.batteryTemp
+        },
+        "panels": {
+            "volts": snapshot.panelVolts,
+            "amps": snapshot.panelAmps
+        },
+        "load": {
+            "state": snapshot.loadState,
+            "volts": snapshot.loadVolts,
+            "amps": snapshot.loadAmps,
+            "watts": snapshot.loadWatts,
+            "maxAmps": snapshot.loadMaxAmps,
+            "maxWatts": snapshot.loadMaxWatts,
+            "dailyAmpHours": snapshot.loadDailyAmpHours,
+            "totalAmpHours": snapshot.loadTotalAmpHours,
+            "dailyPower": snapshot.loadDailyPower,
+            "totalPower": snapshot.loadTotalPower
+        },
+        "faults": list(snapshot.faults)
+    }
+
+# Dictionary sent instead of the data when the controller could not be read.
+ERROR_DICT = {
+    "modbusError": True
+}
+
+# Where each field sits in the JSON document, as (section, (key, field name), ...). The same layout as snapshotToDict().
+DOCUMENT_LAYOUT = (
+    ("controller", (
+        ("chargingMode", "chargingMode"), ("temperature", "controllerTemp"), ("days", "days"),
+        ("overDischarges", "overDischarges"), ("fullCharges", "fullCharges"),
+    )),
+    ("charging", (
+        ("amps", "chargingAmps"), ("maxAmps", "chargingMaxAmps"), ("watts", "chargingWatts"), ("maxWatts", "chargingMaxWatts"),
+        ("dailyAmpHours", "chargingDailyAmpHours"), ("totalAmpHours", "chargingTotalAmpHours"),
+        ("dailyPower", "chargingDailyPower"), ("totalPower", "chargingTotalPower"),
+    )),
+    ("battery", (
+        ("stateOfCharge", "batterySoc"), ("volts", "batteryVolts"), ("minVolts", "batteryMinVolts"),
+        ("maxVolts", "batteryMaxVolts"), ("temperature", "batteryTemp"),
+    )),
+    ("panels", (
+        ("volts", "panelVolts"), ("amps", "panelAmps"),
+    )),
+    ("load", (
+        ("state", "loadState"), ("volts", "loadVolts"), ("amps", "loadAmps"), ("watts", "loadWatts"),
+        ("maxAmps", "loadMaxAmps"), ("maxWatts", "loadMaxWatts"), ("dailyAmpHours", "loadDailyAmpHours"),
+        ("totalAmpHours", "loadTotalAmpHours"), ("dailyPower", "loadDailyPower"), ("totalPower", "loadTotalPower"),
+    )),
+)
+
+# The layout joined with the register map once: (section, ((key, name, offset, words, scale, digits, kind, limit), ...)).
+_REGISTERS_BY_NAME = {register.name: register for register in REGISTER_MAP}
+_DOCUMENT_PLAN = tuple(
+    (section, tuple(
+        (key, name, register.address - BASE_ADDRESS, register.words, register.scale, register.digits, register.kind, (1 << 16*register.words) - 1)
+        for key, name in fields for register in (_REGISTERS_BY_NAME[name],)
+    ))
+    for section, fields in DOCUMENT_LAYOUT
+)
+
+_CHARGE_MODE_INDEX = {mode: index for index, mode in enumerate(chargeModes)}
+
+# Fault description to its bit. Bit 0 and bit 15 share a description, the lower bit is used.
+_FAULT_BITS = {FAULT_BIT_NAMES[bit]: 1 << bit for bit in range(15, -1, -1)}
+
+_NUMBER = (int, float)
+
+# Turn a JSON document (JSON_Sample.json, e.g. from the ESP32 firmware) back into a Snapshot, the opposite of
+# snapshotToDict(). The registers are rebuilt from the values, so the Snapshot is the same as one from a direct read.
+# Returns None for a document sent for a failed read, raises ValueError if anything is missing, of the wrong type or
+# out of range.
+def snapshotFromDict(document, unit=1, timestamp=None):
+    if(type(document) is not dict):
+        raise ValueError("Expected a JSON object")
+    if(document.get("modbusError")):
+        return None
+    snapshot = Snapshot()
+    registers = [0]*REGISTER_COUNT
+    for section, fields in _DOCUMENT_PLAN:
+        values = document.get(section)
+        if(type(values) is not dict):
+            raise ValueError("%s is missing" % section)
+        for key, name, offset, words, scale, digits, kind, limit in fields:
+            value = values.get(key)
+            if(kind == UNSIGNED):
+                if(type(value) not in _NUMBER):
+                    raise ValueError("%s.%s is not a number: %r" % (section, key, value))
+                raw = int(round(value/scale)) if scale != 1 else int(value)
+                if(raw < 0 or raw > limit):
+                    raise ValueError("%s.%s is out of range: %r" % (section, key, value))
+                if(words == 2):
+                    registers[offset] = raw >> 16
+                    registers[offset+1] = raw & 0xFFFF
+                else:
+                    registers[offset] = raw
+                # The same rounding as decodeRegisters, so both give identical values.
+                value = raw if scale == 1 else round(raw*scale, digits)
+            elif(kind == TEMP_HIGH or kind == TEMP_LOW):
+                if(type(value) is not int or not -127 <= value <= 127):
+                    raise ValueError("%s.%s is not a temperature: %r" % (section, key, value))
+                byte = value if value >= 0 else 0x80 | -value
+                registers[offset] |= byte << 8 if kind == TEMP_HIGH else byte
+            elif(kind == FLAG):
+                if(type(value) is not bool):
+                    raise ValueError("%s.%s is not true or false: %r" % (section, key, value))
+                registers[offset] = int(value)
+            else:
+                mode = _CHARGE_MODE_INDEX.get(value) if type(value) is str else None
+                if(mode is None):
+                    raise ValueError("%s.%s is not a charging mode: %r" % (section, key, value))
+                registers[offset] = mode
+            setattr(snapshot, name, value)
+    faults = document.get("faults")
+    if(type(faults) is not list):
+        raise ValueError("faults is missing")
+    faultBits = 0
+    for fault in faults:
+        bit = _FAULT_BITS.get(fault) if type(fault) is str else None
+        if(bit is None):
+            raise ValueError("Unknown fault: %r" % (fault,))
+        faultBits |= bit
+    registers[0x0122 - BASE_ADDRESS] = faultBits
+    snapshot.faultBits = faultBits
+    snapshot.faults = decodeFaults(faultBits)
+    # The document has no charging mode register, the load output's state stands in for its load bit.
+    snapshot.loadEnabled = snapshot.loadState
+    if(snapshot.loadEnabled):
+        registers[0x0120 - BASE_ADDRESS] |= 0x8000
+    snapshot.registers = tuple(registers)
+    snapshot.unit = unit
+    snapshot.timestamp = time.time() if timestamp is None else timestamp
+    return snapshot
+
+# Render a Snapshot in the text format.
+def snapshotToText(snapshot):
+    faults = "None :)"
+    if(snapshot.faults):
+        faults = "\n".join("- " + fault for fault in snapshot.faults)
+
+    return "\n".join((
+        # Realtime information
+        "\n------------- Real Time Data -------------",
+        "Charging Mode:\t\t\t" + snapshot.chargingMode,
+        "Battery SOC:\t\t\t" + str(snapshot.batterySoc) + "%",
+        "Battery Voltage:\t\t" + str(snapshot.batteryVolts) + "V",
+        "Battery Charge Current:\t\t" + str(snapshot.chargingAmps) + "A",
+        "Controller Temperature:\t\t" + str(snapshot.controllerTemp) + "*C",
+        "Battery Temperature:\t\t" + str(snapshot.batteryTemp) + "*C",
+        "Load Voltage:\t\t\t" + str(snapshot.loadVolts) + " V",
+        "Load Current:\t\t\t" + str(snapshot.loadAmps) + " A",
+        "Load Power:\t\t\t" + str(snapshot.loadWatts) + " Watts",
+        "Load Enabled:\t\t\t" + str(snapshot.loadEnabled),
+        "Panel Volts:\t\t\t" + str(snapshot.panelVolts) + "V",
+        "Panel Amps:\t\t\t" + str(snapshot.panelAmps) + "A",
+        "Panel Power:\t\t\t" + str(snapshot.chargingWatts) + "W",
+
+        # Data accumulated over the day
+        "--------------- DAILY DATA ---------------",
+        "Battery Minimum Voltage:\t" + str(snapshot.batteryMinVolts) + "V",
+        "Battery Maximum Voltage:\t" + str(snapshot.batteryMaxVolts) + "V",
+        "Maximum Charge Current:\t\t" + str(snapshot.chargingMaxAmps) + "A",
+        "Maximum Charge Power:\t\t" + str(snapshot.chargingMaxWatts) + "W",
+        "Maximum Load Discharge Current:\t" + str(snapshot.loadMaxAmps) + "A",
+        "Maximum Load Discharge Power:\t" + str(snapshot.loadMaxWatts) + "W",
+        "Charge Amp Hours:\t\t" + str(snapshot.chargingDailyAmpHours) + "Ah",
+        "Charge Power:\t\t\t" + str(snapshot.chargingDailyPower) + "KWh",
+        "Load Amp Hours:\t\t\t" + str(snapshot.loadDailyAmpHours) + "Ah",
+        "Load Power:\t\t\t" + str(snapshot.loadDailyPower) + "KWh",
+
+        # Data from the lifetime of the charge controller
+        "------------- LIFETIME DATA --------------",
+        "Days Operational:\t\t" + str(snapshot.days) + " Days",
+        "Times Over Discharged:\t\t" + str(snapshot.overDischarges),
+        "Times Fully Charged:\t\t" + str(snapshot.fullCharges),
+        "Cumulative Amp Hours:\t\t" + str(snapshot.chargingTotalAmpHours) + "KAh",
+        "Cumulative Power:\t\t" + str(snapshot.chargingTotalPower) + "KWh",
+        "Load Amp Hours:\t\t\t" + str(snapshot.loadTotalAmpHours) + "KAh",
+        "Load Power:\t\t\t" + str(snapshot.loadTotalPower) + "KWh",
+        "------------------------------------------",
+
+        "--------------- FAULT DATA ---------------",
+        faults,
+        "RAW Fault Data:\t\t\t" + str(snapshot.faultBits),
+        "------------------------------------------"
+    ))
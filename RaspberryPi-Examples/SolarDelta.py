@@ -0,0 +1,136 @@
+#!/usr/bin/python
+
+# Cole L - https://github.com/cole8888/SRNE-Solar-Charge-Controller-Monitor
+#
+# Only publish the values that changed.
+#
+# PUBLISH_MODE in the MQTT scripts picks one of:
+#   FULL   - The whole JSON document every cycle. (The original behaviour)
+#   DELTA  - A compact JSON object with just the fields that moved, on <topic>/delta.
+#   FIELDS - Every field that moved on its own topic, e.g. <topic>/battery/volts.
+# In DELTA and FIELDS mode the full document is still sent to <topic> every keyframe interval so subscribers that
+# join late (or missed a message) can resync. Numbers only count as moved when they change by more than their deadband.
+
+import json
+import time
+from SolarDecoder import snapshotToDict
+from SolarFormats import Encoder
+
+FULL = "FULL"
+DELTA = "DELTA"
+FIELDS = "FIELDS"
+
+# How much a value has to move since it was last sent before it is sent again.
+# Fields not listed here are sent on any change.
+DEFAULT_DEADBANDS = {
+    "battery/volts": 0.1,
+    "charging/amps": 0.05,
+    "charging/watts": 2,
+    "panels/volts": 0.5,
+    "panels/amps": 0.05,
+    "load/volts": 0.1,
+    "load/amps": 0.05,
+    "load/watts": 2,
+}
+
+# Flatten the nested JSON dictionary into {"battery/volts": 28.2, ...}
+def flattenDict(nested, prefix=""):
+    flat = {}
+    for key, value in nested.items():
+        if(isinstance(value, dict)):
+            flat.update(flattenDict(value, prefix + key + "/"))
+        else:
+            flat[prefix + key] = value
+    return flat
+
+# Keeps track of what was last sent and works out what needs sending now.
+class DeltaFilter:
+    def __init__(self, deadbands=DEFAULT_DEADBANDS, keyframeInterval=300):
+        self.deadbands = deadbands
+        self.keyframeInterval = keyframeInterval
+        self.sent = {}
+        self.lastKeyframe = None
+
+    # Forget what was sent, the next call to changes() will be a keyframe.
+    def reset(self):
+        self.sent = {}
+        self.lastKeyframe = None
+
+    def keyframeDue(self, now):
+        return self.lastKeyframe is None or now - self.lastKeyframe >= self.keyframeInterval
+
+    # Returns (keyframe, changed fields) for a flattened document.
+    def changes(self, flat, now):
+        if(self.keyframeDue(now)):
+            self.lastKeyframe = now
+            self.sent = dict(flat)
+            return True, flat
+        changed = {}
+        for key, value in flat.items():
+            last = self.sent.get(key)
+            if(value == last and type(value) is type(last)):
+                continue
+            deadband = self.deadbands.get(key)
+            if(deadband is not None and last is not None and type(value) in (int, float) and type(last) in (int, float)):
+                if(abs(value - last) <= deadband):
+                    continue
+            changed[key] = value
+        self.sent.update(changed)
+        return False, changed
+
+# Publishes snapshots for one controller to the MQTT broker in the chosen mode.
+# The full documents and the deltas are encoded with encoder (see SolarFormats.py), per field values are plain JSON.
+# With an outbox (see SolarOutbox.py) readings that fail to publish are queued and replayed once publishing works again.
+class DeltaPublisher:
+    def __init__(self, client, topic, mode=FULL, deadbands=DEFAULT_DEADBANDS, keyframeInterval=300, encoder=None, outbox=None):
+        self.client = client
+        self.topic = topic
+        self.mode = mode
+        self.encoder = encoder if encoder is not None else Encoder()
+        self.filter = DeltaFilter(deadbands, keyframeInterval)
+        self.outbox = outbox
+
+    # Publish a message, returns True if paho accepted it.
+    def send(self, topic, payload, retain=False, qos=0):
+        result = self.client.publish(topic, payload, qos=qos, retain=retain)
+        return result[0] == 0
+
+    # Backlog messages are sent with QoS 1 so paho retries them if the connection drops again.
+    def sendBacklog(self, topic, payload):
+        return self.send(topic, payload, qos=1)
+
+    def publish(self, snapshot):
+        ok = self._publish(snapshot)
+        if(self.outbox is not None):
+            if(ok):
+                self.outbox.drain(self.sendBacklog, self.encoder)
+            else:
+                self.outbox.add(self.topic, snapshot)
+                # Subscribers missed this one, start again from a keyframe.
+                self.filter.reset()
+        return ok
+
+    def _publish(self, snapshot):
+        if(self.mode == FULL):
+            return self.send(self.topic, self.encoder.encode(snapshot))
+
+        keyframe, changed = self.filter.changes(flattenDict(snapshotToDict(snapshot)), time.monotonic())
+        ok = True
+        if(keyframe):
+            ok = self.send(self.topic, self.encoder.encode(snapshot))
+            # Per field subscribers get every field on a keyframe, not just the ones that changed.
+            if(self.mode != FIELDS):
+                return ok
+        if(not changed):
+            return ok
+        if(self.mode == DELTA):
+            return self.send(self.topic + "/delta", self.encoder.dumps(changed))
+        for key, value in changed.items():
+            # Retained so Home Assistant style consumers see the latest value as soon as they subscribe.
+            ok = self.send(self.topic + "/" + key, json.dumps(value), retain=True) and ok
+        return ok
+
+    def publishError(self, unit=1):
+        # Resync everyone with a keyframe once the controller is back.
+        self.filter.reset()
+        return self.send(self.topic, self.encoder.encodeError(unit))
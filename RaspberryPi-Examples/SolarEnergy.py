@@ -0,0 +1,248 @@
+#!/usr/bin/python
+
+# Cole L - https://github.com/cole8888/SRNE-Solar-Charge-Controller-Monitor
+#
+# Keep running energy and amp hour totals for each controller and for the whole site.
+#
+# The controller counts the amp hours and watt hours charged and used twice: in 32 bit lifetime counters
+# (0x0118 - 0x011F) and in 16 bit daily counters (0x0111 - 0x0114) that go back to 0 at the controller's own idea of
+# midnight. Each reading only adds the difference from the last reading of the same controller, in the raw units
+# the controller counts in (Ah and Wh), so the totals are exact and never go backwards:
+# - The lifetime counters are used, so nothing is lost at the controller's midnight or while the monitor was off.
+# - A lifetime counter that rolls over past 2^32 is counted as a wrap and carries on.
+# - A lifetime counter that goes back (the controller was reset or swapped) or jumps by more than maxPerHour
+#   since the counters last changed (a garbled read) is counted as a reset: that reading's difference comes from
+#   the daily counter instead and the new value becomes the starting point.
+# - Readings where the lifetime counters haven't changed add nothing. With the tiered read plan they are only read
+#   every few minutes, so most readings carry the same values as the one before.
+# - The daily counters going down marks the end of the controller's day, their last values are kept in lastDay.
+#
+# The site totals are updated with the same differences, so a reading costs the same however many controllers
+# there are. With stateFile set, the totals and the last counter values are saved every saveInterval seconds
+# and picked up again on start, so the time the monitor was stopped is still counted.
+#
+#   accounts = EnergyAccounts("solar-energy.json")
+#   accounts.update("CC1", snapshot)
+#   accounts.site()     # {"chargingWh": ..., "loadWh": ..., "chargingAh": ..., "loadAh": ...}
+
+import json
+import os
+import time
+from SolarStats import _label
+
+# (name, offset of the lifetime register pair, offset of the daily register) in the 35 registers from 0x0100.
+COUNTERS = (
+    ("chargingAh", 24, 17),
+    ("loadAh",     26, 18),
+    ("chargingWh", 28, 19),
+    ("loadWh",     30, 20),
+)
+
+COUNTER_NAMES = tuple(name for name, lifetime, daily in COUNTERS)
+
+_COUNTER_COUNT = len(COUNTERS)
+
+# The lifetime counters are 32 bit.
+WRAP = 1 << 32
+
+# Running totals and the last counter values of one controller.
+class Account:
+    __slots__ = ("lifetime", "daily", "seen", "totals", "lastDay", "since", "updated", "changed", "wraps", "resets", "days")
+
+    def __init__(self, since=None):
+        self.lifetime = None            # Last value of each lifetime counter, None before the first reading.
+        self.daily = None               # The daily counters of the reading the lifetime counters last changed on.
+        self.seen = None                # The daily counters of the last reading.
+        self.totals = [0]*_COUNTER_COUNT
+        self.lastDay = None             # The daily counters just before they last went back to 0.
+        self.since = since              # Time of the first reading counted.
+        self.updated = since
+        self.changed = since            # Time the lifetime counters last changed.
+        self.wraps = 0
+        self.resets = 0
+        self.days = 0
+
+    def toDict(self):
+        document = dict(zip(COUNTER_NAMES, self.totals))
+        document.update({
+            "since": self.since,
+            "updated": self.updated,
+            "wraps": self.wraps,
+            "resets": self.resets,
+            "days": self.days,
+            "lastDay": None if self.lastDay is None else dict(zip(COUNTER_NAMES, self.lastDay)),
+        })
+        return document
+
+    # State to save, with the last counter values so the next run can carry on from them.
+    def state(self):
+        state = self.toDict()
+        state["lifetime"] = self.lifetime
+        state["daily"] = self.daily
+        state["seen"] = self.seen
+        state["changed"] = self.changed
+        return state
+
+    @classmethod
+    def fromState(cls, state):
+        account = cls(state.get("since"))
+        account.updated = state.get("updated")
+        account.totals = [int(state.get(name, 0)) for name in COUNTER_NAMES]
+        account.lifetime = state.get("lifetime")
+        account.daily = state.get("daily")
+        account.seen = state.get("seen", account.daily)
+        account.changed = state.get("changed", account.updated)
+        lastDay = state.get("lastDay")
+        account.lastDay = None if lastDay is None else [lastDay.get(name, 0) for name in COUNTER_NAMES]
+        account.wraps = state.get("wraps", 0)
+        account.resets = state.get("resets", 0)
+        account.days = state.get("days", 0)
+        return account
+
+# The accounts of every controller and the site totals.
+# stateFile:    JSON file to keep the totals in between runs, None to start from 0 every time.
+# saveInterval: Seconds between saves of the state file.
+# reportInterval: Seconds between reports, see due().
+# maxPerHour:   A counter going up by more than this (Ah or Wh) per hour since it last changed is treated as a reset.
+class EnergyAccounts:
+    def __init__(self, stateFile=None, saveInterval=60, reportInterval=60, maxPerHour=20000):
+        self.stateFile = stateFile
+        self.saveInterval = saveInterval
+        self.reportInterval = reportInterval
+        self.maxPerHour = maxPerHour
+        self.accounts = {}
+        self.totals = [0]*_COUNTER_COUNT
+        now = time.monotonic()
+        self.nextSave = now + saveInterval
+        self.nextReport = now + reportInterval
+        if(stateFile is not None and os.path.exists(stateFile)):
+            self.load(stateFile)
+
+    # Count a reading of a controller. Returns the differences it added, as a list in COUNTERS order.
+    def update(self, device, snapshot):
+        registers = snapshot.registers
+        timestamp = snapshot.timestamp
+        account = self.accounts.get(device)
+        if(account is None):
+            account = self.accounts[device] = Account(timestamp)
+        lifetime = [(registers[offset] << 16) | registers[offset+1] for name, offset, daily in COUNTERS]
+        daily = [registers[offset] for name, lifetime, offset in COUNTERS]
+        lastLifetime = account.lifetime
+        lastDaily = account.daily
+        seen = account.seen
+        if(seen is not None and any(value < last for value, last in zip(daily, seen))):
+            account.days += 1
+            account.lastDay = seen
+        account.seen = daily
+        account.updated = timestamp
+        if(lastLifetime is None):
+            # Nothing to compare the first reading to.
+            deltas = [0]*_COUNTER_COUNT
+        elif(lifetime == lastLifetime):
+            # Nothing was counted, or the lifetime registers weren't read again since the last reading.
+            if(self.stateFile is not None and time.monotonic() >= self.nextSave):
+                self.save()
+            return [0]*_COUNTER_COUNT
+        else:
+            elapsed = timestamp - account.changed if account.changed is not None else 0
+            limit = self.maxPerHour*max(elapsed, 0)/3600 + 1
+            deltas = []
+            reset = False
+            for index in range(_COUNTER_COUNT):
+                # The daily counter only goes back when the day ends, it counts up from 0 after that.
+                dailyStep = daily[index] - lastDaily[index] if daily[index] >= lastDaily[index] else daily[index]
+                step = lifetime[index] - lastLifetime[index]
+                if(step < 0 and lastLifetime[index] - lifetime[index] > WRAP//2):
+                    step += WRAP
+                    account.wraps += 1
+                if(step < 0 or step > limit):
+                    step = dailyStep if dailyStep <= limit else 0
+                    reset = True
+                deltas.append(step)
+            if(reset):
+                account.resets += 1
+        totals = account.totals
+        site = self.totals
+        for index, step in enumerate(deltas):
+            if(step):
+                totals[index] += step
+                site[index] += step
+        account.lifetime = lifetime
+        account.daily = daily
+        account.changed = timestamp
+        if(self.stateFile is not None and time.monotonic() >= self.nextSave):
+            self.save()
+        return deltas
+
+    # Totals of one controller, None if it hasn't been read yet.
+    def device(self, device):
+        account = self.accounts.get(device)
+        return None if account is None else account.toDict()
+
+    # Totals of all the controllers together.
+    def site(self):
+        return dict(zip(COUNTER_NAMES, self.totals))
+
+    # True once every reportInterval, when it is time to publish the totals.
+    def due(self):
+        now = time.monotonic()
+        if(now < self.nextReport):
+            return False
+        self.nextReport = max(self.nextReport + self.reportInterval, now)
+        return True
+
+    # Everything, for publishing.
+    def report(self):
+        return {
+            "site": self.site(),
+            "devices": {device: account.toDict() for device, account in self.accounts.items()},
+        }
+
+    # Write the state file, through a temporary file so a crash never leaves half of it.
+    def save(self, path=None):
+        path = path or self.stateFile
+        self.nextSave = time.monotonic() + self.saveInterval
+        state = {device: account.state() for device, account in self.accounts.items()}
+        temporary = path + ".tmp"
+        with open(temporary, "w") as file:
+            json.dump(state, file)
+        os.replace(temporary, path)
+
+    def load(self, path):
+        with open(path) as file:
+            state = json.load(file)
+        self.accounts = {device: Account.fromState(entry) for device, entry in state.items()}
+        self.totals = [sum(account.totals[index] for account in self.accounts.values()) for index in range(_COUNTER_COUNT)]
+
+    def close(self):
+        if(self.stateFile is not None):
+            self.save()
+
+    # The totals as counters for the metrics page, see MetricsExporter.updateExtra().
+    def render(self):
+        families = (
+            ("srne_accounted_amp_hours", "Amp hours counted by the monitor, including while it was stopped.", 0, 1),
+            ("srne_accounted_watt_hours", "Energy counted by the monitor, including while it was stopped.", 2, 3),
+        )
+        openMetrics = []
+        prometheus = []
+        for name, text, charging, load in families:
+            samples = []
+            for device, account in self.accounts.items():
+                label = _label(device)
+                samples.append('%s_total{device="%s",direction="charging"} %d\n' % (name, label, account.totals[charging]))
+                samples.append('%s_total{device="%s",direction="load"} %d\n' % (name, label, account.totals[load]))
+            siteName = name.replace("accounted", "site")
+            siteSamples = '%s_total{direction="charging"} %d\n%s_total{direction="load"} %d\n' % (siteName, self.totals[charging], siteName, self.totals[load])
+            for familyName, familyText, familySamples in ((name, text, "".join(samples)), (siteName, "Sum over all the controllers. " + text, siteSamples)):
+                openMetrics.append("# HELP %s %s\n# TYPE %s counter\n%s" % (familyName, familyText, familyName, familySamples))
+                prometheus.append("# HELP %s_total %s\n# TYPE %s_total counter\n%s" % (familyName, familyText, familyName, familySamples))
+        return "".join(openMetrics).encode(), "".join(prometheus).encode()
+
+# Run readings from the history file through EnergyAccounts, e.g. to work out the energy for a billing period.
+# Readings are streamed, so this works for ranges of any length.
+def accountHistory(store, start=None, end=None, device=None):
+    accounts = EnergyAccounts()
+    for name, snapshot in store.query(start, end, device):
+        accounts.update(name, snapshot)
+    return accounts
@@ -0,0 +1,136 @@
+#!/usr/bin/python
+
+# Cole L - https://github.com/cole8888/SRNE-Solar-Charge-Controller-Monitor
+#
+# Turn the stream of readings into events: something changed, rather than this is how things are.
+#
+# Each reading is compared with the previous one from the same controller and an event is made for every:
+# - fault that appears ("faultRaised") or goes away ("faultCleared"), found by comparing the fault registers bit by bit
+# - change of charging mode ("chargeMode", with "from" and "to")
+# - time the load output turns on or off ("load", with "state")
+# - time the battery state of charge drops below or climbs back above one of the thresholds ("soc", with
+#   "direction" and "threshold"). Climbing back needs hysteresis percent more, so a battery sitting right on a
+#   threshold doesn't flap.
+# - time the controller stops answering ("commsLost") or answers again ("commsRestored").
+#
+# The scripts publish each event on <topic>/events as soon as the reading comes in, so an alert only has to
+# subscribe to that topic instead of comparing full readings itself.
+
+import time
+from SolarDecoder import FAULT_BIT_NAMES
+
+FAULT_RAISED = "faultRaised"
+FAULT_CLEARED = "faultCleared"
+CHARGE_MODE = "chargeMode"
+LOAD = "load"
+SOC = "soc"
+COMMS_LOST = "commsLost"
+COMMS_RESTORED = "commsRestored"
+
+# The bits set in every possible value of one byte, highest first.
+_BYTE_BITS = tuple(tuple(bit for bit in range(7, -1, -1) if value & (1 << bit)) for value in range(256))
+
+# The bits set in the fault register as (bit, description) pairs, highest first like decodeFaults().
+def _faultBits(value):
+    bits = [bit + 8 for bit in _BYTE_BITS[(value >> 8) & 0xFF]]
+    bits += _BYTE_BITS[value & 0xFF]
+    return [(bit, FAULT_BIT_NAMES[bit]) for bit in bits]
+
+# What was last seen from one controller.
+class _DeviceState:
+    __slots__ = ("faultBits", "chargingMode", "loadEnabled", "below", "lostAt")
+
+    def __init__(self, snapshot, thresholds):
+        self.faultBits = snapshot.faultBits
+        self.chargingMode = snapshot.chargingMode
+        self.loadEnabled = snapshot.loadEnabled
+        self.below = {threshold: snapshot.batterySoc < threshold for threshold in thresholds}
+        self.lostAt = None
+
+# socThresholds: State of charge percentages to report crossing.
+# hysteresis:    Percent above a threshold the state of charge has to climb back to before it counts as above again.
+# initialFaults: Report the faults that are already active on the first reading as raised.
+class EventDetector:
+    def __init__(self, socThresholds=(20, 50, 90), hysteresis=2, initialFaults=True):
+        self.thresholds = tuple(sorted(socThresholds))
+        self.hysteresis = hysteresis
+        self.initialFaults = initialFaults
+        self.devices = {}
+
+    @staticmethod
+    def _event(device, snapshot, kind, **details):
+        event = {"device": device, "type": kind}
+        if(snapshot is not None):
+            event["unit"] = snapshot.unit
+            event["timestamp"] = snapshot.timestamp
+        else:
+            event["timestamp"] = time.time()
+        event.update(details)
+        return event
+
+    # The events for a new reading, as a list of dictionaries. Usually empty.
+    def check(self, device, snapshot):
+        events = []
+        state = self.devices.get(device)
+        if(state is None):
+            state = self.devices[device] = _DeviceState(snapshot, self.thresholds)
+            if(self.initialFaults):
+                for bit, name in _faultBits(snapshot.faultBits):
+                    events.append(self._event(device, snapshot, FAULT_RAISED, fault=name, bit=bit))
+            return events
+
+        if(state.lostAt is not None):
+            events.append(self._event(device, snapshot, COMMS_RESTORED, downSeconds=round(time.monotonic() - state.lostAt, 1)))
+            state.lostAt = None
+
+        # Only the bits that changed need looking at, nearly always none.
+        changed = snapshot.faultBits ^ state.faultBits
+        if(changed):
+            for bit, name in _faultBits(changed):
+                raised = snapshot.faultBits & (1 << bit)
+                events.append(self._event(device, snapshot, FAULT_RAISED if raised else FAULT_CLEARED, fault=name, bit=bit))
+            state.faultBits = snapshot.faultBits
+
+        if(snapshot.chargingMode != state.chargingMode):
+            events.append(self._event(device, snapshot, CHARGE_MODE, **{"from": state.chargingMode, "to": snapshot.chargingMode}))
+            state.chargingMode = snapshot.chargingMode
+
+        if(snapshot.loadEnabled != state.loadEnabled):
+            events.append(self._event(device, snapshot, LOAD, state=snapshot.loadEnabled))
+            state.loadEnabled = snapshot.loadEnabled
+
+        soc = snapshot.batterySoc
+        for threshold in self.thresholds:
+            below = state.below[threshold]
+            if(not below and soc < threshold):
+                state.below[threshold] = True
+                events.append(self._event(device, snapshot, SOC, direction="below", threshold=threshold, soc=soc))
+            elif(below and soc >= threshold + self.hysteresis):
+                state.below[threshold] = False
+                events.append(self._event(device, snapshot, SOC, direction="above", threshold=threshold, soc=soc))
+        return events
+
+    # The events for a failed read, a "commsLost" the first time only.
+    def checkError(self, device, error):
+        state = self.devices.get(device)
+        if(state is None or state.lostAt is not None):
+            return []
+        state.lostAt = time.monotonic()
+        return [self._event(device, None, COMMS_LOST, error=str(error))]
+
+# Short description of an event for the console.
+def eventToText(event):
+    kind = event["type"]
+    if(kind in (FAULT_RAISED, FAULT_CLEARED)):
+        detail = event["fault"]
+    elif(kind == CHARGE_MODE):
+        detail = "%s -> %s" % (event["from"], event["to"])
+    elif(kind == LOAD):
+        detail = "on" if event["state"] else "off"
+    elif(kind == SOC):
+        detail = "%s %d%% (%d%%)" % (event["direction"], event["threshold"], event["soc"])
+    elif(kind == COMMS_RESTORED):
+        detail = "after %ss" % event["downSeconds"]
+    else:
+        detail = event.get("error", "")
+    return "%s: %s %s" % (event["device"], kind, detail)
@@ -0,0 +1,232 @@
+#!/usr/bin/python
+
+# Cole L - https://github.com/cole8888/SRNE-Solar-Charge-Controller-Monitor
+#
+# Get the readings back out of history files (see SolarStore.py), for analysis or to fill gaps on the broker.
+#
+#   python3 SolarExport.py export solar-history.db --out solar.csv
+#   python3 SolarExport.py export site1.db site2.db --format parquet --out solar.parquet --device CC1 --start 2024-01-01
+#   python3 SolarExport.py backfill solar-history.db --start 2024-06-01 --end 2024-06-02 --rate 50
+#
+# Readings are streamed from the files a chunk at a time, so memory use stays the same whether the range is an hour
+# or years. Every reading is decoded into the same values as a live read (one column per field of the register map).
+# Parquet needs the pyarrow library and is written in row groups of CHUNK_ROWS readings.
+#
+# backfill publishes the readings to <device>/backfill as batches like the outbox backlog (see SolarOutbox.py), at
+# no more than --rate readings a second so the broker and its subscribers aren't flooded.
+
+import argparse
+import csv
+import os
+import sys
+import time
+from datetime import datetime, timezone
+from SolarDecoder import REGISTER_MAP, FIELD_NAMES, UNSIGNED, FLAG, CHARGE_MODE, decodeRegisters
+from SolarFormats import Encoder, FORMATS, JSON_MIN
+from SolarStore import HistoryStore
+
+CSV = "csv"
+PARQUET = "parquet"
+
+# Readings per Parquet row group, and per write for CSV.
+CHUNK_ROWS = 10000
+
+# Columns written for every reading, the decoded fields follow.
+BASE_COLUMNS = ("device", "unit", "timestamp", "time")
+COLUMNS = BASE_COLUMNS + FIELD_NAMES + ("loadEnabled",)
+
+# A date (2024-06-01), date and time (2024-06-01T12:00) in local time, or a unix timestamp.
+def parseTime(value):
+    if(value is None):
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise argparse.ArgumentTypeError("not a date or unix timestamp: %r" % value)
+
+def openHistory(path):
+    if(not os.path.exists(path)):
+        raise SystemExit("No such history file: " + path)
+    # retentionDays=None so opening an old file for export never deletes anything.
+    return HistoryStore(path, retentionDays=None)
+
+# (device, Snapshot) for every reading in the files, one file after the other, oldest first within a file.
+def readHistory(paths, start=None, end=None, devices=None):
+    for path in paths:
+        history = openHistory(path)
+        try:
+            for device in (devices or [None]):
+                for name, unit, timestamp, registers in history.queryRegisters(start, end, device):
+                    yield name, decodeRegisters(registers, unit, timestamp)
+        finally:
+            history.close()
+
+# One reading as a row of COLUMNS, the time column is a datetime in UTC.
+def _row(device, snapshot):
+    row = [device, snapshot.unit, snapshot.timestamp, datetime.fromtimestamp(snapshot.timestamp, timezone.utc)]
+    row.extend(getattr(snapshot, name) for name in FIELD_NAMES)
+    row.append(snapshot.loadEnabled)
+    return row
+
+def exportCsv(readings, file):
+    writer = csv.writer(file)
+    writer.writerow(COLUMNS)
+    count = 0
+    rows = []
+    for device, snapshot in readings:
+        row = _row(device, snapshot)
+        row[3] = row[3].isoformat()
+        rows.append(row)
+        if(len(rows) >= CHUNK_ROWS):
+            writer.writerows(rows)
+            count += len(rows)
+            rows = []
+    writer.writerows(rows)
+    return count + len(rows)
+
+def _importPyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Parquet export needs the pyarrow library: pip install pyarrow")
+    return pyarrow, pyarrow.parquet
+
+# Parquet column types, worked out from the register map.
+def parquetSchema(pa):
+    fields = [
+        pa.field("device", pa.string()),
+        pa.field("unit", pa.int16()),
+        pa.field("timestamp", pa.float64()),
+        pa.field("time", pa.timestamp("ms", tz="UTC")),
+    ]
+    for register in REGISTER_MAP:
+        if(register.kind == UNSIGNED):
+            kind = pa.int32() if register.scale == 1 else pa.float64()
+        elif(register.kind == FLAG):
+            kind = pa.bool_()
+        elif(register.kind == CHARGE_MODE):
+            kind = pa.string()
+        else:
+            kind = pa.int32()
+        fields.append(pa.field(register.name, kind))
+    fields.append(pa.field("loadEnabled", pa.bool_()))
+    return pa.schema(fields)
+
+def exportParquet(readings, path):
+    pa, pq = _importPyarrow()
+    schema = parquetSchema(pa)
+    names = schema.names
+    count = 0
+    columns = [[] for name in names]
+    with pq.ParquetWriter(path, schema, compression="zstd") as writer:
+        def writeChunk():
+            writer.write_table(pa.table(columns, schema=schema))
+            for column in columns:
+                column.clear()
+
+        for device, snapshot in readings:
+            for column, value in zip(columns, _row(device, snapshot)):
+                column.append(value)
+            count += 1
+            if(len(columns[0]) >= CHUNK_ROWS):
+                writeChunk()
+        if(columns[0] or count == 0):
+            writeChunk()
+    return count
+
+# Publish the readings to <device>/backfill in batches of batchSize, at no more than rate readings a second.
+def backfill(readings, client, encoder, batchSize=50, rate=20, suffix="/backfill"):
+    nextSend = time.monotonic()
+    sent = 0
+    batch = []
+    device = None
+
+    def send():
+        nonlocal nextSend, sent
+        wait = nextSend - time.monotonic()
+        if(wait > 0):
+            time.sleep(wait)
+        # QoS 1 and waiting for it, so at most one batch is in flight and nothing piles up in memory.
+        client.publish(device + suffix, encoder.encodeBatch(batch), qos=1).wait_for_publish()
+        sent += len(batch)
+        # If publishing itself is slower than the rate, carry on from now rather than trying to catch up.
+        nextSend = max(nextSend, time.monotonic() - 1) + (len(batch)/rate if rate else 0)
+
+    for name, snapshot in readings:
+        if(batch and (name != device or len(batch) >= batchSize)):
+            send()
+            batch = []
+        device = name
+        batch.append(snapshot)
+    if(batch):
+        send()
+    return sent
+
+def connectMqtt(args):
+    from paho.mqtt import client as mqtt_client
+    client = mqtt_client.Client(args.client_id)
+    if(args.user is not None):
+        client.username_pw_set(args.user, args.password)
+    client.connect(args.broker, args.mqtt_port)
+    client.loop_start()
+    return client
+
+def main():
+    parser = argparse.ArgumentParser(description="Export or republish readings from SolarStore history files.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    for name, help in (("export", "write the readings to a CSV or Parquet file"), ("backfill", "republish the readings to an MQTT broker")):
+        command = commands.add_parser(name, help=help)
+        command.add_argument("history", nargs="+", help="history file(s) written by SolarStore.py")
+        command.add_argument("--device", action="append", help="only this controller, can be given more than once")
+        command.add_argument("--start", type=parseTime, help="first reading to include, a date, date and time or unix timestamp")
+        command.add_argument("--end", type=parseTime, help="last reading to include")
+
+    export = commands.choices["export"]
+    export.add_argument("--format", choices=(CSV, PARQUET), help="output format, by default worked out from --out (csv)")
+    export.add_argument("--out", help="file to write, standard output if left out (CSV only)")
+
+    republish = commands.choices["backfill"]
+    republish.add_argument("--rate", type=float, default=20, help="readings a second to publish at most (default 20)")
+    republish.add_argument("--batch", type=int, default=50, help="readings per message (default 50)")
+    republish.add_argument("--suffix", default="/backfill", help="added to the device name to make the topic (default /backfill)")
+    republish.add_argument("--payload-format", default=JSON_MIN, choices=FORMATS, help="payload format (default JSON_MIN)")
+    republish.add_argument("--broker", default="192.168.2.50", help="MQTT broker address")
+    republish.add_argument("--mqtt-port", type=int, default=1883)
+    republish.add_argument("--user")
+    republish.add_argument("--password")
+    republish.add_argument("--client-id", default="SolarExport")
+    args = parser.parse_args()
+
+    readings = readHistory(args.history, args.start, args.end, args.device)
+    started = time.monotonic()
+    if(args.command == "export"):
+        outputFormat = args.format or (PARQUET if args.out and args.out.endswith(".parquet") else CSV)
+        if(outputFormat == PARQUET):
+            if(not args.out):
+                raise SystemExit("Parquet export needs --out")
+            try:
+                count = exportParquet(readings, args.out)
+            except ImportError as e:
+                raise SystemExit(str(e))
+        elif(args.out):
+            with open(args.out, "w", newline="") as file:
+                count = exportCsv(readings, file)
+        else:
+            count = exportCsv(readings, sys.stdout)
+        print("Exported %d readings in %.1fs" % (count, time.monotonic() - started), file=sys.stderr)
+    else:
+        client = connectMqtt(args)
+        try:
+            count = backfill(readings, client, Encoder(args.payload_format), args.batch, args.rate, args.suffix)
+        finally:
+            client.loop_stop()
+            client.disconnect()
+        print("Published %d readings in %.1fs" % (count, time.monotonic() - started), file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+#!/usr/bin/python
+
+# Cole L - https://github.com/cole8888/SRNE-Solar-Charge-Controller-Monitor
+#
+# Serve the latest readings over HTTP for Prometheus (or anything else that scrapes OpenMetrics).
+#
+# The page is rendered when a reading comes in, not when it is scraped. Each reading updates that controller's
+# lines and the whole page is joined into one buffer, so a scrape only hands out the buffer: it never reads the
+# controller or formats a number, and any number of scrapers can poll as often as they like.
+#
+# The live values are gauges. The lifetime amp hour and energy totals (registers 0x0118 - 0x011F) and the
+# over-discharge / full charge counts are counters, so rate() and increase() work on them. The totals are in Ah
+# and Wh, the units the controller counts in.
+#
+#   exporter = MetricsExporter(9105).start()
+#   exporter.update("CC1", snapshot)
+#   curl http://localhost:9105/metrics
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from SolarDecoder import chargeModes, faultCodes
+from SolarStats import _label
+
+PREFIX = "srne_"
+
+GAUGE = "gauge"
+COUNTER = "counter"
+
+OPENMETRICS_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+PROMETHEUS_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# A 32 bit value from two registers (high word first), the raw count rather than the scaled value.
+def _doubleRegister(snapshot, offset):
+    return (snapshot.registers[offset] << 16) | snapshot.registers[offset+1]
+
+# (name, type, help, value). value is a Snapshot field name or a function of the snapshot.
+# Counter names leave off the _total, it is added to the samples.
+_FAMILIES = (
+    ("battery_soc_percent",               GAUGE,   "Battery state of charge.",                       "batterySoc"),
+    ("battery_volts",                     GAUGE,   "Battery voltage.",                               "batteryVolts"),
+    ("battery_temperature_celsius",       GAUGE,   "Battery temperature.",                           "batteryTemp"),
+    ("controller_temperature_celsius",    GAUGE,   "Controller temperature.",                        "controllerTemp"),
+    ("charging_amps",                     GAUGE,   "Current charging the battery.",                  "chargingAmps"),
+    ("charging_watts",                    GAUGE,   "Power charging the battery.",                    "chargingWatts"),
+    ("panel_volts",                       GAUGE,   "Panel voltage.",                                 "panelVolts"),
+    ("panel_amps",                        GAUGE,   "Panel current.",                                 "panelAmps"),
+    ("load_volts",                        GAUGE,   "Load voltage.",                                  "loadVolts"),
+    ("load_amps",                         GAUGE,   "Load current.",                                  "loadAmps"),
+    ("load_watts",                        GAUGE,   "Load power.",                                    "loadWatts"),
+    ("load_on",                           GAUGE,   "1 if the load output is on.",                    lambda snapshot: int(snapshot.loadEnabled)),
+    ("battery_min_volts",                 GAUGE,   "Lowest battery voltage today.",                  "batteryMinVolts"),
+    ("battery_max_volts",                 GAUGE,   "Highest battery voltage today.",                 "batteryMaxVolts"),
+    ("charging_max_amps",                 GAUGE,   "Highest charging current today.",                "chargingMaxAmps"),
+    ("charging_max_watts",                GAUGE,   "Highest charging power today.",                  "chargingMaxWatts"),
+    ("load_max_amps",                     GAUGE,   "Highest load current today.",                    "loadMaxAmps"),
+    ("load_max_watts",                    GAUGE,   "Highest load power today.",                      "loadMaxWatts"),
+    ("charging_daily_amp_hours",          GAUGE,   "Amp hours charged today.",                       "chargingDailyAmpHours"),
+    ("load_daily_amp_hours",              GAUGE,   "Amp hours used by the load today.",              "loadDailyAmpHours"),
+    ("charging_daily_kilowatt_hours",     GAUGE,   "Energy charged today.",                          "chargingDailyPower"),
+    ("load_daily_kilowatt_hours",         GAUGE,   "Energy used by the load today.",                 "loadDailyPower"),
+    ("days_operational",                  GAUGE,   "Days the controller has been running.",          "days"),
+    ("over_discharges",                   COUNTER, "Times the battery was over-discharged.",         "overDischarges"),
+    ("full_charges",                      COUNTER, "Times the battery was fully charged.",           "fullCharges"),
+    ("charging_amp_hours",                COUNTER, "Amp hours charged over the controller's life.",  lambda snapshot: _doubleRegister(snapshot, 24)),
+    ("load_amp_hours",                    COUNTER, "Amp hours used by the load over the controller's life.", lambda snapshot: _doubleRegister(snapshot, 26)),
+    ("charging_watt_hours",               COUNTER, "Energy charged over the controller's life.",     lambda snapshot: _doubleRegister(snapshot, 28)),
+    ("load_watt_hours",                   COUNTER, "Energy used by the load over the controller's life.", lambda snapshot: _doubleRegister(snapshot, 30)),
+    ("fault_bits",                        GAUGE,   "Raw fault register.",                            "faultBits"),
+)
+
+# Families with a line per charging mode / fault, and the read status.
+_MODE = "charging_mode"
+_FAULT = "fault"
+_UP = "up"
+_TIMESTAMP = "last_reading_timestamp_seconds"
+
+# Headers for every family in page order, for OpenMetrics and for the older Prometheus text format.
+def _headers(openMetrics):
+    headers = []
+    families = [(_UP, GAUGE, "1 if the last read of the controller worked.")]
+    families += [(_TIMESTAMP, GAUGE, "Unix time of the last good reading.")]
+    families += [(name, kind, text) for name, kind, text, value in _FAMILIES]
+    families += [(_MODE, GAUGE, "1 for the mode the controller is charging in.")]
+    families += [(_FAULT, GAUGE, "1 for each fault the controller reports.")]
+    for name, kind, text in families:
+        # Prometheus text names the counter family after its samples, OpenMetrics without the _total.
+        family = PREFIX + name + ("_total" if kind == COUNTER and not openMetrics else "")
+        headers.append(("# HELP %s %s\n# TYPE %s %s\n" % (family, text, family, kind)).encode())
+    return headers
+
+_OPENMETRICS_HEADERS = _headers(True)
+_PROMETHEUS_HEADERS = _headers(False)
+
+# The lines for one controller, one bytes object per family.
+class _DeviceLines:
+    def __init__(self, device, unit):
+        self.labels = 'device="%s",unit="%d"' % (_label(device), unit)
+        self.up = ("%sup{%s} 1\n" % (PREFIX, self.labels)).encode()
+        self.down = ("%sup{%s} 0\n" % (PREFIX, self.labels)).encode()
+        self.samples = None
+
+    def render(self, snapshot):
+        labels = self.labels
+        samples = [self.up, ("%s%s{%s} %s\n" % (PREFIX, _TIMESTAMP, labels, snapshot.timestamp)).encode()]
+        for name, kind, text, value in _FAMILIES:
+            value = getattr(snapshot, value) if isinstance(value, str) else value(snapshot)
+            if(value is True or value is False):
+                value = int(value)
+            suffix = "_total" if kind == COUNTER else ""
+            samples.append(("%s%s%s{%s} %s\n" % (PREFIX, name, suffix, labels, value)).encode())
+        samples.append("".join(
+            '%s%s{%s,mode="%s"} %d\n' % (PREFIX, _MODE, labels, mode, mode == snapshot.chargingMode) for mode in chargeModes
+        ).encode())
+        active = set(snapshot.faults)
+        samples.append("".join(
+            '%s%s{%s,fault="%s"} %d\n' % (PREFIX, _FAULT, labels, _label(fault), fault in active) for fault in faultCodes
+        ).encode())
+        self.samples = samples
+
+    # Keep the last values but report that the read failed.
+    def renderDown(self):
+        if(self.samples is None):
+            self.samples = [self.down] + [b""]*(len(_OPENMETRICS_HEADERS) - 1)
+        else:
+            self.samples[0] = self.down
+
+# Holds the rendered page and serves it.
+# port: TCP port to listen on, 9105 is not taken by any of the common exporters.
+# host: Address to listen on, "" for all of them.
+class MetricsExporter:
+    def __init__(self, port=9105, host=""):
+        self.port = port
+        self.host = host
+        self.lock = threading.Lock()
+        self.devices = {}
+        self.extras = {}
+        self.openMetrics = b"# EOF\n"
+        self.prometheus = b""
+        self.server = None
+        self.scrapes = 0
+
+    # A new reading for a controller.
+    def update(self, device, snapshot):
+        with self.lock:
+            lines = self.devices.get(device)
+            if(lines is None):
+                lines = self.devices[device] = _DeviceLines(device, snapshot.unit)
+            lines.render(snapshot)
+            self._build()
+
+    # A failed read for a controller.
+    def updateError(self, device, error=None, unit=1):
+        with self.lock:
+            lines = self.devices.get(device)
+            if(lines is None):
+                lines = self.devices[device] = _DeviceLines(device, unit)
+            lines.renderDown()
+            self._build()
+
+    # Add (or replace) a block of already rendered metrics, e.g. the monitor's own stats from Stats.render().
+    def updateExtra(self, name, openMetrics, prometheus):
+        with self.lock:
+            self.extras[name] = (openMetrics, prometheus)
+            self._build()
+
+    # Join the page, all the samples of a family have to be together.
+    def _build(self):
+        devices = [lines.samples for lines in self.devices.values()]
+        body = []
+        for index in range(len(_OPENMETRICS_HEADERS)):
+            body.append(b"".join(samples[index] for samples in devices))
+        openMetrics = []
+        prometheus = []
+        for index, samples in enumerate(body):
+            if(not samples):
+                continue
+            openMetrics += (_OPENMETRICS_HEADERS[index], samples)
+            prometheus += (_PROMETHEUS_HEADERS[index], samples)
+        for extraOpenMetrics, extraPrometheus in self.extras.values():
+            openMetrics.append(extraOpenMetrics)
+            prometheus.append(extraPrometheus)
+        openMetrics.append(b"# EOF\n")
+        # Swapping the references is atomic, scrapes never see a half built page.
+        self.openMetrics = b"".join(openMetrics)
+        self.prometheus = b"".join(prometheus)
+
+    # The page in the format the scraper asked for, as (content type, body).
+    def page(self, accept=""):
+        if("application/openmetrics-text" in accept):
+            return OPENMETRICS_TYPE, self.openMetrics
+        return PROMETHEUS_TYPE, self.prometheus
+
+    # Serve /metrics from a background thread.
+    def start(self):
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive, so frequent scrapers don't open a new connection every time.
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                if(self.path.split("?")[0] != "/metrics"):
+                    self.send_error(404)
+                    return
+                contentType, body = exporter.page(self.headers.get("Accept", ""))
+                exporter.scrapes += 1
+                self.send_response(200)
+                self.send_header("Content-Type", contentType)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="metrics", daemon=True).start()
+        return self
+
+    def stop(self):
+        if(self.server is not None):
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
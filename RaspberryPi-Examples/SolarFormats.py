@@ -0,0 +1,129 @@
+#!/usr/bin/python
+
+# Cole L - https://github.com/cole8888/SRNE-Solar-Charge-Controller-Monitor
+#
+# Output formats for the controller data, used for both the console and the MQTT payloads.
+#
+#   JSON     - Indented JSON, the same as JSON_Sample.json.
+#   JSON_MIN - The same JSON document without the whitespace.
+#   MSGPACK  - The JSON document encoded with MessagePack. (Needs: pip install msgpack)
+#   CBOR     - The JSON document encoded with CBOR. (Needs: pip install cbor2)
+#   PACKED   - The raw 35 registers in a fixed 82 byte layout, see PACKED_LAYOUT below.
+
+import json
+import struct
+import sys
+import time
+from SolarDecoder import REGISTER_COUNT, decodeRegisters, snapshotToDict, ERROR_DICT
+
+JSON = "JSON"
+JSON_MIN = "JSON_MIN"
+MSGPACK = "MSGPACK"
+CBOR = "CBOR"
+PACKED = "PACKED"
+
+FORMATS = (JSON, JSON_MIN, MSGPACK, CBOR, PACKED)
+
+# Bump when PACKED_LAYOUT changes so consumers can tell the layouts apart.
+PACKED_SCHEMA_VERSION = 1
+
+# Big endian:
+#   B   Schema version.
+#   B   Flags, bit 0 is set when the controller could not be read (the registers are then all 0).
+#   H   Modbus unit ID.
+#   d   Unix timestamp of the read.
+#   35H Registers 0x0100 to 0x0122 exactly as the controller returned them.
+PACKED_LAYOUT = struct.Struct(">BBHd%dH" % REGISTER_COUNT)
+PACKED_ERROR = 0x01
+
+_NO_REGISTERS = (0,)*REGISTER_COUNT
+
+def packRegisters(registers, unit=1, timestamp=None, error=False):
+    return PACKED_LAYOUT.pack(
+        PACKED_SCHEMA_VERSION,
+        PACKED_ERROR if error else 0,
+        unit,
+        time.time() if timestamp is None else timestamp,
+        *registers
+    )
+
+# Unpack a PACKED payload into (error, unit, timestamp, registers) without decoding the registers.
+def unpackRegisters(payload):
+    values = PACKED_LAYOUT.unpack(payload)
+    if(values[0] != PACKED_SCHEMA_VERSION):
+        raise ValueError("Unsupported packed schema version %d" % values[0])
+    return bool(values[1] & PACKED_ERROR), values[2], values[3], values[4:]
+
+# Decode a PACKED payload into a Snapshot, None if it was sent for a read error.
+def unpackSnapshot(payload):
+    error, unit, timestamp, registers = unpackRegisters(payload)
+    if(error):
+        return None
+    return decodeRegisters(registers, unit, timestamp)
+
+# Split a batch of PACKED records back into single payloads.
+def splitPacked(payload):
+    size = PACKED_LAYOUT.size
+    return [payload[offset:offset+size] for offset in range(0, len(payload), size)]
+
+# The optional libraries are only imported when their format is picked.
+def _importMsgpack():
+    try:
+        import msgpack
+    except ImportError:
+        raise ImportError("The MSGPACK format needs the msgpack library: pip install msgpack")
+    return msgpack.packb
+
+def _importCbor():
+    try:
+        import cbor2
+    except ImportError:
+        raise ImportError("The CBOR format needs the cbor2 library: pip install cbor2")
+    return cbor2.dumps
+
+# Turns snapshots (or any dictionary) into payloads in one format.
+class Encoder:
+    def __init__(self, payloadFormat=JSON):
+        if(payloadFormat not in FORMATS):
+            raise ValueError("Unknown format %r, pick one of %s" % (payloadFormat, ", ".join(FORMATS)))
+        self.format = payloadFormat
+        self.binary = payloadFormat in (MSGPACK, CBOR, PACKED)
+        if(payloadFormat == JSON):
+            self.dumps = lambda document: json.dumps(document, indent=4)
+        elif(payloadFormat == MSGPACK):
+            self.dumps = _importMsgpack()
+        elif(payloadFormat == CBOR):
+            self.dumps = _importCbor()
+        else:
+            # PACKED only covers whole snapshots, anything else (e.g. deltas) is sent as minified JSON.
+            self.dumps = lambda document: json.dumps(document, separators=(",", ":"))
+
+    def encode(self, snapshot):
+        if(self.format == PACKED):
+            return packRegisters(snapshot.registers, snapshot.unit, snapshot.timestamp)
+        return self.dumps(snapshotToDict(snapshot))
+
+    # Several snapshots in one payload, e.g. readings replayed after the broker was unreachable.
+    # PACKED batches are the packed records back to back, the others are a list of documents with a timestamp added.
+    def encodeBatch(self, snapshots):
+        if(self.format == PACKED):
+            return b"".join(packRegisters(snapshot.registers, snapshot.unit, snapshot.timestamp) for snapshot in snapshots)
+        documents = []
+        for snapshot in snapshots:
+            document = snapshotToDict(snapshot)
+            document["timestamp"] = snapshot.timestamp
+            documents.append(document)
+        return self.dumps(documents)
+
+    def encodeError(self, unit=1, timestamp=None):
+        if(self.format == PACKED):
+            return packRegisters(_NO_REGISTERS, unit, timestamp, error=True)
+        return self.dumps(ERROR_DICT)
+
+# Print a payload to the console, binary payloads are written as raw bytes so they can be piped to another program.
+def printPayload(payload):
+    if(isinstance(payload, bytes)):
+        sys.stdout.buffer.write(payload)
+        sys.stdout.buffer.flush()
+    else:
+        print(payload)
@@ -0,0 +1,317 @@
+#!/usr/bin/python
+
+# Cole L - https://github.com/cole8888/SRNE-Solar-Charge-Controller-Monitor
+#
+# Collect the readings pushed by any number of ESP32 / ESP8266 nodes (see My-Current-Setup) and feed them to the
+# same outputs as the Pi scripts: history file, energy totals, Prometheus metrics and rollups.
+#
+# The nodes send the JSON document from JSON_Sample.json, one per controller. The gateway takes it
+# - from MQTT, subscribed to --topic (default "+", the firmware publishes to CC1, CC2, ...), the topic is the name,
+# - as UDP datagrams on --udp-port: the controller's name, a newline, then the document,
+# - as HTTP POSTs to http://<gateway>:<--http-port>/<name> with the document as the body.
+# The Pi scripts' own MQTT payloads ("JSON" / "JSON_MIN" in "FULL" mode) have the same shape, so they can be
+# collected too.
+#
+#   python3 SolarGateway.py --broker 192.168.2.50 --history solar-history.db --energy solar-energy.json --metrics-port 9105
+#
+# Receiving does no parsing: a payload that is byte for byte the same as the last one from that node within
+# --dedup-seconds (a QoS 1 redelivery, or a node heard over two transports) is dropped straight away, everything
+# else is queued for a worker. Each node always goes to the same worker, so its readings stay in order, and the
+# worker turns the document into a Snapshot in one pass over a precomputed layout (snapshotFromDict() in
+# SolarDecoder.py). Install orjson (pip install orjson) and it is used instead of json to parse the payloads.
+# Documents that fail validation are counted and the first problem from each node is printed.
+
+import argparse
+import json
+import queue
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from SolarDecoder import snapshotFromDict
+from SolarPipeline import Pipeline, Sink
+
+try:
+    from orjson import loads as _loads
+except ImportError:
+    _loads = json.loads
+
+# Payloads waiting for each worker, the oldest is dropped when a worker falls this far behind.
+MAX_QUEUE = 1000
+
+# Put on a worker's queue to stop it.
+_STOP = object()
+
+# A node's controller, handed to the outputs like a Device from SolarPoller.py.
+class Node:
+    __slots__ = ("name", "unit")
+
+    def __init__(self, name, unit=1):
+        self.name = name
+        self.unit = unit
+
+    def __repr__(self):
+        return "Node(%r)" % self.name
+
+# Raised for (and handed to the outputs' onError) a document saying the node couldn't read its controller.
+class NodeReadError(Exception):
+    pass
+
+# Takes payloads from any number of threads, drops duplicates and decodes them on a pool of worker threads.
+# Every decoded reading goes to pipeline.publish(node, snapshot), see SolarPipeline.py.
+# workers:      Number of worker threads, a node's payloads are always handled by the same one.
+# dedupSeconds: A payload equal to the node's last one is dropped if it came less than this many seconds later.
+class Gateway:
+    def __init__(self, pipeline, workers=2, dedupSeconds=2.0):
+        self.pipeline = pipeline
+        self.dedupSeconds = dedupSeconds
+        self.lock = threading.Lock()
+        self.nodes = {}
+        self.last = {}          # Name: (payload, time received) of the last payload taken.
+        self.errors = {}        # Name: first problem printed for the node.
+        self.counts = {"received": 0, "duplicate": 0, "accepted": 0, "rejected": 0, "dropped": 0}
+        self.queues = [queue.Queue(MAX_QUEUE) for index in range(workers)]
+        self.threads = [
+            threading.Thread(target=self._work, args=(work,), name="gateway-%d" % index, daemon=True)
+            for index, work in enumerate(self.queues)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    # A payload from a node, from whichever thread received it. Never blocks.
+    def receive(self, name, payload, receivedAt=None):
+        receivedAt = time.time() if receivedAt is None else receivedAt
+        with self.lock:
+            self.counts["received"] += 1
+            last = self.last.get(name)
+            if(last is not None and last[0] == payload and receivedAt - last[1] < self.dedupSeconds):
+                self.counts["duplicate"] += 1
+                return False
+            self.last[name] = (payload, receivedAt)
+            node = self.nodes.get(name)
+            if(node is None):
+                node = self.nodes[name] = Node(name)
+        work = self.queues[hash(name) % len(self.queues)]
+        while True:
+            try:
+                work.put_nowait((node, payload, receivedAt))
+                return True
+            except queue.Full:
+                pass
+            try:
+                work.get_nowait()
+                with self.lock:
+                    self.counts["dropped"] += 1
+            except queue.Empty:
+                pass
+
+    def _work(self, work):
+        publish = self.pipeline.publish
+        while True:
+            item = work.get()
+            if(item is _STOP):
+                return
+            node, payload, receivedAt = item
+            try:
+                snapshot = snapshotFromDict(_loads(payload), node.unit, receivedAt)
+            except Exception as e:
+                # A bad payload must never stop the worker, or every node it serves would go quiet.
+                self._reject(node, e)
+                continue
+            with self.lock:
+                self.counts["accepted"] += 1
+            if(snapshot is None):
+                self.pipeline.publishError(node, NodeReadError(node.name + " could not read its controller"))
+            else:
+                publish(node, snapshot)
+
+    def _reject(self, node, error):
+        with self.lock:
+            self.counts["rejected"] += 1
+            first = node.name not in self.errors
+            if(first):
+                self.errors[node.name] = str(error)
+        if(first):
+            print(f"{node.name}: Rejected payload:", error)
+
+    # Counts since starting, and the number of nodes heard from.
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counts)
+            stats["nodes"] = len(self.nodes)
+        stats["queued"] = sum(work.qsize() for work in self.queues)
+        return stats
+
+    # The counts as metrics, see MetricsExporter.updateExtra().
+    def render(self):
+        stats = self.stats()
+        samples = "".join(
+            'srne_gateway_payloads_total{result="%s"} %d\n' % (result, stats[result])
+            for result in ("received", "duplicate", "accepted", "rejected", "dropped")
+        )
+        nodes = "srne_gateway_nodes %d\n" % stats["nodes"]
+        openMetrics = "# HELP srne_gateway_payloads Payloads taken in by the gateway.\n# TYPE srne_gateway_payloads counter\n" + samples
+        prometheus = "# HELP srne_gateway_payloads_total Payloads taken in by the gateway.\n# TYPE srne_gateway_payloads_total counter\n" + samples
+        header = "# HELP srne_gateway_nodes Nodes heard from.\n# TYPE srne_gateway_nodes gauge\n"
+        return (openMetrics + header + nodes).encode(), (prometheus + header + nodes).encode()
+
+    # Let the workers finish what is queued and stop them.
+    def stop(self, timeout=5):
+        for work in self.queues:
+            work.put(_STOP)
+        for thread in self.threads:
+            thread.join(timeout)
+
+# Subscribe to the nodes' topics, the topic is used as the node's name.
+def listenMqtt(gateway, broker, port=1883, topics=("+",), user=None, password=None, clientId="SolarGateway"):
+    from paho.mqtt import client as mqtt_client
+
+    def onConnect(client, userdata, flags, rc):
+        if rc == 0:
+            print("Connected to MQTT Broker!")
+            # Subscribed again on every connect, paho doesn't keep subscriptions across reconnects.
+            for topic in topics:
+                client.subscribe(topic)
+        else:
+            print("Failed to connect, return code %d\n", rc)
+
+    client = mqtt_client.Client(clientId)
+    if(user is not None):
+        client.username_pw_set(user, password)
+    client.on_connect = onConnect
+    client.on_message = lambda client, userdata, message: gateway.receive(message.topic, message.payload)
+    client.connect_async(broker, port)
+    client.loop_start()
+    return client
+
+# Take "<name>\n<document>" datagrams on a UDP port, from a background thread.
+def listenUdp(gateway, port, host=""):
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind((host, port))
+
+    def serve():
+        while True:
+            try:
+                datagram = server.recv(65535)
+            except OSError:
+                return
+            name, separator, payload = datagram.partition(b"\n")
+            if(separator and name):
+                gateway.receive(name.decode("utf-8", "replace").strip(), payload)
+
+    threading.Thread(target=serve, name="gateway-udp", daemon=True).start()
+    return server
+
+# Take POST /<name> requests with the document as the body, from a background thread.
+def listenHttp(gateway, port, host=""):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            name = self.path.strip("/")
+            length = int(self.headers.get("Content-Length") or 0)
+            payload = self.rfile.read(length)
+            if(not name or not payload):
+                self.send_response(400)
+            else:
+                gateway.receive(name, payload)
+                # Decoded later by a worker, so this only says the payload was taken.
+                self.send_response(202)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="gateway-http", daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Collect readings from ESP32 / ESP8266 nodes and store or export them.")
+    parser.add_argument("--broker", help="MQTT broker to subscribe to the nodes' topics on")
+    parser.add_argument("--mqtt-port", type=int, default=1883)
+    parser.add_argument("--user")
+    parser.add_argument("--password")
+    parser.add_argument("--client-id", default="SolarGateway")
+    parser.add_argument("--topic", action="append", help="topic to subscribe to, can be given more than once (default +)")
+    parser.add_argument("--udp-port", type=int, help="take <name>\\n<document> datagrams on this port")
+    parser.add_argument("--http-port", type=int, help="take POST /<name> requests on this port")
+    parser.add_argument("--workers", type=int, default=2, help="threads decoding the payloads (default 2)")
+    parser.add_argument("--dedup-seconds", type=float, default=2.0, help="drop a payload equal to the node's last one within this many seconds (default 2)")
+    parser.add_argument("--history", help="SQLite file to save the readings in (see SolarStore.py)")
+    parser.add_argument("--retention-days", type=float, default=30)
+    parser.add_argument("--energy", help="JSON file to keep energy totals per node and for the site in (see SolarEnergy.py)")
+    parser.add_argument("--metrics-port", type=int, help="serve the latest readings for Prometheus on this port")
+    parser.add_argument("--stats-interval", type=float, default=60, help="print the payload counts this often in seconds (default 60)")
+    args = parser.parse_args()
+    if(args.broker is None and args.udp_port is None and args.http_port is None):
+        parser.error("give at least one of --broker, --udp-port or --http-port")
+
+    # Every output runs in its own thread (see SolarPipeline.py), so a slow disk can't hold up the others.
+    pipeline = Pipeline()
+    history = None
+    if(args.history is not None):
+        from SolarStore import HistoryStore
+        history = HistoryStore(args.history, args.retention_days)
+        pipeline.add(Sink("history", lambda node, snapshot: history.add(node.name, snapshot), maxQueue=MAX_QUEUE))
+    exporter = None
+    if(args.metrics_port is not None):
+        from SolarExporter import MetricsExporter
+        exporter = MetricsExporter(args.metrics_port).start()
+        pipeline.add(Sink("metrics",
+            lambda node, snapshot: exporter.update(node.name, snapshot),
+            lambda node, e: exporter.updateError(node.name, e, node.unit),
+            maxQueue=MAX_QUEUE
+        ))
+    energy = None
+    if(args.energy is not None):
+        from SolarEnergy import EnergyAccounts
+        energy = EnergyAccounts(args.energy, reportInterval=args.stats_interval)
+
+        def account(node, snapshot):
+            energy.update(node.name, snapshot)
+            if(exporter is not None and energy.due()):
+                exporter.updateExtra("energy", *energy.render())
+
+        pipeline.add(Sink("energy", account, maxQueue=MAX_QUEUE))
+
+    gateway = Gateway(pipeline, args.workers, args.dedup_seconds)
+    client = udp = http = None
+    if(args.broker is not None):
+        client = listenMqtt(gateway, args.broker, args.mqtt_port, args.topic or ["+"], args.user, args.password, args.client_id)
+    if(args.udp_port is not None):
+        udp = listenUdp(gateway, args.udp_port)
+    if(args.http_port is not None):
+        http = listenHttp(gateway, args.http_port)
+
+    try:
+        while True:
+            time.sleep(args.stats_interval)
+            stats = gateway.stats()
+            print("Gateway: %(nodes)d nodes, %(received)d received, %(duplicate)d duplicates, %(rejected)d rejected, %(dropped)d dropped" % stats)
+            drops = pipeline.newDrops()
+            if(drops):
+                print("Outputs falling behind, readings dropped:", drops)
+            if(exporter is not None):
+                exporter.updateExtra("gateway", *gateway.render())
+    except KeyboardInterrupt:
+        print("\nStopping...")
+    finally:
+        if(client is not None):
+            client.loop_stop()
+            client.disconnect()
+        if(udp is not None):
+            udp.close()
+        if(http is not None):
+            http.shutdown()
+        gateway.stop()
+        pipeline.stop()
+        if(energy is not None):
+            energy.close()
+        if(history is not None):
+            history.close()
+        if(exporter is not None):
+            exporter.stop()
+
+if __name__ == "__main__":
+    main()
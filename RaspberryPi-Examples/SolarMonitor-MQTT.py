@@ -12,70 +12,73 @@
 # If you are having trouble getting this to work, create an issue and I'll see if I can help.
 
 import atexit
-import time
 import json
-from pymodbus.client.sync import ModbusSerialClient as ModbusClient
+import queue
+import time
 from paho.mqtt import client as mqtt_client
+from SolarConnection import ModbusConnection
+from SolarDecoder import BASE_ADDRESS, snapshotToText
+from SolarFormats import Encoder, printPayload
+from SolarStore import HistoryStore
+from SolarExporter import MetricsExporter
+from SolarStats import Stats
+from SolarOutbox import Outbox
+from SolarRollup import RollupEngine, RESOLUTIONS, RESOLUTION_NAMES
+from SolarPipeline import Pipeline, Sink, Ticker
+from SolarReadPlan import ReadPlan, TIERED_BLOCKS, FULL_BLOCKS
+from SolarDelta import DeltaPublisher
+from SolarEvents import EventDetector, eventToText
+from SolarBurst import Burst, parseSeconds
+from SolarControl import ControlQueue, parseCommand
+from SolarEnergy import EnergyAccounts
 
+SERIAL_PORT = '/dev/ttyS0'        # Serial device the charge controller is connected to. (Or the simulator's port, see SolarSimulator.py)
 DELAY_BETWEEN_REQUESTS = 3        # Number of seconds to wait in between requests to the charge controller.
-JSON_OR_TEXT = "TEXT"             # Output format, either "TEXT" or "JSON".
+OUTPUT_FORMAT = "TEXT"            # Console output format, "TEXT" or one of the formats in SolarFormats.py ("JSON", "JSON_MIN", "MSGPACK", "CBOR", "PACKED").
+ADAPTIVE_POLLING = True           # Read the daily and lifetime registers less often than the live ones.
+NIGHT_DELAY = 30                  # Number of seconds to wait in between requests while the panels have no voltage.
+HISTORY_FILE = None               # SQLite file to keep a local history of the readings in, e.g. 'solar-history.db'. None to turn it off. (See SolarStore.py)
+HISTORY_RETENTION_DAYS = 30       # Readings older than this many days are deleted from the history file.
+OUTBOX_FILE = None                # SQLite file to queue readings in while the MQTT broker is unreachable, e.g. 'solar-outbox.db'. (See SolarOutbox.py)
+METRICS_PORT = None               # Serve the latest readings for Prometheus on this port at /metrics, e.g. 9105. None to turn it off. (See SolarExporter.py)
+STATS_INTERVAL = 60               # Publish the monitor's own stats (read times, bus use, errors, output queues) this often in seconds. None to turn it off. (See SolarStats.py)
+ROLLUPS = []                      # Publish (and save to the history file) min/max/mean/energy rollups of these sizes: "minute", "hour", "day". (See SolarRollup.py)
+EVENTS_ENABLED = True             # Publish faults raised/cleared, charging mode changes, load on/off and SOC_THRESHOLDS crossings to <topic>/events. (See SolarEvents.py)
+SOC_THRESHOLDS = (20, 50, 90)     # Battery state of charge percentages to publish an event for when crossed.
+BURST_ENABLED = True              # Publish the number of seconds to <topic>/burst/set for a high rate capture of the battery and PV values on <topic>/burst. (See SolarBurst.py)
+BURST_SECONDS = 10                # Length of a burst when the command has no number.
+ENERGY_FILE = None                # JSON file to keep running energy and amp hour totals in, e.g. 'solar-energy.json'. None to turn it off. (See SolarEnergy.py)
+ENERGY_INTERVAL = 60              # Publish the totals to <topic>/energy this often in seconds.
+WRITES_ENABLED = False            # Take setting changes (e.g. {"loadEnabled": false}) on <topic>/set and write them to the controller, the outcome goes to <topic>/set/result. (See SolarControl.py)
 MQTT_PORT = 1883
 MQTT_SERVER_ADDR = '192.168.2.50'
 MQTT_USER = 'CHANGE_ME!!!'
 MQTT_PASS = 'CHANGE_ME!!!'
 MQTT_CLIENT_ID = 'RaspberryPiSolar'
 MQTT_TOPIC_NAME = 'CC1'
+PUBLISH_MODE = "FULL"             # "FULL" sends everything every time, "DELTA" or "FIELDS" only send what changed. (See SolarDelta.py)
+KEYFRAME_INTERVAL = 300           # In "DELTA" / "FIELDS" mode, send the full document this often (seconds) so late subscribers can catch up.
+PAYLOAD_FORMAT = "JSON"           # MQTT payload format, one of the formats in SolarFormats.py. The web interface needs "JSON" or "JSON_MIN".
 
-# Array of charging mode strings.
-# These are the states the charge controller can be in when charging the battery.
-chargeModes = [
-    "OFF",      #0
-    "NORMAL",   #1
-    "MPPT",     #2
-    "EQUALIZE", #3
-    "BOOST",    #4
-    "FLOAT",    #5
-    "CUR_LIM"   #6 (Current limiting)
-]
+# Connection to the charge controller, the port is opened on the first read and reopened if it fails. (See SolarConnection.py)
+# MAX3232 Breakout board connects to the raspberry pi serial pins and to the charge controller RS232 port.
+# See pictures for details.
+modbus = ModbusConnection(SERIAL_PORT, baudrate=9600, timeout=5)
 
-# Array of fault codes.
-# These are all the possible faults the charge controller can indicate.
-# Multiple faults can be thrown at the same time.
-faultCodes = [
-    "Charge MOS short circuit",      #0
-    "Anti-reverse MOS short",        #1
-    "PV panel reversely connected",  #2
-    "PV working point over voltage", #3
-    "PV counter current",            #4
-    "PV input side over-voltage",    #5
-    "PV input side short circuit",   #6
-    "PV input overpower",            #7
-    "Ambient temp too high",         #8
-    "Controller temp too high",      #9
-    "Load over-power/current",       #10
-    "Load short circuit",            #11
-    "Battery undervoltage warning",  #12
-    "Battery overvoltage",           #13
-    "Battery over-discharge"         #14
-]
+# Burst lengths asked for over MQTT, taken by the poll loop so the bursts don't collide with the normal reads.
+burstRequests = queue.Queue()
 
-# Create ModbusClient instance and connect
-# MAX3232 Breakout board connects to the raspberry pi serial pins and to the charge controller RS232 port. See pictures for details.
-modbus = ModbusClient(method='rtu', port='/dev/ttyS0', baudrate=9600, stopbits = 1, bytesize = 8, parity = 'N', timeout = 5, unit = 1) 
-a = modbus.connect()
+# Setting changes asked for over MQTT, written by the poll loop after its next read.
+control = ControlQueue()
 
-# Used to reconnect on controller timeout.
-def reconnectModbus():
-    global a
-    global modbus
-    modbus = ModbusClient(method='rtu', port='/dev/ttyS0', baudrate=9600, stopbits = 1, bytesize = 8, parity = 'N', timeout = 5, unit = 1) 
-    a = modbus.connect()
-
-    # Retry connection to charge controller if it fails.
-    while(not a):
-        print("Failed to connect to the Charge Controller, retrying in 5 seconds...")
-        time.sleep(5)
-        a = modbus.connect()
+# Queue the setting changes in a command, the outcome is published to <topic>/set/result once they are written.
+def onSetCommand(client, payload):
+    publishResult = lambda result: client.publish(MQTT_TOPIC_NAME + "/set/result", json.dumps(result), qos=1)
+    try:
+        control.set(parseCommand(payload), publishResult)
+    except ValueError as e:
+        print("Ignoring command:", e)
+        publishResult({"ok": False, "settings": {}, "errors": [str(e)]})
 
 # Connect to the MQTT Broker.
 def connectMqtt():
@@ -84,197 +87,197 @@ def connectMqtt():
             print("Connected to MQTT Broker!")
         else:
             print("Failed to connect, return code %d\n", rc)
+            return
+        # Subscribed again on every connect, paho doesn't keep subscriptions across reconnects.
+        if(BURST_ENABLED):
+            client.subscribe(MQTT_TOPIC_NAME + "/burst/set")
+        if(WRITES_ENABLED):
+            client.subscribe(MQTT_TOPIC_NAME + "/set")
+
+    def onMessage(client, userdata, message):
+        if(message.topic == MQTT_TOPIC_NAME + "/set"):
+            onSetCommand(client, message.payload)
+            return
+        seconds = parseSeconds(message.payload, BURST_SECONDS)
+        if(seconds is None):
+            print("Ignoring burst command, not a number of seconds:", message.payload)
+        else:
+            burstRequests.put(seconds)
 
     client = mqtt_client.Client(MQTT_CLIENT_ID)
     client.username_pw_set(MQTT_USER, MQTT_PASS)
     client.on_connect = onConnect
-    client.connect(MQTT_SERVER_ADDR, MQTT_PORT)
+    client.on_message = onMessage
+    if(OUTBOX_FILE is not None):
+        # Don't wait for the broker, readings are queued in the outbox until it is reachable.
+        client.connect_async(MQTT_SERVER_ADDR, MQTT_PORT)
+    else:
+        client.connect(MQTT_SERVER_ADDR, MQTT_PORT)
+    # Network traffic, and reconnecting when the broker goes away, is handled in paho's own thread.
+    client.loop_start()
     return client
 
 # Publish the controller data to the MQTT Broker.
-def publish(client, response, error):
-    result = client.publish(MQTT_TOPIC_NAME, convertToJson(response, error))
-    status = result[0]
-    if status == 0:
+def publish(publisher, snapshot, error):
+    if(error):
+        status = publisher.publishError()
+    else:
+        status = publisher.publish(snapshot)
+    if status:
         print(f"Sent to topic `{MQTT_TOPIC_NAME}`")
     else:
         print(f"Failed to send message to topic {MQTT_TOPIC_NAME}")
 
+# Publish a finished rollup to <topic>/rollup/<size> and save it to the history file.
+def publishRollup(publisher, history, device, bucket):
+    publisher.send(device + "/rollup/" + RESOLUTION_NAMES[bucket.resolution], publisher.encoder.dumps(bucket.toDict()))
+    if(history is not None):
+        history.addRollup(device, bucket)
+
+# Publish each event from a reading to <topic>/events as its own message.
+def publishEvents(publisher, events):
+    for event in events:
+        print("Event:", eventToText(event))
+        # QoS 1 so paho retries it if the connection drops, an alert shouldn't go missing.
+        publisher.send(MQTT_TOPIC_NAME + "/events", json.dumps(event), qos=1)
+
+# Count a reading into the energy totals, and every ENERGY_INTERVAL publish them to <topic>/energy (retained).
+def accountEnergy(publisher, exporter, energy, device, snapshot):
+    energy.update(device, snapshot)
+    if(energy.due()):
+        publisher.send(MQTT_TOPIC_NAME + "/energy", json.dumps(energy.device(device)), retain=True)
+        if(exporter is not None):
+            exporter.updateExtra("energy", *energy.render())
+
+# Read the battery and PV registers as fast as possible for a while and publish them as one batch to <topic>/burst.
+def runBurst(publisher, seconds):
+    print("Burst capture for %gs..." % seconds)
+    burst = Burst(seconds).capture(modbus.read, unit=1)
+    print("Burst: %d samples in %.1fs (%.1f a second), %d errors" % (burst.samples, burst.duration, burst.rate(), burst.errors))
+    publisher.send(MQTT_TOPIC_NAME + "/burst", json.dumps(burst.toDict(MQTT_TOPIC_NAME)), qos=1)
+
 # When program exits, close the modbus connection.
 def exit_handler(client):
         print("\nClosing Modbus Connection...")
         modbus.close()
+        client.loop_stop()
         client.disconnect()
 
-# Account for negative temperatures.
-def getRealTemp(temp):
-    if(temp/int(128) > 1):
-        return -(temp%128)
-    return temp
+# Read the registers that are due from the charge controller and decode them.
+def readController(plan):
+    now = time.monotonic()
+    for offset, count in plan.due(now):
+        plan.update(offset, modbus.read(BASE_ADDRESS + offset, count, unit=1), now)
+    return plan.snapshot()
 
 # Display the output in text format.
-def printDataText(response):
-    # Offset to apply when determining the charging mode.
-    # This only applies when the load is turned on since they share a register.
-    loadOffset = 32768 if response.registers[32] > 6 else 0
-
-    # Charging modes
-    chargeMode = chargeModes[response.registers[32]-loadOffset]
-
-    # Determine if there are any faults / what they mean.
-    faults = "None :)"
-    faultID = response.registers[34]
-    if(faultID != 0):
-        faults = ""
-        count = 0
-        while(faultID != 0):
-            if(faultID >= pow(2, 15-count)):
-                # If there is more than one error, make a new line.
-                if(count > 0):
-                    faults += '\n'
-                faults += '- ' + faultCodes[count-1]
-                faultID -= pow(2, 15-count)
-            count += 1
-
-    # Realtime information
-    print("\n------------- Real Time Data -------------")
-    print("Charging Mode:\t\t\t" + chargeMode)
-    print("Battery SOC:\t\t\t" + str(response.registers[0]) + "%")
-    print("Battery Voltage:\t\t" + str(round(float(response.registers[1]*0.1), 1)) + "V")
-    print("Battery Charge Current:\t\t" + str(round(float(response.registers[2]*0.01), 2)) + "A")
-    print("Controller Temperature:\t\t" + str(getRealTemp(int(hex(response.registers[3])[2:-2], 16))) + "*C")
-    print("Battery Temperature:\t\t" + str(getRealTemp(int(hex(response.registers[3])[-2:], 16))) + "*C")
-    print("Load Voltage:\t\t\t" + str(round(float(response.registers[4]*0.1), 1)) + " V")
-    print("Load Current:\t\t\t" + str(round(float(response.registers[5]*0.01), 2)) + " A")
-    print("Load Power:\t\t\t" + str(response.registers[6]) + " Watts")
-    print("Load Enabled:\t\t\t" + str(response.registers[32] > 6))
-    print("Panel Volts:\t\t\t" + str(round(float(response.registers[7]*0.1), 1)) + "V")
-    print("Panel Amps:\t\t\t" + str(round(float(response.registers[8]*0.01), 2)) + "A")
-    print("Panel Power:\t\t\t" + str(response.registers[9]) + "W")
-
-    # Data accumulated over the day
-    print("--------------- DAILY DATA ---------------")
-    print("Battery Minimum Voltage:\t" + str(round(float(response.registers[11]*0.1), 1)) + "V")
-    print("Battery Maximum Voltage:\t" + str(round(float(response.registers[12]*0.1), 1)) + "V")
-    print("Maximum Charge Current:\t\t" + str(round(float(response.registers[13]*0.01), 2)) + "A")
-    print("Maximum Charge Power:\t\t" + str(response.registers[15]) + "W")
-    print("Maximum Load Discharge Current:\t" + str(float(response.registers[14])*0.01) + "A")
-    print("Maximum Load Discharge Power:\t" + str(response.registers[16]) + "W")
-    print("Charge Amp Hours:\t\t" + str(response.registers[17]) + "Ah")
-    print("Charge Power:\t\t\t" + str(round(float(response.registers[19]*0.001), 3)) + "KWh")
-    print("Load Amp Hours:\t\t\t" + str(response.registers[18]) + "Ah")
-    print("Load Power:\t\t\t" + str(round(float(response.registers[20]*0.001), 3)) + "KWh")
-
-    # Data from the lifetime of the charge controller
-    print("------------- LIFETIME DATA --------------")
-    print("Days Operational:\t\t" + str(response.registers[21]) + " Days")
-    print("Times Over Discharged:\t\t" + str(response.registers[22]))
-    print("Times Fully Charged:\t\t" + str(response.registers[23]))
-    print("Cumulative Amp Hours:\t\t" + str(round(float((response.registers[24]*65536 + response.registers[25])*0.001), 3)) + "KAh")
-    print("Cumulative Power:\t\t" + str(round(float((response.registers[28]*65536 + response.registers[29])*0.001), 3)) + "KWh")
-    print("Load Amp Hours:\t\t\t" + str(round(float((response.registers[26]*65536 + response.registers[27])*0.001), 3)) + "KAh")
-    print("Load Power:\t\t\t" + str(round(float((response.registers[30]*65536 + response.registers[31])*0.001), 3)) + "KWh")
-    print("------------------------------------------")
-
-    print("--------------- FAULT DATA ---------------")
-    print(faults)
-    print("RAW Fault Data:\t\t\t" + str(response.registers[34]))
-    print("------------------------------------------")
-
-# Convert the register data to a JSON string. (For JSON print option)
-def convertToJson(response, error):
-    json_string = ""
-    nested_dict = {}
+def printDataText(snapshot):
+    print(snapshotToText(snapshot))
 
+# Print the controller data to the console in one of the SolarFormats formats.
+def printData(encoder, snapshot, error):
     if(error):
-        nested_dict = {
-            "modbusError": error,
-        }
+        printPayload(encoder.encodeError())
     else:
-        # Offset to apply when determining the charging mode.
-        # This only applies when the load is turned on since they share a register.
-        loadOffset = 32768 if response.registers[32] > 6 else 0
-
-        # Determine if there are any faults / what they mean.
-        faults = []
-        faultID = response.registers[34]
-        if(faultID != 0):
-            count = 0
-            while(faultID != 0):
-                if(faultID >= pow(2, 15-count)):
-                    faults.append(faultCodes[count-1])
-                    faultID -= pow(2, 15-count)
-                count += 1
+        printPayload(encoder.encode(snapshot))
 
-        nested_dict = {
-            "modbusError": error,
-            "controller": {
-                "chargingMode": chargeModes[response.registers[32]-loadOffset],
-                "temperature": getRealTemp(int(hex(response.registers[3])[2:-2], 16)),
-                "days": response.registers[21],
-                "overDischarges": response.registers[22],
-                "fullCharges": response.registers[23]
-            },
-            "charging": {
-                "amps": round(float(response.registers[2]*0.01), 2),
-                "maxAmps": round(float(response.registers[13]*0.01), 2),
-                "watts": response.registers[9],
-                "maxWatts": response.registers[15],
-                "dailyAmpHours": response.registers[17],
-                "totalAmpHours": round(float((response.registers[24]*65536 + response.registers[25])*0.001), 3),
-                "dailyPower": round(float(response.registers[19]*0.001), 3),
-                "totalPower": round(float((response.registers[28]*65536 + response.registers[29])*0.001), 3)
-            },
-            "battery": {
-                "stateOfCharge": response.registers[0],
-                "volts": round(float(response.registers[1]*0.1), 1),
-                "minVolts": round(float(response.registers[11]*0.1), 1),
-                "maxVolts": round(float(response.registers[12]*0.1), 1),
-                "temperature": getRealTemp(int(hex(response.registers[3])[-2:], 16))
-            },
-            "panels": {
-                "volts": round(float(response.registers[7]*0.1), 1),
-                "amps": round(float(response.registers[8]*0.01), 2)
-            },
-            "load": {
-                "state": True if response.registers[10] else False,
-                "volts": round(float(response.registers[4]*0.1), 1),
-                "amps": round(float(response.registers[5]*0.01), 2),
-                "watts": response.registers[6],
-                "maxAmps": response.registers[14]*0.01,
-                "maxWatts": response.registers[16],
-                "dailyAmpHours": response.registers[18],
-                "totalAmpHours": round(float((response.registers[26]*65536 + response.registers[27])*0.001), 3),
-                "dailyPower": round(float(response.registers[20]*0.001), 3),
-                "totalPower": str(round(float((response.registers[30]*65536 + response.registers[31])*0.001), 3))
-            },
-            "faults": faults
-        }
-    json_string = json.dumps(nested_dict, indent=4)
-    return json_string
+# Publish the monitor's own stats to <topic>/stats and add them to the metrics page.
+def publishStats(stats, publisher, exporter):
+    publisher.send(MQTT_TOPIC_NAME + "/stats", json.dumps(stats.collect()))
+    if(exporter is not None):
+        exporter.updateExtra("stats", *stats.render())
 
 def run():
     client = connectMqtt()
+    # Registers 0x0100 (Decimal 256) until 0x0122 (Decimal 290) are read, either all at once or split by how often they change.
+    if(ADAPTIVE_POLLING):
+        plan = ReadPlan(TIERED_BLOCKS, DELAY_BETWEEN_REQUESTS, NIGHT_DELAY)
+    else:
+        plan = ReadPlan(FULL_BLOCKS, DELAY_BETWEEN_REQUESTS, None)
+    console = None if OUTPUT_FORMAT == "TEXT" else Encoder(OUTPUT_FORMAT)
+    history = None
+    if(HISTORY_FILE is not None):
+        history = HistoryStore(HISTORY_FILE, HISTORY_RETENTION_DAYS)
+        # Write out the readings still in memory when the program exits.
+        atexit.register(history.close)
+    outbox = None
+    if(OUTBOX_FILE is not None):
+        outbox = Outbox(OUTBOX_FILE)
+        atexit.register(outbox.close)
+    publisher = DeltaPublisher(client, MQTT_TOPIC_NAME, PUBLISH_MODE, keyframeInterval=KEYFRAME_INTERVAL, encoder=Encoder(PAYLOAD_FORMAT), outbox=outbox)
+    rollups = None
+    if(ROLLUPS):
+        rollups = RollupEngine(lambda device, bucket: publishRollup(publisher, history, device, bucket), [RESOLUTIONS[name] for name in ROLLUPS])
     if client.is_connected:
         atexit.register(exit_handler, client)
+
+        # Every output runs in its own thread (see SolarPipeline.py), so a slow broker or terminal can't delay the next read.
+        pipeline = Pipeline()
+        if(EVENTS_ENABLED):
+            # Added first so the events go out ahead of the full reading.
+            detector = EventDetector(SOC_THRESHOLDS)
+            pipeline.add(Sink("events",
+                lambda device, snapshot: publishEvents(publisher, detector.check(device, snapshot)),
+                lambda device, e: publishEvents(publisher, detector.checkError(device, e))
+            ))
+
+        def printError(device, e):
+            if(console is None):
+                print("Failed to read data:", e)
+            else:
+                printData(console, None, True)
+
+        if(console is None):
+            pipeline.add(Sink("console", lambda device, snapshot: printDataText(snapshot), printError))
+        else:
+            pipeline.add(Sink("console", lambda device, snapshot: printData(console, snapshot, False), printError))
+        # Saved separately from publishing so the reading is kept even if the broker is down.
+        if(history is not None):
+            pipeline.add(Sink("history", history.add))
+        if(rollups is not None):
+            pipeline.add(Sink("rollups", rollups.add))
+        exporter = None
+        if(METRICS_PORT is not None):
+            exporter = MetricsExporter(METRICS_PORT).start()
+            pipeline.add(Sink("metrics", exporter.update, exporter.updateError))
+        if(ENERGY_FILE is not None):
+            energy = EnergyAccounts(ENERGY_FILE, reportInterval=ENERGY_INTERVAL)
+            atexit.register(energy.close)
+            pipeline.add(Sink("energy", lambda device, snapshot: accountEnergy(publisher, exporter, energy, device, snapshot)))
+        pipeline.add(Sink("mqtt", lambda device, snapshot: publish(publisher, snapshot, False), lambda device, e: publish(publisher, None, True)))
+        # Runs before the files and connections are closed, let the outputs finish what they have queued.
+        atexit.register(pipeline.stop)
+        stats = None
+        if(STATS_INTERVAL is not None):
+            stats = Stats(STATS_INTERVAL)
+            stats.watchConnection(modbus, {1: MQTT_TOPIC_NAME})
+            stats.watchPipeline(pipeline)
+
+        ticker = Ticker()
         while True:
             try:
-                # Read 35 registers from the controller starting at address 0x0100 (Decimal 256) until 0x0122 (Decimal 290)
-                response = modbus.read_holding_registers(256, 35, unit=1)
-                if(JSON_OR_TEXT == "TEXT"):
-                    printDataText(response)
-                else:
-                    print(convertToJson(response, False))
-                publish(client, response, False)
-                time.sleep(DELAY_BETWEEN_REQUESTS)
+                # Decode once, all the outputs use the same snapshot.
+                pipeline.publish(MQTT_TOPIC_NAME, readController(plan))
+                delay = plan.delay()
+            except Exception as e:
+                pipeline.publishError(MQTT_TOPIC_NAME, e)
+                delay = DELAY_BETWEEN_REQUESTS
+            drops = pipeline.newDrops()
+            if(drops):
+                print("Outputs falling behind, readings dropped:", drops)
+            if(stats is not None and stats.due()):
+                publishStats(stats, publisher, exporter)
+            # Written between reads, on the same connection, so they never collide with the polling.
+            if(control.pending()):
+                result = control.flush(modbus, unit=1)
+                print("Settings written:" if result["ok"] else "Settings NOT written:", result)
+            try:
+                runBurst(publisher, burstRequests.get_nowait())
+            except queue.Empty:
+                pass
             except Exception as e:
-                if(JSON_OR_TEXT == "TEXT"):
-                    print("Failed to read data, reconnecting...", e)
-                else:
-                    print(convertToJson(None, True))
-                publish(client, None, True)
-                reconnectModbus()
-                time.sleep(DELAY_BETWEEN_REQUESTS)
+                print("Burst capture failed:", e)
+            ticker.wait(delay)
     else:
         print("Failed to connect to MQTT Broker.")
 
@@ -0,0 +1,258 @@
+#!/usr/bin/python
+
+# Cole L - https://github.com/cole8888/SRNE-Solar-Charge-Controller-Monitor
+#
+# Used to gather data from several SRNE charge controllers at once and print it, optionally publishing it to an MQTT broker.
+#
+# List your controllers in DEVICES. Controllers on an RS485 bus can share a serial port as long as each one has its
+# own unit ID. Controllers on different ports are read at the same time.
+#
+# If you are having trouble getting this to work, create an issue and I'll see if I can help.
+
+import asyncio
+import json
+from SolarFormats import Encoder, printPayload
+from SolarPoller import Device, Poller
+from SolarDelta import DeltaPublisher
+from SolarStore import HistoryStore
+from SolarExporter import MetricsExporter
+from SolarStats import Stats
+from SolarOutbox import Outbox
+from SolarRollup import RollupEngine, RESOLUTIONS, RESOLUTION_NAMES
+from SolarPipeline import Pipeline, Sink
+from SolarEvents import EventDetector, eventToText
+from SolarBurst import Burst, parseSeconds
+from SolarControl import parseCommand
+from SolarEnergy import EnergyAccounts
+
+OUTPUT_FORMAT = "JSON"            # Console output format, "TEXT" or one of the formats in SolarFormats.py ("JSON", "JSON_MIN", "MSGPACK", "CBOR", "PACKED").
+MQTT_ENABLED = False              # Also publish each controller to its own topic on the MQTT broker.
+MQTT_PORT = 1883
+MQTT_SERVER_ADDR = '192.168.2.50'
+MQTT_USER = 'CHANGE_ME!!!'
+MQTT_PASS = 'CHANGE_ME!!!'
+MQTT_CLIENT_ID = 'RaspberryPiSolarMulti'
+PUBLISH_MODE = "FULL"             # "FULL" sends everything every time, "DELTA" or "FIELDS" only send what changed. (See SolarDelta.py)
+KEYFRAME_INTERVAL = 300           # In "DELTA" / "FIELDS" mode, send the full document this often (seconds) so late subscribers can catch up.
+PAYLOAD_FORMAT = "JSON"           # MQTT payload format, one of the formats in SolarFormats.py. The web interface needs "JSON" or "JSON_MIN".
+HISTORY_FILE = None               # SQLite file to keep a local history of the readings in, e.g. 'solar-history.db'. None to turn it off. (See SolarStore.py)
+HISTORY_RETENTION_DAYS = 30       # Readings older than this many days are deleted from the history file.
+OUTBOX_FILE = None                # SQLite file to queue readings in while the MQTT broker is unreachable, e.g. 'solar-outbox.db'. (See SolarOutbox.py)
+METRICS_PORT = None               # Serve the latest readings for Prometheus on this port at /metrics, e.g. 9105. None to turn it off. (See SolarExporter.py)
+STATS_INTERVAL = 60               # Publish the monitor's own stats to <MQTT_CLIENT_ID>/stats (read times, bus use, errors, output queues) this often in seconds. None to turn it off. (See SolarStats.py)
+ROLLUPS = []                      # Publish (and save to the history file) min/max/mean/energy rollups of these sizes: "minute", "hour", "day". (See SolarRollup.py)
+EVENTS_ENABLED = True             # Print (and publish to <topic>/events) faults raised/cleared, charging mode changes, load on/off and SOC_THRESHOLDS crossings. (See SolarEvents.py)
+SOC_THRESHOLDS = (20, 50, 90)     # Battery state of charge percentages to report an event for when crossed.
+BURST_ENABLED = True              # Publish the number of seconds to <topic>/burst/set for a high rate capture of the battery and PV values on <topic>/burst. (See SolarBurst.py)
+BURST_SECONDS = 10                # Length of a burst when the command has no number.
+ENERGY_FILE = None                # JSON file to keep running energy and amp hour totals in, per controller and for the whole site, e.g. 'solar-energy.json'. None to turn it off. (See SolarEnergy.py)
+ENERGY_INTERVAL = 60              # Publish the totals to <MQTT_CLIENT_ID>/energy this often in seconds.
+WRITES_ENABLED = False            # Take setting changes (e.g. {"loadEnabled": false}) on <topic>/set and write them to the controller, the outcome goes to <topic>/set/result. (See SolarControl.py)
+
+# The controllers to poll. The name is used as the MQTT topic.
+DEVICES = [
+    Device('CC1', port='/dev/ttyS0', unit=1, interval=3),
+    Device('CC2', port='/dev/ttyUSB0', unit=1, interval=3),
+    Device('CC3', port='/dev/ttyUSB0', unit=2, interval=10),
+]
+
+# Connect to the MQTT Broker.
+def connectMqtt():
+    from paho.mqtt import client as mqtt_client
+
+    def onConnect(client, userdata, flags, rc):
+        if rc == 0:
+            print("Connected to MQTT Broker!")
+        else:
+            print("Failed to connect, return code %d\n", rc)
+            return
+        # Subscribed again on every connect, paho doesn't keep subscriptions across reconnects.
+        if(BURST_ENABLED):
+            for device in DEVICES:
+                client.subscribe(device.name + "/burst/set")
+        if(WRITES_ENABLED):
+            for device in DEVICES:
+                client.subscribe(device.name + "/set")
+
+    client = mqtt_client.Client(MQTT_CLIENT_ID)
+    client.username_pw_set(MQTT_USER, MQTT_PASS)
+    client.on_connect = onConnect
+    if(OUTBOX_FILE is not None):
+        # Don't wait for the broker, readings are queued in the outbox until it is reachable.
+        client.connect_async(MQTT_SERVER_ADDR, MQTT_PORT)
+    else:
+        client.connect(MQTT_SERVER_ADDR, MQTT_PORT)
+    # Network traffic runs in paho's own thread so publishing never holds up the serial ports.
+    client.loop_start()
+    return client
+
+def run():
+    client = connectMqtt() if MQTT_ENABLED else None
+    # One publisher per controller, each keeps track of what it last sent.
+    publishers = {}
+    outbox = None
+    if(client is not None):
+        encoder = Encoder(PAYLOAD_FORMAT)
+        # One outbox shared by all the controllers, backlog messages still go to each controller's own topic.
+        outbox = Outbox(OUTBOX_FILE) if OUTBOX_FILE is not None else None
+        for device in DEVICES:
+            publishers[device.name] = DeltaPublisher(client, device.name, PUBLISH_MODE, keyframeInterval=KEYFRAME_INTERVAL, encoder=encoder, outbox=outbox)
+    console = None if OUTPUT_FORMAT == "TEXT" else Encoder(OUTPUT_FORMAT)
+    history = HistoryStore(HISTORY_FILE, HISTORY_RETENTION_DAYS) if HISTORY_FILE is not None else None
+
+    # Publish a finished rollup to <topic>/rollup/<size> and save it to the history file.
+    def onRollup(device, bucket):
+        if(device in publishers):
+            publisher = publishers[device]
+            publisher.send(device + "/rollup/" + RESOLUTION_NAMES[bucket.resolution], publisher.encoder.dumps(bucket.toDict()))
+        if(history is not None):
+            history.addRollup(device, bucket)
+
+    rollups = RollupEngine(onRollup, [RESOLUTIONS[name] for name in ROLLUPS]) if ROLLUPS else None
+
+    def printSnapshot(device, snapshot):
+        if(console is None):
+            print(f"{device.name}: Battery {snapshot.batterySoc}% {snapshot.batteryVolts}V, Panels {snapshot.panelVolts}V {snapshot.chargingWatts}W, {snapshot.chargingMode}")
+        else:
+            if(not console.binary):
+                print(device.name + ":")
+            printPayload(console.encode(snapshot))
+
+    def publishSnapshot(device, snapshot):
+        if(not publishers[device.name].publish(snapshot)):
+            print(f"Failed to send message to topic {device.name}")
+
+    def publishError(device, e):
+        if(not publishers[device.name].publishError(device.unit)):
+            print(f"Failed to send message to topic {device.name}")
+
+    detector = EventDetector(SOC_THRESHOLDS)
+
+    # Print each event and publish it to <topic>/events as its own message.
+    def sendEvents(device, events):
+        for event in events:
+            print("Event:", eventToText(event))
+            if(device.name in publishers):
+                # QoS 1 so paho retries it if the connection drops, an alert shouldn't go missing.
+                publishers[device.name].send(device.name + "/events", json.dumps(event), qos=1)
+
+    # Every output runs in its own thread (see SolarPipeline.py), so a slow broker or terminal can't delay the serial ports.
+    pipeline = Pipeline()
+    if(EVENTS_ENABLED):
+        # Added first so the events go out ahead of the full reading.
+        pipeline.add(Sink("events",
+            lambda device, snapshot: sendEvents(device, detector.check(device.name, snapshot)),
+            lambda device, e: sendEvents(device, detector.checkError(device.name, e))
+        ))
+    pipeline.add(Sink("console", printSnapshot, lambda device, e: print(f"{device.name}: Failed to read data.", e)))
+    # Saved separately from publishing so the reading is kept even if the broker is down.
+    if(history is not None):
+        pipeline.add(Sink("history", lambda device, snapshot: history.add(device.name, snapshot)))
+    if(rollups is not None):
+        pipeline.add(Sink("rollups", lambda device, snapshot: rollups.add(device.name, snapshot)))
+    exporter = None
+    if(METRICS_PORT is not None):
+        exporter = MetricsExporter(METRICS_PORT).start()
+        pipeline.add(Sink("metrics", lambda device, snapshot: exporter.update(device.name, snapshot), lambda device, e: exporter.updateError(device.name, e, device.unit)))
+    energy = EnergyAccounts(ENERGY_FILE, reportInterval=ENERGY_INTERVAL) if ENERGY_FILE is not None else None
+
+    # Count a reading into the totals, and every ENERGY_INTERVAL publish the site and controller totals (retained).
+    def accountEnergy(device, snapshot):
+        energy.update(device.name, snapshot)
+        if(energy.due()):
+            if(client is not None):
+                client.publish(MQTT_CLIENT_ID + "/energy", json.dumps(energy.report()), retain=True)
+            if(exporter is not None):
+                exporter.updateExtra("energy", *energy.render())
+
+    if(energy is not None):
+        pipeline.add(Sink("energy", accountEnergy))
+    if(client is not None):
+        pipeline.add(Sink("mqtt", publishSnapshot, publishError))
+
+    poller = Poller(DEVICES, lambda device, snapshot: afterRead(device, snapshot, None), lambda device, e: afterRead(device, None, e))
+    if(client is not None):
+        # Command topic: (device, command). Names can contain "/", so the topics are matched whole.
+        commands = {}
+        for device in DEVICES:
+            commands[device.name + "/burst/set"] = (device, "burst/set")
+            commands[device.name + "/set"] = (device, "set")
+
+        # Read the battery and PV registers as fast as possible for a while and publish them as one batch to <topic>/burst.
+        def onBurst(device, burst):
+            print(f"{device.name}: Burst of {burst.samples} samples in {burst.duration:.1f}s ({burst.rate():.1f} a second), {burst.errors} errors")
+            publishers[device.name].send(device.name + "/burst", json.dumps(burst.toDict(device.name, device.unit)), qos=1)
+
+        def onBurstCommand(device, payload):
+            seconds = parseSeconds(payload, BURST_SECONDS)
+            if(seconds is None):
+                print(f"{device.name}: Ignoring burst command, not a number of seconds:", payload)
+                return
+            print(f"{device.name}: Burst capture for {seconds:g}s...")
+            try:
+                poller.requestBurst(device, Burst(seconds), onBurst)
+            except Exception as e:
+                print(f"{device.name}: Burst capture failed:", e)
+
+        # Queue the setting changes, they are written after the controller's next read. (See SolarControl.py)
+        def onSetCommand(device, payload):
+            def publishResult(result):
+                print(f"{device.name}: Settings written:" if result["ok"] else f"{device.name}: Settings NOT written:", result)
+                client.publish(device.name + "/set/result", json.dumps(result), qos=1)
+            try:
+                poller.control(device).set(parseCommand(payload), publishResult)
+            except ValueError as e:
+                print(f"{device.name}: Ignoring command:", e)
+                client.publish(device.name + "/set/result", json.dumps({"ok": False, "settings": {}, "errors": [str(e)]}), qos=1)
+
+        def onMessage(client, userdata, message):
+            device, command = commands.get(message.topic, (None, None))
+            if(device is None):
+                return
+            if(command == "burst/set" and BURST_ENABLED):
+                onBurstCommand(device, message.payload)
+            elif(command == "set" and WRITES_ENABLED):
+                onSetCommand(device, message.payload)
+
+        client.on_message = onMessage
+
+    stats = None
+    if(STATS_INTERVAL is not None):
+        stats = Stats(STATS_INTERVAL)
+        for port, bus in poller.buses.items():
+            stats.watchConnection(bus.connection, {device.unit: device.name for device in DEVICES if device.port == port})
+        stats.watchPipeline(pipeline)
+
+    def afterRead(device, snapshot, error):
+        if(error is None):
+            pipeline.publish(device, snapshot)
+        else:
+            pipeline.publishError(device, error)
+        drops = pipeline.newDrops()
+        if(drops):
+            print("Outputs falling behind, readings dropped:", drops)
+        if(stats is not None and stats.due()):
+            report = stats.collect()
+            if(client is not None):
+                client.publish(MQTT_CLIENT_ID + "/stats", json.dumps(report))
+            if(exporter is not None):
+                exporter.updateExtra("stats", *stats.render())
+
+    try:
+        asyncio.run(poller.run())
+    except KeyboardInterrupt:
+        print("\nClosing Modbus Connections...")
+    finally:
+        pipeline.stop()
+        if(energy is not None):
+            energy.close()
+        if(history is not None):
+            history.close()
+        if(outbox is not None):
+            outbox.close()
+        if(client is not None):
+            client.loop_stop()
+            client.disconnect()
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,106 @@
+#!/usr/bin/python
+
+# Cole L - https://github.com/cole8888/SRNE-Solar-Charge-Controller-Monitor
+#
+# Hold on to readings that couldn't be published and send them once the broker is reachable again.
+#
+# Readings that fail to publish are kept in an SQLite file (the same setup as SolarStore.py), so a long outage or
+# a restart doesn't lose them. Once the broker is back they are replayed, oldest first, a few batches per poll
+# cycle so replaying never holds up the polling. Each batch is one message on <topic>/backlog holding several
+# readings with their timestamps (see Encoder.encodeBatch in SolarFormats.py). Live readings keep going to <topic>.
+#
+# Memory use is bounded by memoryRows and disk use by maxRows, when the file is full the oldest readings are dropped.
+
+import threading
+from SolarDecoder import decodeRegisters
+from SolarStore import openDatabase, packRegisters, unpackRegisters
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY,
+    topic TEXT NOT NULL,
+    unit INTEGER NOT NULL,
+    timestamp REAL NOT NULL,
+    registers BLOB NOT NULL
+);
+"""
+
+# path:            SQLite file to queue the readings in.
+# maxRows:         Maximum number of readings kept on disk, about 100 bytes each.
+# memoryRows:      Readings are written to disk in groups of this many.
+# batchSize:       Number of readings sent in each backlog message.
+# batchesPerDrain: Number of backlog messages sent per call to drain().
+class Outbox:
+    def __init__(self, path, maxRows=100000, memoryRows=20, batchSize=50, batchesPerDrain=4):
+        self.maxRows = maxRows
+        self.memoryRows = memoryRows
+        self.batchSize = batchSize
+        self.batchesPerDrain = batchesPerDrain
+        self.lock = threading.Lock()
+        self.pending = []
+        self.dropped = 0
+        self.connection = openDatabase(path)
+        self.connection.executescript(_SCHEMA)
+        self.stored = self.connection.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    # Number of readings waiting to be sent.
+    def __len__(self):
+        return self.stored + len(self.pending)
+
+    # Queue a reading that failed to publish.
+    def add(self, topic, snapshot):
+        with self.lock:
+            self.pending.append((topic, snapshot.unit, snapshot.timestamp, packRegisters(snapshot.registers)))
+            if(len(self.pending) >= self.memoryRows):
+                self._flush()
+
+    def _flush(self):
+        if(not self.pending):
+            return
+        with self.connection:
+            self.connection.execute("BEGIN")
+            self.connection.executemany("INSERT INTO outbox (topic, unit, timestamp, registers) VALUES (?, ?, ?, ?)", self.pending)
+            self.stored += len(self.pending)
+            if(self.stored > self.maxRows):
+                # Full, drop the oldest readings.
+                excess = self.stored - self.maxRows
+                self.connection.execute("DELETE FROM outbox WHERE id IN (SELECT id FROM outbox ORDER BY id LIMIT ?)", (excess,))
+                self.stored -= excess
+                self.dropped += excess
+        self.pending = []
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    # Send up to batchesPerDrain backlog messages. send(topic, payload) publishes one message and returns True if
+    # it was accepted. Returns the number of readings sent.
+    def drain(self, send, encoder):
+        with self.lock:
+            if(self.stored == 0 and not self.pending):
+                return 0
+            self._flush()
+            sent = 0
+            for batch in range(self.batchesPerDrain):
+                rows = self.connection.execute(
+                    "SELECT id, topic, unit, timestamp, registers FROM outbox ORDER BY id LIMIT ?", (self.batchSize,)
+                ).fetchall()
+                if(not rows):
+                    break
+                # A backlog message only holds readings for one topic.
+                topic = rows[0][1]
+                rows = [row for row in rows if row[1] == topic]
+                snapshots = [decodeRegisters(unpackRegisters(row[4]), row[2], row[3]) for row in rows]
+                if(not send(topic + "/backlog", encoder.encodeBatch(snapshots))):
+                    break
+                with self.connection:
+                    self.connection.execute("BEGIN")
+                    self.connection.executemany("DELETE FROM outbox WHERE id = ?", [(row[0],) for row in rows])
+                self.stored -= len(rows)
+                sent += len(rows)
+            return sent
+
+    def close(self):
+        with self.lock:
+            self._flush()
+            self.connection.close()
@@ -0,0 +1,125 @@
+#!/usr/bin/python
+
+# Cole L - https://github.com/cole8888/SRNE-Solar-Charge-Controller-Monitor
+#
+# Keep the polling on schedule no matter how slow the outputs are.
+#
+# The poll loop only reads the controller and hands each snapshot to the pipeline. Every output (console, MQTT,
+# history file, ...) is a Sink with its own thread and a small queue, so a slow broker or terminal only holds up
+# its own sink. When a sink falls so far behind that its queue is full, its oldest reading is dropped so it
+# catches up with current data, and the drop is counted so it can be reported.
+
+import queue
+import threading
+import time
+from SolarStats import Histogram
+
+# Put on a sink's queue to stop its thread.
+_STOP = object()
+
+# One output with its own thread.
+# onSnapshot(device, snapshot) is called for each reading and onError(device, exception) for each failed read.
+class Sink:
+    def __init__(self, name, onSnapshot, onError=None, maxQueue=50):
+        self.name = name
+        self.onSnapshot = onSnapshot
+        self.onError = onError
+        self.queue = queue.Queue(maxQueue)
+        self.dropped = 0
+        # How long each reading takes to handle and how long it waited in the queue first. (See SolarStats.py)
+        self.handleTimes = Histogram()
+        self.waitTimes = Histogram()
+        self.thread = threading.Thread(target=self._run, name="sink-" + name, daemon=True)
+        self.thread.start()
+
+    # Queue an item without ever blocking the caller.
+    def put(self, item):
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return
+            except queue.Full:
+                pass
+            try:
+                self.queue.get_nowait()
+                self.dropped += 1
+            except queue.Empty:
+                pass
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if(item is _STOP):
+                return
+            device, snapshot, error, queuedAt = item
+            started = time.monotonic()
+            try:
+                if(error is None):
+                    self.onSnapshot(device, snapshot)
+                elif(self.onError is not None):
+                    self.onError(device, error)
+            except Exception as e:
+                print(f"Output '{self.name}' failed:", e)
+            finished = time.monotonic()
+            self.waitTimes.observe(started - queuedAt)
+            self.handleTimes.observe(finished - started)
+
+    # Let the sink finish what is queued (for up to timeout seconds) and stop its thread.
+    def stop(self, timeout=5):
+        try:
+            self.queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            return
+        self.thread.join(timeout)
+
+# Hands every reading to all the sinks.
+class Pipeline:
+    def __init__(self, sinks=()):
+        self.sinks = list(sinks)
+        self.reported = {}
+
+    def add(self, sink):
+        self.sinks.append(sink)
+        return sink
+
+    def publish(self, device, snapshot):
+        queuedAt = time.monotonic()
+        for sink in self.sinks:
+            sink.put((device, snapshot, None, queuedAt))
+
+    def publishError(self, device, error):
+        queuedAt = time.monotonic()
+        for sink in self.sinks:
+            sink.put((device, None, error, queuedAt))
+
+    # Number of readings each sink has dropped since the last call, only sinks that dropped any are included.
+    def newDrops(self):
+        drops = {}
+        for sink in self.sinks:
+            count = sink.dropped - self.reported.get(sink.name, 0)
+            if(count > 0):
+                drops[sink.name] = count
+                self.reported[sink.name] = sink.dropped
+        return drops
+
+    # Queue depth of each sink.
+    def depths(self):
+        return {sink.name: sink.queue.qsize() for sink in self.sinks}
+
+    def stop(self, timeout=5):
+        for sink in self.sinks:
+            sink.stop(timeout)
+
+# Sleeps until the next poll is due on the monotonic clock, so the time taken by the poll itself doesn't add up.
+class Ticker:
+    def __init__(self):
+        self.next = time.monotonic()
+
+    def wait(self, interval):
+        self.next += interval
+        delay = self.next - time.monotonic()
+        if(delay > 0):
+            time.sleep(delay)
+        else:
+            # Fell behind (e.g. a read timed out), start counting again from now rather than rushing to catch up.
+            self.next = time.monotonic()
@@ -0,0 +1,223 @@
+#!/usr/bin/python
+
+# Cole L - https://github.com/cole8888/SRNE-Solar-Charge-Controller-Monitor
+#
+# Poll several SRNE charge controllers from one process.
+#
+# Controllers can share a serial port (RS485, different unit IDs) or sit on their own ports. Every port gets its
+# own asyncio task, so ports are polled concurrently, while the reads on a single port go through one worker
+# thread so two requests are never on the wire at the same time. When several controllers on a port are due,
+# they are read back to back so the bus stays busy without collisions.
+
+import asyncio
+import heapq
+from concurrent.futures import ThreadPoolExecutor
+from SolarConnection import ModbusConnection
+from SolarControl import ControlQueue
+from SolarDecoder import BASE_ADDRESS
+from SolarReadPlan import ReadPlan, TIERED_BLOCKS, FULL_BLOCKS
+
+# A charge controller to poll.
+# name:     Used to tell the controllers apart in the output (e.g. as the MQTT topic).
+# port:     Serial device the controller is connected to.
+# unit:     Modbus unit ID of the controller.
+# interval: Number of seconds between reads of this controller.
+# adaptive: Read the daily and lifetime registers less often than the live ones and back off at night. (See SolarReadPlan.py)
+# nightInterval: Number of seconds between reads while the panels have no voltage, None to keep the normal interval.
+#           Only used with adaptive, like in the single controller scripts.
+class Device:
+    def __init__(self, name, port='/dev/ttyS0', unit=1, interval=3, adaptive=True, nightInterval=30):
+        self.name = name
+        self.port = port
+        self.unit = unit
+        self.interval = interval
+        self.adaptive = adaptive
+        self.nightInterval = nightInterval
+
+    # Everything that affects how the device is polled, a device whose settings change gets a new read plan.
+    def settings(self):
+        return (self.name, self.port, self.unit, self.interval, self.adaptive, self.nightInterval)
+
+    def readPlan(self):
+        if(self.adaptive):
+            return ReadPlan(TIERED_BLOCKS, self.interval, self.nightInterval)
+        return ReadPlan(FULL_BLOCKS, self.interval, None)
+
+    def __repr__(self):
+        return "Device(%r, port=%r, unit=%r, interval=%r)" % (self.name, self.port, self.unit, self.interval)
+
+# One serial port and the connection that talks on it. (See SolarConnection.py)
+class SerialBus:
+    def __init__(self, port, baudrate=9600, timeout=5, clientFactory=None):
+        self.port = port
+        self.connection = ModbusConnection(port, baudrate, timeout, clientFactory=clientFactory)
+        # Devices polled on this port, replaced by Poller.update(). Empty to stop polling the port.
+        self.devices = []
+        # Set when the devices change, made by the bus's task so it belongs to the running event loop.
+        self.changed = None
+        # A single worker thread, the blocking pymodbus calls for this port run one at a time in it.
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="modbus-" + port.split("/")[-1])
+
+    # Blocking read, only ever called from the bus worker thread.
+    def _read(self, unit, address, count):
+        return self.connection.read(address, count, unit)
+
+    async def read(self, unit, address, count):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self._read, unit, address, count)
+
+    # Run func(connection, *args) in the bus worker thread, e.g. ControlQueue.flush.
+    async def call(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, self.connection, *args)
+
+    def health(self):
+        return self.connection.health()
+
+    def shutdown(self):
+        self.executor.submit(self.connection.close)
+        self.executor.shutdown(wait=True)
+
+# Schedules reads for a group of devices across any number of serial ports.
+# onSnapshot(device, snapshot) is called after every successful read, onError(device, exception) after a failed one.
+# clientFactory is passed on to each port's ModbusConnection, e.g. to poll simulated controllers.
+class Poller:
+    def __init__(self, devices, onSnapshot, onError=None, baudrate=9600, timeout=5, clientFactory=None):
+        self.onSnapshot = onSnapshot
+        self.onError = onError
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.clientFactory = clientFactory
+        self.buses = {}
+        self._tasks = {}
+        self._stopped = None
+        self.controls = {}
+        self._assign(devices)
+
+    # Hand each port its devices, adding ports that are new. Returns the ports that no longer have any devices.
+    def _assign(self, devices):
+        self.devices = list(devices)
+        groups = {}
+        for device in self.devices:
+            groups.setdefault(device.port, []).append(device)
+        for port, group in groups.items():
+            if(port not in self.buses):
+                self.buses[port] = SerialBus(port, self.baudrate, self.timeout, self.clientFactory)
+            self.buses[port].devices = group
+        return [port for port in self.buses if port not in groups]
+
+    def _start(self, bus):
+        if(bus.port not in self._tasks):
+            self._tasks[bus.port] = asyncio.ensure_future(self._runBus(bus))
+
+    # Change the devices being polled while running, e.g. after the configuration was reloaded. Call from the event loop.
+    # A read that is in progress is finished first. Devices whose settings didn't change keep their schedule and
+    # read plan, ports without devices are closed once their last poll is done.
+    def update(self, devices):
+        for port in self._assign(devices):
+            self.buses[port].devices = []
+        for bus in self.buses.values():
+            if(bus.changed is not None):
+                bus.changed.set()
+            if(bus.devices and self._stopped is not None):
+                self._start(bus)
+
+    # Poll the devices on one bus until it has none left.
+    async def _runBus(self, bus):
+        loop = asyncio.get_running_loop()
+        # Heap of (time the device is due, tie breaker, device), times are from the loop's monotonic clock.
+        due = []
+        plans = {}
+        devices = None
+        bus.changed = asyncio.Event()
+        try:
+            while True:
+                if(bus.devices is not devices):
+                    # Picked up between polls, so a read on the wire is never cut short.
+                    bus.changed.clear()
+                    devices = bus.devices
+                    if(not devices):
+                        return
+                    now = loop.time()
+                    dueAt = {entry[2].settings(): entry[0] for entry in due}
+                    plans = {device.settings(): plans.get(device.settings()) or device.readPlan() for device in devices}
+                    due = [(dueAt.get(device.settings(), now), index, device) for index, device in enumerate(devices)]
+                    heapq.heapify(due)
+                dueAt, index, device = due[0]
+                wait = dueAt - loop.time()
+                if(wait > 0):
+                    # Sleep until the next device is due, or the devices change.
+                    try:
+                        await asyncio.wait_for(bus.changed.wait(), wait)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                heapq.heappop(due)
+                plan = plans[device.settings()]
+                try:
+                    started = loop.time()
+                    for offset, count in plan.due(started):
+                        registers = await bus.read(device.unit, BASE_ADDRESS + offset, count)
+                        plan.update(offset, registers, started)
+                    self.onSnapshot(device, plan.snapshot(device.unit))
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    # The connection decides itself whether the port needs reopening.
+                    if(self.onError is not None):
+                        self.onError(device, e)
+                # Queued writes go out straight after the read, so they never hold up another device's poll.
+                control = self.controls.get(device.name)
+                if(control is not None and control.pending()):
+                    await bus.call(control.flush, device.unit)
+                # Keep to the device's cadence, but don't try to catch up on reads we fell behind on.
+                nextDue = dueAt + plan.delay()
+                now = loop.time()
+                heapq.heappush(due, (nextDue if nextDue > now else now, index, device))
+        finally:
+            if(not bus.devices and self.buses.get(bus.port) is bus):
+                del self.buses[bus.port]
+                del self._tasks[bus.port]
+                await loop.run_in_executor(None, bus.shutdown)
+
+    async def run(self):
+        self._stopped = asyncio.get_running_loop().create_future()
+        for bus in list(self.buses.values()):
+            self._start(bus)
+        try:
+            await self._stopped
+        finally:
+            for task in self._tasks.values():
+                task.cancel()
+            for bus in self.buses.values():
+                bus.shutdown()
+
+    # The queue of writes for a device (see SolarControl.py), they are sent after the device's next read.
+    def control(self, device):
+        control = self.controls.get(device.name)
+        if(control is None):
+            control = self.controls[device.name] = ControlQueue()
+        return control
+
+    # Run a burst capture (see SolarBurst.py) of one device, can be called from any thread.
+    # It goes through the port's worker thread, so the other devices on that port wait until it is done.
+    # onDone(device, burst) is called from the worker thread when it finishes.
+    def requestBurst(self, device, burst, onDone):
+        bus = self.buses[device.port]
+
+        def capture():
+            try:
+                burst.capture(bus.connection.read, device.unit)
+                onDone(device, burst)
+            except Exception as e:
+                print(f"{device.name}: Burst capture failed:", e)
+        bus.executor.submit(capture)
+
+    # Connection health of each serial port.
+    def health(self):
+        return {port: bus.health() for port, bus in self.buses.items()}
+
+    # Stop polling, call from the event loop.
+    def stop(self):
+        if(self._stopped is not None and not self._stopped.done()):
+            self._stopped.set_result(None)
@@ -0,0 +1,96 @@
+#!/usr/bin/python
+
+# Cole L - https://github.com/cole8888/SRNE-Solar-Charge-Controller-Monitor
+#
+# Decide which registers to read from the charge controller on each cycle.
+#
+# The PV, battery and load values change all the time, but the daily maximums only move a few times a minute and
+# the lifetime counters even less. Reading them on their own cadence keeps each cycle short at 9600 baud, which
+# lets the live values be polled faster. At night (no panel voltage) the live values are read less often too.
+
+from SolarDecoder import REGISTER_COUNT, decodeRegisters
+
+# Reading a few registers we don't need is cheaper than starting another request, so due blocks with
+# a gap of up to this many registers between them are read together.
+MAX_GAP = 4
+
+# Offset of the panel voltage register (0x0107), used to tell if it is night.
+PANEL_VOLTS = 7
+
+# A block of registers to read.
+# name:   Used to keep track of when the block was last read.
+# offset: First register, counted from 0x0100.
+# count:  Number of registers.
+# every:  Number of seconds between reads, 0 reads it every cycle.
+class Block:
+    __slots__ = ("name", "offset", "count", "every")
+
+    def __init__(self, name, offset, count, every):
+        self.name = name
+        self.offset = offset
+        self.count = count
+        self.every = every
+
+    def __repr__(self):
+        return "Block(%r, %r, %r, %r)" % (self.name, self.offset, self.count, self.every)
+
+# Live values every cycle, daily values every minute and lifetime values every 5 minutes.
+TIERED_BLOCKS = (
+    Block("realtime", 0, 11, 0),      # 0x0100 - 0x010A Battery, temperatures, load and panels.
+    Block("state", 32, 3, 0),         # 0x0120 - 0x0122 Charging mode, load state and faults.
+    Block("daily", 11, 10, 60),       # 0x010B - 0x0114 Daily minimums / maximums and totals.
+    Block("lifetime", 21, 11, 300),   # 0x0115 - 0x011F Days, counters and lifetime totals.
+)
+
+# The whole 35 register block every cycle.
+FULL_BLOCKS = (
+    Block("all", 0, REGISTER_COUNT, 0),
+)
+
+# Keeps the latest value of every register and works out what needs to be read next.
+class ReadPlan:
+    def __init__(self, blocks=TIERED_BLOCKS, interval=3, nightInterval=30, nightPanelVolts=0):
+        self.blocks = tuple(sorted(blocks, key=lambda block: block.offset))
+        self.interval = interval
+        self.nightInterval = nightInterval
+        # Panel voltage is stored in tenths of a volt.
+        self.nightPanelRaw = int(nightPanelVolts*10)
+        self.registers = [0]*REGISTER_COUNT
+        self.lastRead = {}
+
+    # Has every block been read at least once?
+    def complete(self):
+        return len(self.lastRead) == len(self.blocks)
+
+    # Ranges of registers to read now as (offset, count), with neighbouring due blocks merged.
+    def due(self, now):
+        ranges = []
+        for block in self.blocks:
+            last = self.lastRead.get(block.name)
+            if(last is not None and now - last < block.every):
+                continue
+            end = block.offset + block.count
+            if(ranges and block.offset - (ranges[-1][0] + ranges[-1][1]) <= MAX_GAP):
+                start = ranges[-1][0]
+                ranges[-1] = (start, max(end, start + ranges[-1][1]) - start)
+            else:
+                ranges.append((block.offset, block.count))
+        return ranges
+
+    # Store the registers read for a range returned by due().
+    def update(self, offset, registers, now):
+        self.registers[offset:offset+len(registers)] = registers
+        end = offset + len(registers)
+        for block in self.blocks:
+            if(block.offset >= offset and block.offset + block.count <= end):
+                self.lastRead[block.name] = now
+
+    def snapshot(self, unit=1, timestamp=None):
+        return decodeRegisters(self.registers, unit, timestamp)
+
+    def isNight(self):
+        return self.nightInterval is not None and self.complete() and self.registers[PANEL_VOLTS] <= self.nightPanelRaw
+
+    # Number of seconds to wait until the next cycle.
+    def delay(self):
+        return self.nightInterval if self.isNight() else self.interval
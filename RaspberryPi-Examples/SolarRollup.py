@@ -0,0 +1,206 @@
+#!/usr/bin/python
+
+# Cole L - https://github.com/cole8888/SRNE-Solar-Charge-Controller-Monitor
+#
+# Roll the readings up into per minute, hour and day aggregates as they come in.
+#
+# Each bucket keeps the number of readings and the min / max / mean of the live values, plus the energy charged
+# and used (watts integrated over time, in Wh). Minutes are built from the readings, hours from the finished
+# minutes and days from the finished hours, so only the open bucket of each size is kept per controller and
+# nothing is ever rescanned. Finished buckets are handed to a callback, which the scripts use to publish them
+# over MQTT and save them in the history file (see SolarStore.py).
+#
+# Buckets line up with the local clock (e.g. a day runs from local midnight to midnight).
+
+import time
+
+MINUTE = 60
+HOUR = 3600
+DAY = 86400
+
+RESOLUTION_NAMES = {
+    MINUTE: "minute",
+    HOUR: "hour",
+    DAY: "day",
+}
+
+RESOLUTIONS = {name: resolution for resolution, name in RESOLUTION_NAMES.items()}
+
+# Snapshot fields that get a min / max / mean.
+ROLLUP_FIELDS = (
+    "batterySoc",
+    "batteryVolts",
+    "chargingAmps",
+    "chargingWatts",
+    "panelVolts",
+    "panelAmps",
+    "loadVolts",
+    "loadAmps",
+    "loadWatts",
+    "controllerTemp",
+    "batteryTemp",
+)
+
+_FIELD_COUNT = len(ROLLUP_FIELDS)
+
+# Aggregates for one controller over one time bucket.
+class Bucket:
+    __slots__ = ("start", "resolution", "count", "minimum", "maximum", "total", "chargingWh", "loadWh")
+
+    def __init__(self, start, resolution):
+        self.start = start
+        self.resolution = resolution
+        self.count = 0
+        self.minimum = [None]*_FIELD_COUNT
+        self.maximum = [None]*_FIELD_COUNT
+        self.total = [0]*_FIELD_COUNT
+        self.chargingWh = 0.0
+        self.loadWh = 0.0
+
+    @property
+    def end(self):
+        return self.start + self.resolution
+
+    def addSnapshot(self, snapshot):
+        self.count += 1
+        minimum = self.minimum
+        maximum = self.maximum
+        total = self.total
+        for index, name in enumerate(ROLLUP_FIELDS):
+            value = getattr(snapshot, name)
+            total[index] += value
+            if(minimum[index] is None or value < minimum[index]):
+                minimum[index] = value
+            if(maximum[index] is None or value > maximum[index]):
+                maximum[index] = value
+
+    # Fold a finished smaller bucket into this one.
+    def merge(self, other):
+        if(other.count == 0):
+            self.chargingWh += other.chargingWh
+            self.loadWh += other.loadWh
+            return
+        self.count += other.count
+        for index in range(_FIELD_COUNT):
+            self.total[index] += other.total[index]
+            if(self.minimum[index] is None or other.minimum[index] < self.minimum[index]):
+                self.minimum[index] = other.minimum[index]
+            if(self.maximum[index] is None or other.maximum[index] > self.maximum[index]):
+                self.maximum[index] = other.maximum[index]
+        self.chargingWh += other.chargingWh
+        self.loadWh += other.loadWh
+
+    def toDict(self):
+        document = {
+            "start": self.start,
+            "resolution": RESOLUTION_NAMES.get(self.resolution, self.resolution),
+            "samples": self.count,
+        }
+        for index, name in enumerate(ROLLUP_FIELDS):
+            if(self.count == 0):
+                document[name] = None
+                continue
+            document[name] = {
+                "min": self.minimum[index],
+                "max": self.maximum[index],
+                "mean": round(self.total[index]/self.count, 3),
+            }
+        document["chargingWh"] = round(self.chargingWh, 3)
+        document["loadWh"] = round(self.loadWh, 3)
+        return document
+
+# The open buckets and last reading for one controller.
+class _DeviceRollup:
+    __slots__ = ("buckets", "lastTimestamp", "lastChargingWatts", "lastLoadWatts")
+
+    def __init__(self):
+        self.buckets = {}
+        self.lastTimestamp = None
+        self.lastChargingWatts = 0
+        self.lastLoadWatts = 0
+
+# onBucket(device, bucket) is called for every finished bucket whose resolution is in resolutions.
+# maxGap:    Readings further apart than this many seconds are not integrated into energy, the data in between is missing.
+# utcOffset: Seconds to add to UTC to get the local time the buckets line up with, defaults to the system's.
+class RollupEngine:
+    def __init__(self, onBucket, resolutions=(MINUTE, HOUR, DAY), maxGap=300, utcOffset=None):
+        self.onBucket = onBucket
+        self.resolutions = frozenset(resolutions)
+        self.maxGap = maxGap
+        self.utcOffset = time.localtime().tm_gmtoff if utcOffset is None else utcOffset
+        self.devices = {}
+
+    def bucketStart(self, timestamp, resolution):
+        local = timestamp + self.utcOffset
+        return local - local % resolution - self.utcOffset
+
+    def add(self, device, snapshot):
+        state = self.devices.get(device)
+        if(state is None):
+            state = self.devices[device] = _DeviceRollup()
+        timestamp = snapshot.timestamp
+        minute = state.buckets.get(MINUTE)
+        if(minute is None):
+            minute = state.buckets[MINUTE] = Bucket(self.bucketStart(timestamp, MINUTE), MINUTE)
+
+        # Energy between the last reading and this one, using the average power of the two.
+        last = state.lastTimestamp
+        if(last is not None and 0 < timestamp - last <= self.maxGap):
+            chargingWh = (state.lastChargingWatts + snapshot.chargingWatts)/2*(timestamp - last)/3600
+            loadWh = (state.lastLoadWatts + snapshot.loadWatts)/2*(timestamp - last)/3600
+            if(timestamp >= minute.end):
+                # Split the energy at the end of the minute.
+                share = (minute.end - last)/(timestamp - last) if last < minute.end else 0
+                minute.chargingWh += chargingWh*share
+                minute.loadWh += loadWh*share
+                chargingWh -= chargingWh*share
+                loadWh -= loadWh*share
+        else:
+            chargingWh = loadWh = 0.0
+
+        if(timestamp >= minute.end):
+            self._close(device, state, MINUTE, minute)
+            minute = state.buckets[MINUTE] = Bucket(self.bucketStart(timestamp, MINUTE), MINUTE)
+            # Hours and days are finished as soon as a reading from after them comes in.
+            for resolution in (HOUR, DAY):
+                parent = state.buckets.get(resolution)
+                if(parent is not None and timestamp >= parent.end):
+                    del state.buckets[resolution]
+                    self._close(device, state, resolution, parent)
+        minute.addSnapshot(snapshot)
+        minute.chargingWh += chargingWh
+        minute.loadWh += loadWh
+
+        state.lastTimestamp = timestamp
+        state.lastChargingWatts = snapshot.chargingWatts
+        state.lastLoadWatts = snapshot.loadWatts
+
+    # Hand a finished bucket out and fold it into the next bigger one.
+    def _close(self, device, state, resolution, bucket):
+        if(resolution in self.resolutions):
+            self.onBucket(device, bucket)
+        bigger = HOUR if resolution == MINUTE else DAY if resolution == HOUR else None
+        if(bigger is None):
+            return
+        start = self.bucketStart(bucket.start, bigger)
+        parent = state.buckets.get(bigger)
+        if(parent is not None and parent.start != start):
+            # Readings stopped for a while, the open bucket is from before this one.
+            self._close(device, state, bigger, parent)
+            parent = None
+        if(parent is None):
+            parent = state.buckets[bigger] = Bucket(start, bigger)
+        parent.merge(bucket)
+
+    # The buckets still being filled for a controller, by resolution.
+    def openBuckets(self, device):
+        state = self.devices.get(device)
+        return {} if state is None else dict(state.buckets)
+
+# Run readings from the history file through a RollupEngine, e.g. to rebuild the rollups for a time range.
+# Readings are streamed, so this works for ranges of any length.
+def rollupHistory(store, onBucket, start=None, end=None, device=None, resolutions=(MINUTE, HOUR, DAY)):
+    engine = RollupEngine(onBucket, resolutions)
+    for name, snapshot in store.query(start, end, device):
+        engine.add(name, snapshot)
+    return engine
@@ -0,0 +1,578 @@
+#!/usr/bin/python
+
+# Cole L - https://github.com/cole8888/SRNE-Solar-Charge-Controller-Monitor
+#
+# Simulated SRNE charge controllers, for trying out and benchmarking the scripts without the hardware.
+#
+# A controller serves the 0x0100 - 0x0122 register block from a profile, either SyntheticProfile (a made up day of
+# sun, battery and load) or TraceProfile (readings recorded in a history file, see SolarStore.py, played back).
+# Answers can be slowed down and made to fail (no answer, bad CRC or a modbus exception) at random.
+#
+# There are two ways to talk to them:
+# - SimulatedBus hands out stand-ins for the pymodbus client, pass bus.client as clientFactory to ModbusConnection
+#   or Poller (see SolarConnection.py and SolarPoller.py). Nothing touches a serial port.
+# - RtuServer speaks modbus RTU (reads, 0x06 and 0x10 writes) on a pseudo terminal, so the scripts can be pointed at it
+#   like a real serial port:
+#     python3 SolarSimulator.py --link /tmp/ttySRNE
+#   and set SERIAL_PORT = '/tmp/ttySRNE' in the script.
+
+import argparse
+import bisect
+import math
+import os
+import random
+import select
+import struct
+import threading
+import time
+import tty
+from SolarDecoder import BASE_ADDRESS, REGISTER_COUNT, REGISTER_MAP, UNSIGNED, FLAG, TEMP_HIGH, TEMP_LOW, CHARGE_MODE, chargeModes
+
+# What happened to a read.
+ANSWERED = "answered"
+NO_ANSWER = "noAnswer"          # The controller stays quiet, the client times out.
+BAD_CRC = "badCrc"              # The answer is corrupted on the wire.
+EXCEPTION = "exception"         # The controller answers with a modbus exception.
+
+# Registers that can be written.
+LOAD_SWITCH = 0x010A
+SETTINGS_START = 0xE000
+SETTINGS_END = 0xE100
+CHARGE_MODE_REGISTER = 32
+
+# Modbus exception codes.
+ILLEGAL_FUNCTION = 1
+ILLEGAL_ADDRESS = 2
+ILLEGAL_VALUE = 3
+DEVICE_FAILURE = 4
+
+# Sign-magnitude temperature byte, the opposite of getRealTemp() in SolarDecoder.py.
+def _tempByte(value):
+    value = int(round(value))
+    if(value < 0):
+        return 0x80 | (min(-value, 127))
+    return min(value, 127)
+
+# Turn a dictionary of values (named like the fields in REGISTER_MAP) into the 35 registers, the opposite of
+# decodeRegisters(). Fields that are left out are 0. loadEnabled sets the load bit in the charging mode register.
+def encodeRegisters(values):
+    registers = [0]*REGISTER_COUNT
+    for register in REGISTER_MAP:
+        if(register.name not in values):
+            continue
+        value = values[register.name]
+        offset = register.address - BASE_ADDRESS
+        if(register.kind == UNSIGNED):
+            raw = int(value) if register.scale == 1 else int(round(value/register.scale))
+            if(register.words == 2):
+                registers[offset] = (raw >> 16) & 0xFFFF
+                registers[offset+1] = raw & 0xFFFF
+            else:
+                registers[offset] = raw & 0xFFFF
+        elif(register.kind == TEMP_HIGH):
+            registers[offset] = (registers[offset] & 0x00FF) | (_tempByte(value) << 8)
+        elif(register.kind == TEMP_LOW):
+            registers[offset] = (registers[offset] & 0xFF00) | _tempByte(value)
+        elif(register.kind == FLAG):
+            registers[offset] = 1 if value else 0
+        elif(register.kind == CHARGE_MODE):
+            mode = chargeModes.index(value) if isinstance(value, str) else int(value)
+            registers[offset] = mode | (0x8000 if values.get("loadEnabled") else 0)
+        else:
+            registers[offset] = int(value) & 0xFFFF
+    return registers
+
+# A 12V system: the panels charge the battery during the day and the load runs off it day and night.
+# speed:      Simulated seconds per real second, e.g. 3600 runs through a day in 24 seconds.
+# start:      Simulated unix time to start at, defaults to now.
+# panelWatts: Charging power at noon on a clear day.
+# loadWatts:  Power drawn by the load while it is on.
+# capacity:   Battery capacity in Ah.
+# faults:     Fault register value to report, e.g. 1 << 2 for "Battery undervoltage warning".
+class SyntheticProfile:
+    def __init__(self, speed=1, start=None, panelWatts=200, loadWatts=30, capacity=100, faults=0, seed=None):
+        self.speed = speed
+        self.origin = time.monotonic()
+        self.start = time.time() if start is None else start
+        self.panelWatts = panelWatts
+        self.loadWatts = loadWatts
+        self.capacity = capacity
+        self.faults = faults
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.last = None
+        self.soc = 60.0
+        self.cloud = 1.0
+        self.day = None
+        self.days = 1
+        self.daily = dict.fromkeys(("chargingAh", "loadAh", "chargingWh", "loadWh", "chargingMaxAmps", "loadMaxAmps", "chargingMaxWatts", "loadMaxWatts"), 0.0)
+        self.daily["batteryMinVolts"] = self.daily["batteryMaxVolts"] = None
+        self.totals = dict.fromkeys(("chargingAh", "loadAh", "chargingWh", "loadWh"), 0.0)
+        self.fullCharges = 0
+        self.overDischarges = 0
+
+    # Simulated unix time.
+    def clock(self):
+        return self.start + (time.monotonic() - self.origin)*self.speed
+
+    # The registers at simulated time now (defaults to clock()). Time only moves forward, earlier times return
+    # the current state.
+    def registers(self, now=None):
+        with self.lock:
+            return encodeRegisters(self._step(self.clock() if now is None else now))
+
+    def _step(self, now):
+        local = time.localtime(now)
+        hour = local.tm_hour + local.tm_min/60 + local.tm_sec/3600
+        sun = max(0.0, math.sin(math.pi*(hour - 6)/12))
+        # Clouds drift slowly rather than jumping from reading to reading.
+        self.cloud = min(1.0, max(0.3, self.cloud + self.random.uniform(-0.05, 0.05)))
+        panelVolts = 0.0 if sun == 0 else 17 + 3*sun + self.random.uniform(-0.2, 0.2)
+        batteryVolts = 11.8 + 1.6*self.soc/100
+        full = self.soc >= 99.5
+        chargingWatts = 0 if full else self.panelWatts*sun*self.cloud
+        chargingAmps = chargingWatts/batteryVolts
+        loadAmps = self.loadWatts/batteryVolts if self.soc > 5 else 0
+        loadWatts = loadAmps*batteryVolts
+
+        if(self.day != local.tm_yday):
+            if(self.day is not None):
+                self.days += 1
+            self.day = local.tm_yday
+            for key in self.daily:
+                self.daily[key] = 0.0
+            self.daily["batteryMinVolts"] = self.daily["batteryMaxVolts"] = None
+
+        if(self.last is not None and now > self.last):
+            hours = (now - self.last)/3600
+            previous = self.soc
+            self.soc = min(100.0, max(0.0, self.soc + (chargingAmps - loadAmps)*hours/self.capacity*100))
+            if(self.soc >= 99.5 and previous < 99.5):
+                self.fullCharges += 1
+            if(self.soc <= 5 and previous > 5):
+                self.overDischarges += 1
+            for key, value in (("chargingAh", chargingAmps*hours), ("loadAh", loadAmps*hours), ("chargingWh", chargingWatts*hours), ("loadWh", loadWatts*hours)):
+                self.daily[key] += value
+                self.totals[key] += value
+        if(self.last is None or now > self.last):
+            self.last = now
+
+        daily = self.daily
+        daily["chargingMaxAmps"] = max(daily["chargingMaxAmps"], chargingAmps)
+        daily["loadMaxAmps"] = max(daily["loadMaxAmps"], loadAmps)
+        daily["chargingMaxWatts"] = max(daily["chargingMaxWatts"], chargingWatts)
+        daily["loadMaxWatts"] = max(daily["loadMaxWatts"], loadWatts)
+        daily["batteryMinVolts"] = batteryVolts if daily["batteryMinVolts"] is None else min(daily["batteryMinVolts"], batteryVolts)
+        daily["batteryMaxVolts"] = batteryVolts if daily["batteryMaxVolts"] is None else max(daily["batteryMaxVolts"], batteryVolts)
+
+        if(sun == 0):
+            mode = "OFF"
+        elif(full):
+            mode = "FLOAT"
+        else:
+            mode = "MPPT"
+        return {
+            "batterySoc": int(self.soc),
+            "batteryVolts": batteryVolts,
+            "chargingAmps": chargingAmps,
+            "controllerTemp": 20 + 15*sun*self.cloud,
+            "batteryTemp": 18 + 5*sun,
+            "loadVolts": batteryVolts if loadAmps else 0,
+            "loadAmps": loadAmps,
+            "loadWatts": int(loadWatts),
+            "panelVolts": panelVolts,
+            "panelAmps": chargingWatts/panelVolts if panelVolts else 0,
+            "chargingWatts": int(chargingWatts),
+            "loadState": loadAmps > 0,
+            "batteryMinVolts": daily["batteryMinVolts"],
+            "batteryMaxVolts": daily["batteryMaxVolts"],
+            "chargingMaxAmps": daily["chargingMaxAmps"],
+            "loadMaxAmps": daily["loadMaxAmps"],
+            "chargingMaxWatts": int(daily["chargingMaxWatts"]),
+            "loadMaxWatts": int(daily["loadMaxWatts"]),
+            "chargingDailyAmpHours": int(daily["chargingAh"]),
+            "loadDailyAmpHours": int(daily["loadAh"]),
+            "chargingDailyPower": daily["chargingWh"]/1000,
+            "loadDailyPower": daily["loadWh"]/1000,
+            "days": self.days,
+            "overDischarges": self.overDischarges,
+            "fullCharges": self.fullCharges,
+            "chargingTotalAmpHours": self.totals["chargingAh"]/1000,
+            "loadTotalAmpHours": self.totals["loadAh"]/1000,
+            "chargingTotalPower": self.totals["chargingWh"]/1000,
+            "loadTotalPower": self.totals["loadWh"]/1000,
+            "chargingMode": mode,
+            "loadEnabled": loadAmps > 0,
+            "faultBits": self.faults,
+        }
+
+# Plays back recorded readings, rows are (timestamp, registers) oldest first.
+# speed: Recorded seconds played per real second.
+# loop:  Start over at the end of the recording, otherwise the last reading is served from then on.
+class TraceProfile:
+    def __init__(self, rows, speed=1, loop=True):
+        if(not rows):
+            raise ValueError("The trace has no readings")
+        self.timestamps = [row[0] for row in rows]
+        self.rows = [tuple(row[1]) for row in rows]
+        self.speed = speed
+        self.loop = loop
+        self.origin = time.monotonic()
+
+    # Load a trace from a history file (see SolarStore.py). The readings are kept in memory, about 350 bytes each.
+    @classmethod
+    def fromHistory(cls, path, device=None, start=None, end=None, speed=1, loop=True):
+        from SolarStore import HistoryStore
+        store = HistoryStore(path, retentionDays=None)
+        try:
+            if(device is None):
+                devices = store.devices()
+                device = devices[0] if devices else None
+            rows = [(timestamp, registers) for name, unit, timestamp, registers in store.queryRegisters(start, end, device)]
+        finally:
+            store.close()
+        return cls(rows, speed, loop)
+
+    # Position in the recording, as a recorded timestamp.
+    def clock(self):
+        span = self.timestamps[-1] - self.timestamps[0]
+        elapsed = (time.monotonic() - self.origin)*self.speed
+        if(self.loop and span > 0):
+            elapsed %= span
+        return self.timestamps[0] + elapsed
+
+    def registers(self, now=None):
+        index = bisect.bisect_right(self.timestamps, self.clock() if now is None else now) - 1
+        return list(self.rows[max(0, index)])
+
+# One simulated charge controller.
+# latency:     Seconds the controller takes to answer, plus up to jitter seconds at random.
+# timeoutRate: Share of reads that go unanswered (0 - 1).
+# crcRate:     Share of answers that are corrupted.
+# errorRate:   Share of reads answered with a modbus exception.
+# Writes to the load switch (0x010A) and the settings block (0xE000 - 0xE0FF) are kept and read back, see SolarControl.py.
+class SimulatedController:
+    def __init__(self, profile, unit=1, latency=0.02, jitter=0, timeoutRate=0, crcRate=0, errorRate=0, seed=None):
+        self.profile = profile
+        self.unit = unit
+        self.latency = latency
+        self.jitter = jitter
+        self.timeoutRate = timeoutRate
+        self.crcRate = crcRate
+        self.errorRate = errorRate
+        self.random = random.Random(seed)
+        self.counts = dict.fromkeys((ANSWERED, NO_ANSWER, BAD_CRC, EXCEPTION), 0)
+        self.settings = {}          # Address: value written to the settings block.
+        self.load = None            # Load switched on / off by a write, None to follow the profile.
+
+    def delay(self):
+        return self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0)
+
+    # Work out the answer to a read of count registers from address.
+    # Returns (outcome, registers or exception code), see the outcomes at the top.
+    def answer(self, address, count):
+        offset = address - BASE_ADDRESS
+        roll = self.random.random()
+        if(roll < self.timeoutRate):
+            outcome, result = NO_ANSWER, None
+        elif(SETTINGS_START <= address and address + count <= SETTINGS_END and count >= 1):
+            outcome, result = ANSWERED, [self.settings.get(address + index, 0) for index in range(count)]
+        elif(offset < 0 or count < 1 or offset + count > REGISTER_COUNT):
+            outcome, result = EXCEPTION, ILLEGAL_ADDRESS
+        elif(roll < self.timeoutRate + self.errorRate):
+            outcome, result = EXCEPTION, DEVICE_FAILURE
+        else:
+            registers = self.profile.registers()
+            if(self.load is not None):
+                registers[LOAD_SWITCH - BASE_ADDRESS] = int(self.load)
+                registers[CHARGE_MODE_REGISTER] = (registers[CHARGE_MODE_REGISTER] & 0x7FFF) | (0x8000 if self.load else 0)
+            registers = registers[offset:offset + count]
+            outcome = BAD_CRC if roll < self.timeoutRate + self.errorRate + self.crcRate else ANSWERED
+            result = registers
+        self.counts[outcome] += 1
+        return outcome, result
+
+    # Work out the answer to a write of values from address, returns (outcome, None or exception code).
+    def answerWrite(self, address, values):
+        if(self.random.random() < self.timeoutRate):
+            outcome, result = NO_ANSWER, None
+        elif(address == LOAD_SWITCH and len(values) == 1 and values[0] in (0, 1)):
+            self.load = bool(values[0])
+            outcome, result = ANSWERED, None
+        elif(SETTINGS_START <= address and address + len(values) <= SETTINGS_END):
+            for index, value in enumerate(values):
+                self.settings[address + index] = value & 0xFFFF
+            outcome, result = ANSWERED, None
+        else:
+            outcome, result = EXCEPTION, ILLEGAL_ADDRESS
+        self.counts[outcome] += 1
+        return outcome, result
+
+# Seconds a request and its answer spend on the wire, 10 bits per byte (start, 8 data, stop).
+def wireTime(requestBytes, answerBytes, baudrate):
+    if(not baudrate):
+        return 0
+    return (requestBytes + answerBytes)*10/baudrate
+
+# Read responses shaped like the ones pymodbus 2.x returns.
+class _Registers:
+    def __init__(self, registers):
+        self.registers = registers
+
+    def isError(self):
+        return False
+
+class _Error:
+    def __init__(self, message):
+        self.message = message
+
+    def isError(self):
+        return True
+
+    def __str__(self):
+        return self.message
+
+_ERROR_MESSAGES = {
+    NO_ANSWER: "Modbus Error: [Input/Output] Modbus Error: [Invalid Message] No response received, expected at least 2 bytes (0 received)",
+    BAD_CRC: "Modbus Error: [Input/Output] Modbus Error: [Invalid Message] Invalid CRC",
+}
+
+# Simulated controllers sharing one serial port, reads take turns like on a real RS485 bus.
+# baudrate: Adds the time the bytes would take on the wire, None for no wire time.
+class SimulatedBus:
+    def __init__(self, controllers, baudrate=9600):
+        self.controllers = {controller.unit: controller for controller in controllers}
+        self.baudrate = baudrate
+        self.lock = threading.Lock()
+        self.downUntil = 0
+
+    # Make the port fail (as if the USB adapter was pulled) for the given number of seconds.
+    def unplug(self, seconds):
+        self.downUntil = time.monotonic() + seconds
+
+    def isUp(self):
+        return time.monotonic() >= self.downUntil
+
+    # Client factory for ModbusConnection, takes the same arguments as ModbusSerialClient.
+    def client(self, **settings):
+        return SimulatedClient(self, settings.get("timeout", 5))
+
+# Stand-in for ModbusSerialClient that reads from a SimulatedBus.
+class SimulatedClient:
+    def __init__(self, bus, timeout=5):
+        self.bus = bus
+        self.timeout = timeout
+        self.connected = False
+
+    def connect(self):
+        self.connected = self.bus.isUp()
+        return self.connected
+
+    def close(self):
+        self.connected = False
+
+    def read_holding_registers(self, address, count, unit=1):
+        if(not self.connected or not self.bus.isUp()):
+            raise OSError("Simulated port is unplugged")
+        with self.bus.lock:
+            controller = self.bus.controllers.get(unit)
+            if(controller is None):
+                outcome, result = NO_ANSWER, None
+            else:
+                outcome, result = controller.answer(address, count)
+            if(outcome == NO_ANSWER):
+                time.sleep(self.timeout)
+                return _Error(_ERROR_MESSAGES[NO_ANSWER])
+            answerBytes = 5 if outcome == EXCEPTION else 5 + 2*count
+            time.sleep(controller.delay() + wireTime(8, answerBytes, self.bus.baudrate))
+        if(outcome == EXCEPTION):
+            return _Error("Exception Response(131, 3, %d)" % result)
+        if(outcome == BAD_CRC):
+            return _Error(_ERROR_MESSAGES[BAD_CRC])
+        return _Registers(result)
+
+    def _write(self, address, values, unit):
+        if(not self.connected or not self.bus.isUp()):
+            raise OSError("Simulated port is unplugged")
+        with self.bus.lock:
+            controller = self.bus.controllers.get(unit)
+            if(controller is None):
+                outcome, result = NO_ANSWER, None
+            else:
+                outcome, result = controller.answerWrite(address, values)
+            if(outcome == NO_ANSWER):
+                time.sleep(self.timeout)
+                return _Error(_ERROR_MESSAGES[NO_ANSWER])
+            time.sleep(controller.delay() + wireTime(9 + 2*len(values), 8, self.bus.baudrate))
+        if(outcome == EXCEPTION):
+            return _Error("Exception Response(134, 6, %d)" % result)
+        return _Registers(list(values))
+
+    def write_register(self, address, value, unit=1):
+        return self._write(address, [value], unit)
+
+    def write_registers(self, address, values, unit=1):
+        return self._write(address, values, unit)
+
+# Modbus CRC16 lookup table.
+def _crcTable():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for bit in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return tuple(table)
+
+_CRC_TABLE = _crcTable()
+
+def crc16(data):
+    crc = 0xFFFF
+    for byte in data:
+        crc = (crc >> 8) ^ _CRC_TABLE[(crc ^ byte) & 0xFF]
+    return crc
+
+# Add the CRC to a frame, low byte first.
+def withCrc(frame):
+    return frame + struct.pack("<H", crc16(frame))
+
+# Length of the request frame at the start of buffer (at least 8 bytes), including the CRC.
+# Reads and single register writes (0x06) are 8 bytes, a multiple register write (0x10) carries its byte count.
+def _frameLength(buffer):
+    if(buffer[1] == 0x10):
+        return 9 + buffer[6]
+    return 8
+
+# Serves simulated controllers as a modbus RTU slave on a pseudo terminal.
+# link: Optional path to create a symlink to the pseudo terminal at, so it has a fixed name.
+class RtuServer:
+    def __init__(self, controllers, link=None, baudrate=9600):
+        self.controllers = {controller.unit: controller for controller in controllers}
+        self.baudrate = baudrate
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.master)
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.link = link
+        if(link is not None):
+            if(os.path.islink(link)):
+                os.unlink(link)
+            os.symlink(self.port, link)
+        self.running = False
+        self.thread = None
+        self.frames = 0
+        self.discarded = 0      # Bytes thrown away because they weren't part of a valid request.
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="rtu-server", daemon=True)
+        self.thread.start()
+        return self
+
+    def _run(self):
+        buffer = b""
+        while self.running:
+            ready = select.select([self.master], [], [], 0.1)[0]
+            if(not ready):
+                # A gap on the line ends a frame, anything left over is garbage.
+                self.discarded += len(buffer)
+                buffer = b""
+                continue
+            try:
+                buffer += os.read(self.master, 256)
+            except OSError:
+                continue
+            while len(buffer) >= 8:
+                length = _frameLength(buffer)
+                if(len(buffer) < length):
+                    break
+                frame = buffer[:length]
+                if(crc16(frame[:-2]) != struct.unpack("<H", frame[-2:])[0]):
+                    # Out of step, drop a byte and look for the start of a frame again.
+                    buffer = buffer[1:]
+                    self.discarded += 1
+                    continue
+                buffer = buffer[length:]
+                self.frames += 1
+                answer = self._handle(frame)
+                if(answer is not None):
+                    os.write(self.master, answer)
+
+    # Answer one request frame, None means no answer.
+    def _handle(self, frame):
+        unit, function, address, count = struct.unpack(">BBHH", frame[:6])
+        controller = self.controllers.get(unit)
+        if(controller is None):
+            return None
+        if(function in (3, 4)):
+            outcome, result = controller.answer(address, count)
+        elif(function == 6):
+            # The second word is the value to write, the answer echoes the request.
+            outcome, result = controller.answerWrite(address, [count])
+        elif(function == 0x10):
+            if(frame[6] != 2*count or count < 1):
+                outcome, result = EXCEPTION, ILLEGAL_VALUE
+            else:
+                outcome, result = controller.answerWrite(address, list(struct.unpack(">%dH" % count, frame[7:-2])))
+        else:
+            outcome, result = EXCEPTION, ILLEGAL_FUNCTION
+        if(outcome == NO_ANSWER):
+            return None
+        if(outcome == EXCEPTION):
+            answer = withCrc(struct.pack(">BBB", unit, function | 0x80, result))
+        elif(function in (6, 0x10)):
+            answer = withCrc(frame[:6])
+        else:
+            answer = withCrc(struct.pack(">BBB%dH" % len(result), unit, function, 2*len(result), *result))
+            if(outcome == BAD_CRC):
+                answer = answer[:-1] + bytes([answer[-1] ^ 0xFF])
+        time.sleep(controller.delay() + wireTime(len(frame), len(answer), self.baudrate))
+        return answer
+
+    def stop(self):
+        self.running = False
+        if(self.thread is not None):
+            self.thread.join()
+        if(self.link is not None and os.path.islink(self.link)):
+            os.unlink(self.link)
+        os.close(self.master)
+        os.close(self.slave)
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate SRNE charge controllers on a pseudo terminal.")
+    parser.add_argument("--link", help="create a symlink to the pseudo terminal at this path, e.g. /tmp/ttySRNE")
+    parser.add_argument("--units", default="1", help="comma separated modbus unit IDs to simulate (default 1)")
+    parser.add_argument("--trace", help="play back the readings from this history file instead of a synthetic day")
+    parser.add_argument("--device", help="controller name to play back from the history file (default the first)")
+    parser.add_argument("--speed", type=float, default=1, help="simulated seconds per real second (default 1)")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds the controller takes to answer (default 0.02)")
+    parser.add_argument("--jitter", type=float, default=0, help="up to this many extra seconds at random (default 0)")
+    parser.add_argument("--timeout-rate", type=float, default=0, help="share of reads that go unanswered, 0 - 1")
+    parser.add_argument("--crc-rate", type=float, default=0, help="share of answers with a bad CRC, 0 - 1")
+    parser.add_argument("--error-rate", type=float, default=0, help="share of reads answered with a modbus exception, 0 - 1")
+    parser.add_argument("--baudrate", type=int, default=9600, help="add the time the bytes take on the wire at this speed, 0 for none")
+    parser.add_argument("--seed", type=int, help="seed for the random numbers, to repeat a run")
+    args = parser.parse_args()
+
+    controllers = []
+    for unit in [int(unit) for unit in args.units.split(",")]:
+        if(args.trace):
+            profile = TraceProfile.fromHistory(args.trace, args.device, speed=args.speed)
+        else:
+            profile = SyntheticProfile(args.speed, seed=args.seed)
+        controllers.append(SimulatedController(
+            profile, unit, args.latency, args.jitter, args.timeout_rate, args.crc_rate, args.error_rate, args.seed
+        ))
+    server = RtuServer(controllers, args.link, args.baudrate).start()
+    print("Serving unit(s) %s on %s" % (args.units, args.link or server.port))
+    try:
+        while True:
+            time.sleep(10)
+            print("Requests:", server.frames, "Bytes discarded:", server.discarded, "Answers:", {c.unit: c.counts for c in controllers})
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+#!/usr/bin/python
+
+# Cole L - https://github.com/cole8888/SRNE-Solar-Charge-Controller-Monitor
+#
+# Measure the monitor itself, to tell whether slow data is down to the serial bus, the Pi or the MQTT broker.
+#
+# - Bus: how long each read of each controller takes (round trip), how busy each serial port is, timeouts, bad
+#   CRCs and other errors, and how long reconnects take. Recorded by ModbusConnection (see SolarConnection.py).
+# - Outputs: how many readings are waiting in each output's queue, how many were dropped, how long each output
+#   takes per reading (e.g. the MQTT publish) and how long a reading waits before it is handled. Recorded by the
+#   sinks in SolarPipeline.py.
+# - CPU time used by the whole process.
+#
+# Stats.collect() gathers all of it into a dictionary, which the scripts publish to <topic>/stats every
+# STATS_INTERVAL seconds. Stats.render() gives the same numbers as Prometheus metrics for SolarExporter.py.
+
+import resource
+import time
+
+# Escape a label value for the metrics page. Kept here rather than in SolarExporter.py so the modules that render
+# metrics don't have to import the HTTP server.
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+# Histogram bucket upper bounds in seconds.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+RECONNECT_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 300, 900)
+
+# Counts observations into buckets, for latencies.
+class Histogram:
+    __slots__ = ("bounds", "counts", "count", "total", "maximum", "mark")
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        # One more bucket than bounds for everything above the last one.
+        self.counts = [0]*(len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        self.mark = (self.counts[:], 0, 0.0)
+
+    def observe(self, value):
+        index = 0
+        bounds = self.bounds
+        while index < len(bounds) and value > bounds[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        if(value > self.maximum):
+            self.maximum = value
+
+    # Estimate the q quantile (0 - 1) from bucket counts, assuming values are spread evenly within a bucket.
+    @staticmethod
+    def _quantile(bounds, counts, count, q, maximum):
+        if(count == 0):
+            return None
+        rank = q*count
+        seen = 0
+        for index, bucketCount in enumerate(counts):
+            if(seen + bucketCount >= rank and bucketCount):
+                lower = bounds[index-1] if index > 0 else 0
+                upper = bounds[index] if index < len(bounds) else maximum
+                return round(lower + (upper - lower)*(rank - seen)/bucketCount, 4)
+            seen += bucketCount
+        return maximum
+
+    def quantile(self, q):
+        return self._quantile(self.bounds, self.counts, self.count, q, self.maximum)
+
+    # Summary of the observations since the last call, for the published stats.
+    def recent(self):
+        counts, count, total = self.mark
+        counts = [now - before for now, before in zip(self.counts, counts)]
+        count = self.count - count
+        total = self.total - total
+        self.mark = (self.counts[:], self.count, self.total)
+        if(count == 0):
+            return {"count": 0}
+        return {
+            "count": count,
+            "mean": round(total/count, 4),
+            "p50": self._quantile(self.bounds, counts, count, 0.5, self.maximum),
+            "p99": self._quantile(self.bounds, counts, count, 0.99, self.maximum),
+        }
+
+    # Prometheus histogram lines (buckets, sum and count) for one set of labels.
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            lines.append('%s_bucket{%s,le="%s"} %d\n' % (name, labels, bound, cumulative))
+        lines.append('%s_bucket{%s,le="+Inf"} %d\n' % (name, labels, self.count))
+        lines.append("%s_sum{%s} %s\n" % (name, labels, round(self.total, 6)))
+        lines.append("%s_count{%s} %d\n" % (name, labels, self.count))
+        return "".join(lines)
+
+# Gathers the numbers from the connections and the pipeline.
+# interval: Seconds between reports, see due().
+class Stats:
+    def __init__(self, interval=60):
+        self.interval = interval
+        self.connections = []
+        self.pipeline = None
+        now = time.monotonic()
+        self.nextReport = now + interval
+        self.lastCollect = now
+        self.lastCpu = time.process_time()
+
+    # names maps the unit IDs on the connection to controller names.
+    def watchConnection(self, connection, names):
+        self.connections.append([connection, dict(names), connection.busy])
+
+    def watchPipeline(self, pipeline):
+        self.pipeline = pipeline
+
+    # True once every interval, when it is time to publish a report.
+    def due(self):
+        now = time.monotonic()
+        if(now < self.nextReport):
+            return False
+        self.nextReport = max(self.nextReport + self.interval, now)
+        return True
+
+    # Everything since the last report, as a dictionary.
+    def collect(self):
+        now = time.monotonic()
+        elapsed = max(now - self.lastCollect, 1e-9)
+        cpu = time.process_time()
+        report = {
+            "timestamp": time.time(),
+            "interval": round(elapsed, 3),
+            "cpu": round((cpu - self.lastCpu)/elapsed, 4),
+            "maxRssKb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            "buses": {},
+            "devices": {},
+            "outputs": {},
+        }
+        self.lastCollect = now
+        self.lastCpu = cpu
+
+        for watched in self.connections:
+            connection, names, busyMark = watched
+            health = connection.health()
+            # Share of the time the port was busy with reads.
+            health["utilization"] = round((connection.busy - busyMark)/elapsed, 4)
+            health["reconnectSeconds"] = connection.reconnectTimes.recent()
+            watched[2] = connection.busy
+            report["buses"][connection.port] = health
+            for unit, histogram in list(connection.latency.items()):
+                report["devices"][names.get(unit, str(unit))] = {"unit": unit, "readSeconds": histogram.recent()}
+
+        if(self.pipeline is not None):
+            depths = self.pipeline.depths()
+            for sink in self.pipeline.sinks:
+                report["outputs"][sink.name] = {
+                    "queued": depths.get(sink.name, 0),
+                    "dropped": sink.dropped,
+                    "handleSeconds": sink.handleTimes.recent(),
+                    "waitSeconds": sink.waitTimes.recent(),
+                }
+        return report
+
+    # The numbers as Prometheus metrics, returns (OpenMetrics text, Prometheus text) for MetricsExporter.updateExtra().
+    def render(self):
+        families = []
+
+        def family(name, kind, text, samples):
+            if(samples):
+                families.append((name, kind, text, "".join(samples)))
+
+        readSeconds = []
+        busy = []
+        reads = []
+        retries = []
+        errors = []
+        reconnects = []
+        reconnectSeconds = []
+        for connection, names, busyMark in self.connections:
+            port = 'port="%s"' % _label(connection.port)
+            for unit, histogram in list(connection.latency.items()):
+                labels = 'device="%s",unit="%d"' % (_label(names.get(unit, unit)), unit)
+                readSeconds.append(histogram.render("srne_modbus_read_seconds", labels))
+            busy.append("srne_modbus_busy_seconds_total{%s} %s\n" % (port, round(connection.busy, 6)))
+            reads.append("srne_modbus_reads_total{%s} %d\n" % (port, connection.reads))
+            retries.append("srne_modbus_retries_total{%s} %d\n" % (port, connection.retried))
+            for kind, count in connection.errors.items():
+                errors.append('srne_modbus_errors_total{%s,kind="%s"} %d\n' % (port, kind, count))
+            reconnects.append("srne_modbus_reconnects_total{%s} %d\n" % (port, connection.reconnects))
+            reconnectSeconds.append(connection.reconnectTimes.render("srne_modbus_reconnect_seconds", port))
+        family("srne_modbus_read_seconds", "histogram", "Round trip time of successful reads.", readSeconds)
+        family("srne_modbus_busy_seconds", "counter", "Time the serial port spent on reads, rate() gives the utilization.", busy)
+        family("srne_modbus_reads", "counter", "Reads started.", reads)
+        family("srne_modbus_retries", "counter", "Reads tried again after a timeout or bad CRC.", retries)
+        family("srne_modbus_errors", "counter", "Failed read attempts by kind.", errors)
+        family("srne_modbus_reconnects", "counter", "Times the serial port was opened again.", reconnects)
+        family("srne_modbus_reconnect_seconds", "histogram", "Time from losing the serial port to having it back.", reconnectSeconds)
+
+        if(self.pipeline is not None):
+            depths = self.pipeline.depths()
+            queued = []
+            dropped = []
+            handleSeconds = []
+            waitSeconds = []
+            for sink in self.pipeline.sinks:
+                labels = 'output="%s"' % _label(sink.name)
+                queued.append("srne_output_queued{%s} %d\n" % (labels, depths.get(sink.name, 0)))
+                dropped.append("srne_output_dropped_total{%s} %d\n" % (labels, sink.dropped))
+                handleSeconds.append(sink.handleTimes.render("srne_output_handle_seconds", labels))
+                waitSeconds.append(sink.waitTimes.render("srne_output_wait_seconds", labels))
+            family("srne_output_queued", "gauge", "Readings waiting for the output.", queued)
+            family("srne_output_dropped", "counter", "Readings dropped because the output fell behind.", dropped)
+            family("srne_output_handle_seconds", "histogram", "Time the output took per reading, e.g. to publish it.", handleSeconds)
+            family("srne_output_wait_seconds", "histogram", "Time a reading waited in the queue before it was handled.", waitSeconds)
+        family("srne_process_cpu_seconds", "counter", "CPU time used by the monitor.", ["srne_process_cpu_seconds_total %s\n" % round(time.process_time(), 3)])
+
+        openMetrics = []
+        prometheus = []
+        for name, kind, text, samples in families:
+            # Prometheus text names the counter family after its samples, OpenMetrics without the _total.
+            openMetrics.append("# HELP %s %s\n# TYPE %s %s\n%s" % (name, text, name, kind, samples))
+            promName = name + "_total" if kind == "counter" else name
+            prometheus.append("# HELP %s %s\n# TYPE %s %s\n%s" % (promName, text, promName, kind, samples))
+        return "".join(openMetrics).encode(), "".join(prometheus).encode()
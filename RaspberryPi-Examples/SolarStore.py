@@ -0,0 +1,197 @@
+#!/usr/bin/python
+
+# Cole L - https://github.com/cole8888/SRNE-Solar-Charge-Controller-Monitor
+#
+# Keep a local history of the controller readings in an SQLite file.
+#
+# Each reading is stored as the 35 raw registers (70 bytes) with the controller name and timestamp, so the history
+# costs about 100 bytes per reading and decodes into the same Snapshot as a live read. The database runs in WAL mode
+# and readings are written in batches, so the SD card sees a few small sequential writes instead of one per poll.
+# A power cut can lose at most the batch that hasn't been written yet, never the file. A batch is also written once
+# it is flushInterval seconds old, so readings don't sit in memory when the controller stops answering.
+#
+# Readings older than the retention period are deleted as new ones come in. SQLite reuses the freed pages, so once
+# the retention period is reached the file stops growing, like a ring buffer.
+#
+# The same file also holds the minute / hour / day rollups (see SolarRollup.py). Minute rollups are kept as long as
+# the readings, hour and day rollups are kept forever since there are so few of them.
+
+import json
+import sqlite3
+import struct
+import threading
+import time
+from SolarDecoder import REGISTER_COUNT, decodeRegisters
+
+# The registers are stored big endian, the same as they come off the wire.
+_REGISTERS = struct.Struct(">%dH" % REGISTER_COUNT)
+
+# Number of rows fetched from SQLite at a time when querying, keeps memory use flat for long ranges.
+QUERY_CHUNK = 500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS readings (
+    device TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    unit INTEGER NOT NULL,
+    registers BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS readingsTimestamp ON readings (timestamp);
+CREATE TABLE IF NOT EXISTS rollups (
+    device TEXT NOT NULL,
+    resolution INTEGER NOT NULL,
+    start REAL NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (device, resolution, start)
+);
+"""
+
+def packRegisters(registers):
+    return _REGISTERS.pack(*registers)
+
+def unpackRegisters(blob):
+    return _REGISTERS.unpack(blob)
+
+# Open an SQLite file with the settings used for all the local files (history, outbox, ...).
+def openDatabase(path):
+    connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    connection.execute("PRAGMA journal_mode=WAL")
+    # With WAL, NORMAL only syncs on checkpoints. The file stays consistent after a power cut, the last
+    # transactions may be lost.
+    connection.execute("PRAGMA synchronous=NORMAL")
+    return connection
+
+# path:          SQLite file to store the readings in.
+# retentionDays: Readings older than this are deleted, None keeps everything.
+# batchSize:     Number of readings buffered in memory before they are written.
+# flushInterval: Maximum number of seconds a reading stays in memory before it is written.
+class HistoryStore:
+    def __init__(self, path, retentionDays=30, batchSize=20, flushInterval=60):
+        self.path = path
+        self.retention = None if retentionDays is None else retentionDays*86400
+        self.batchSize = batchSize
+        self.flushInterval = flushInterval
+        self.lock = threading.Lock()
+        self.pending = []
+        self.pendingRollups = []
+        self.lastFlush = time.monotonic()
+        self.lastPrune = 0
+        self.connection = openDatabase(path)
+        self.connection.executescript(_SCHEMA)
+        self.stopping = threading.Event()
+        self.flusher = threading.Thread(target=self._flushLoop, name="history-flush", daemon=True)
+        self.flusher.start()
+
+    # Add a reading, it is written once the batch is full or flushInterval has passed.
+    def add(self, device, snapshot):
+        with self.lock:
+            self.pending.append((device, snapshot.timestamp, snapshot.unit, packRegisters(snapshot.registers)))
+            if(len(self.pending) >= self.batchSize or time.monotonic() - self.lastFlush >= self.flushInterval):
+                self._flush()
+
+    # Add a finished rollup bucket (see SolarRollup.py), written with the next batch of readings.
+    def addRollup(self, device, bucket):
+        with self.lock:
+            self.pendingRollups.append((device, bucket.resolution, bucket.start, json.dumps(bucket.toDict(), separators=(",", ":"))))
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    # Write the batch once it is flushInterval old, even if no more readings come in to fill it.
+    def _flushLoop(self):
+        while not self.stopping.wait(max(self.lastFlush + self.flushInterval - time.monotonic(), 1)):
+            try:
+                with self.lock:
+                    if(time.monotonic() - self.lastFlush >= self.flushInterval):
+                        self._flush()
+            except sqlite3.Error as e:
+                print("Could not write the history file:", e)
+
+    def _flush(self):
+        self.lastFlush = time.monotonic()
+        if(not self.pending and not self.pendingRollups):
+            return
+        with self.connection:
+            self.connection.execute("BEGIN")
+            self.connection.executemany("INSERT INTO readings (device, timestamp, unit, registers) VALUES (?, ?, ?, ?)", self.pending)
+            self.connection.executemany("INSERT OR REPLACE INTO rollups (device, resolution, start, data) VALUES (?, ?, ?, ?)", self.pendingRollups)
+            # Pruning at most once an hour is plenty, the deleted pages get reused by the next inserts.
+            now = time.time()
+            if(self.retention is not None and now - self.lastPrune >= 3600):
+                self.connection.execute("DELETE FROM readings WHERE timestamp < ?", (now - self.retention,))
+                self.connection.execute("DELETE FROM rollups WHERE resolution = 60 AND start < ?", (now - self.retention,))
+                self.lastPrune = now
+        self.pending = []
+        self.pendingRollups = []
+
+    def close(self):
+        self.stopping.set()
+        self.flusher.join()
+        with self.lock:
+            self._flush()
+            self.connection.close()
+
+    # Raw rows as (device, unit, timestamp, registers) between start and end (unix timestamps, inclusive),
+    # oldest first. Anything not yet flushed is written first so it shows up.
+    def queryRegisters(self, start=None, end=None, device=None):
+        self.flush()
+        sql = "SELECT device, unit, timestamp, registers FROM readings WHERE timestamp >= ? AND timestamp <= ?"
+        params = [0 if start is None else start, float("inf") if end is None else end]
+        if(device is not None):
+            sql += " AND device = ?"
+            params.append(device)
+        # Long queries get their own connection, WAL lets them read while the poller keeps writing.
+        reader = sqlite3.connect(self.path)
+        try:
+            cursor = reader.execute(sql + " ORDER BY timestamp", params)
+            while True:
+                rows = cursor.fetchmany(QUERY_CHUNK)
+                if(not rows):
+                    break
+                for name, unit, timestamp, registers in rows:
+                    yield name, unit, timestamp, unpackRegisters(registers)
+        finally:
+            reader.close()
+
+    # Decoded readings as (device, Snapshot) between start and end, oldest first.
+    def query(self, start=None, end=None, device=None):
+        for name, unit, timestamp, registers in self.queryRegisters(start, end, device):
+            yield name, decodeRegisters(registers, unit, timestamp)
+
+    # Rollups of one resolution (60, 3600 or 86400 seconds) as (device, dictionary) between start and end, oldest first.
+    def queryRollups(self, resolution, start=None, end=None, device=None):
+        self.flush()
+        sql = "SELECT device, data FROM rollups WHERE resolution = ? AND start >= ? AND start <= ?"
+        params = [resolution, 0 if start is None else start, float("inf") if end is None else end]
+        if(device is not None):
+            sql += " AND device = ?"
+            params.append(device)
+        reader = sqlite3.connect(self.path)
+        try:
+            cursor = reader.execute(sql + " ORDER BY start", params)
+            while True:
+                rows = cursor.fetchmany(QUERY_CHUNK)
+                if(not rows):
+                    break
+                for name, data in rows:
+                    yield name, json.loads(data)
+        finally:
+            reader.close()
+
+    # The most recent reading for a controller as a Snapshot, None if there are none.
+    def latest(self, device):
+        with self.lock:
+            self._flush()
+            row = self.connection.execute(
+                "SELECT unit, timestamp, registers FROM readings WHERE device = ? ORDER BY timestamp DESC LIMIT 1", (device,)
+            ).fetchone()
+        if(row is None):
+            return None
+        return decodeRegisters(unpackRegisters(row[2]), row[0], row[1])
+
+    # Names of the controllers in the history.
+    def devices(self):
+        with self.lock:
+            self._flush()
+            return [row[0] for row in self.connection.execute("SELECT DISTINCT device FROM readings ORDER BY device")]
@@ -0,0 +1,42 @@
+# Cole L - https://github.com/cole8888/SRNE-Solar-Charge-Controller-Monitor
+#
+# Run with: python -m pytest test_SolarEnergy.py
+
+from SolarDecoder import REGISTER_COUNT
+from SolarEnergy import EnergyAccounts
+from SolarReadPlan import ReadPlan, TIERED_BLOCKS, FULL_BLOCKS
+
+# Charge at a steady power for a while and feed every cycle of the read plan to the accounts, the way the pollers do.
+def _charge(blocks, watts=1000, seconds=3600, interval=3):
+    plan = ReadPlan(blocks, interval, None)
+    accounts = EnergyAccounts()
+    controller = [0]*REGISTER_COUNT
+    for now in range(0, seconds + 1, interval):
+        wattHours = watts*now//3600
+        controller[28] = wattHours >> 16      # Lifetime charging Wh.
+        controller[29] = wattHours & 0xFFFF
+        controller[19] = wattHours            # Daily charging Wh.
+        for offset, count in plan.due(now):
+            plan.update(offset, controller[offset:offset+count], now)
+        accounts.update("CC1", plan.snapshot(timestamp=now))
+    return accounts
+
+def test_tiered_plan_counts_all_the_energy():
+    accounts = _charge(TIERED_BLOCKS)
+    totals = accounts.device("CC1")
+    # The lifetime registers are last read at 3600 s, so the whole hour is counted.
+    assert totals["chargingWh"] == 1000
+    assert totals["resets"] == 0
+
+def test_tiered_plan_matches_full_plan():
+    assert _charge(TIERED_BLOCKS).site() == _charge(FULL_BLOCKS).site()
+
+def test_garbled_read_is_a_reset():
+    accounts = _charge(TIERED_BLOCKS, seconds=600)
+    snapshot = ReadPlan(FULL_BLOCKS).snapshot(timestamp=603)
+    registers = list(snapshot.registers)
+    registers[28] = 0x7FFF                    # Far more than 20 kWh/h since the last change.
+    registers[19] = 170
+    snapshot.registers = registers
+    assert accounts.update("CC1", snapshot)[2] == 4     # From the daily counter, 166 Wh at 600 s.
+    assert accounts.device("CC1")["resets"] == 1